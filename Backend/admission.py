@@ -0,0 +1,224 @@
+"""
+Admission control for the chat endpoints
+
+A chat passes two checks before it does any work:
+- load shedding: when CHAT_MAX_QUEUE chats of this worker already wait for
+  one of its CHAT_MAX_CONCURRENCY LLM slots, it is refused with 503
+- a token bucket per user_id holding CHAT_USER_BURST chats, refilled at
+  CHAT_USER_RATE_PER_MINUTE; an empty bucket refuses it with 429
+An admitted chat that finds every slot busy waits at most
+CHAT_QUEUE_TIMEOUT_SECONDS for one and is then refused with 503, rather than
+queueing until the client or a proxy gives up. Every refusal carries a
+Retry-After: the time until the user's next token, or the expected wait for
+a slot from the recent time calls hold one.
+
+Buckets live in the worker process unless RATE_LIMIT_REDIS_URL points at
+Redis, where a Lua script takes tokens atomically for every worker. The
+in-process store has the same interface and stands in for Redis in
+development; when Redis fails, chats are let through. Every decision is
+counted for /api/stats/admission and /metrics.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Tuple
+
+from backend import metrics
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Buckets kept by the in-process store, least recently used dropped first
+# (a dropped bucket starts full again)
+MAX_LOCAL_BUCKETS = 100_000
+
+BUSY_DETAIL = "The server is busy, please retry shortly"
+
+# Decision -> count: admitted, rate_limited, shed_queue_full, shed_queue_timeout, limiter_error
+decisions: Counter = Counter()
+
+class AdmissionRejected(Exception):
+    """A chat refused by admission control"""
+    
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+    
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+class LocalBucketStore:
+    """Token buckets in this process"""
+    
+    name = "local"
+    
+    def __init__(self, max_buckets: int = MAX_LOCAL_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        """Take a token; (taken, seconds until the next token when not)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return taken, 0.0 if taken else (1 - tokens) / rate
+
+# KEYS[1]: bucket; ARGV: refill per second, burst. Uses the Redis clock so
+# workers with skewed clocks agree; idle buckets expire once full again.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local taken = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {taken, tostring(wait)}
+"""
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through Redis (needs the redis package)"""
+    
+    name = "redis"
+    
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+    
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        taken, wait = await self._script(keys=[f"chat_rate:{key}"], args=[rate, burst])
+        return bool(int(taken)), float(wait)
+
+def create_bucket_store(redis_url: str):
+    if redis_url:
+        try:
+            return RedisBucketStore(redis_url)
+        except ImportError:
+            logger.warning("redis is not installed; chat rate limits are kept per worker")
+    return LocalBucketStore()
+
+class LLMSlots:
+    """
+    At most `capacity` LLM calls in flight in this worker; up to max_queue
+    more chats wait for a slot, each for at most `timeout` seconds
+    """
+    
+    def __init__(self, capacity: int, max_queue: int, timeout: float):
+        self.capacity = max(1, capacity)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(self.capacity)
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long a call holds its slot
+        self.average_hold_seconds = 1.0
+    
+    def expected_wait(self) -> float:
+        """Seconds until a slot frees up for a chat joining the queue now"""
+        return (self.waiting + 1) / self.capacity * self.average_hold_seconds
+    
+    def check(self):
+        """Refuse a new chat while the queue for slots is full"""
+        if self.waiting >= self.max_queue and self.in_flight >= self.capacity:
+            decisions["shed_queue_full"] += 1
+            raise AdmissionRejected(503, BUSY_DETAIL, self.expected_wait())
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold an LLM slot; AdmissionRejected when none frees up within the timeout"""
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            decisions["shed_queue_timeout"] += 1
+            raise AdmissionRejected(503, BUSY_DETAIL, self.expected_wait()) from None
+        finally:
+            self.waiting -= 1
+        metrics.CHAT_LLM_SLOT_WAIT_SECONDS.observe(time.perf_counter() - started)
+        self.in_flight += 1
+        held = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self.average_hold_seconds += 0.1 * (time.perf_counter() - held - self.average_hold_seconds)
+
+class ChatAdmission:
+    """Load shedding on the LLM slot queue plus the per-user token buckets"""
+    
+    def __init__(self, slots: LLMSlots, store, rate_per_minute: float, burst: int):
+        self.slots = slots
+        self.store = store
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1, burst)
+    
+    async def admit(self, user_id: int):
+        """Raise AdmissionRejected unless the user's chat may start now"""
+        # Shed before taking a token so a refused chat costs the user nothing
+        self.slots.check()
+        if self.rate_per_minute > 0:
+            try:
+                taken, wait = await self.store.take(str(user_id), self.rate_per_minute / 60, self.burst)
+            except Exception as e:
+                logger.warning("Chat rate limiter failed, admitting the chat: %s", type(e).__name__)
+                decisions["limiter_error"] += 1
+                taken = True
+            if not taken:
+                decisions["rate_limited"] += 1
+                raise AdmissionRejected(429, "Too many messages, please slow down", wait)
+        decisions["admitted"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "decisions": dict(decisions),
+            "llm_slots": {
+                "capacity": self.slots.capacity,
+                "in_flight": self.slots.in_flight,
+                "waiting": self.slots.waiting,
+                "max_queue": self.slots.max_queue,
+                "queue_timeout_seconds": self.slots.timeout,
+                "average_hold_seconds": round(self.slots.average_hold_seconds, 3)
+            },
+            "user_rate_limit": {
+                "backend": self.store.name,
+                "per_minute": self.rate_per_minute,
+                "burst": self.burst
+            }
+        }
+
+llm_slots = LLMSlots(settings.CHAT_MAX_CONCURRENCY, settings.CHAT_MAX_QUEUE, settings.CHAT_QUEUE_TIMEOUT_SECONDS)
+chat_admission = ChatAdmission(
+    llm_slots,
+    create_bucket_store(settings.RATE_LIMIT_REDIS_URL),
+    settings.CHAT_USER_RATE_PER_MINUTE,
+    settings.CHAT_USER_BURST
+)
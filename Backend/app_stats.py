@@ -0,0 +1,216 @@
+"""
+Materialized application statistics for /api/stats
+
+Counting users, conversations and messages with COUNT(*) on every call scans
+each table. Instead the counts live in stats_counters and stats_daily and are
+brought up to date incrementally: rows of the append-only tables above a
+counter's high-water id are counted with a primary key range scan and
+grouped by day. Products can be deleted, so they are recounted, but only
+when the catalogue change log has moved. Active conversations and users
+(conversations updated within STATS_ACTIVE_HOURS) are counted on the
+updated_at index.
+
+Each API worker runs refresh_forever(), which refreshes the snapshot every
+STATS_REFRESH_SECONDS in a thread unless another worker just did; requests
+only read_snapshot(), a handful of rows, reporting when it was taken.
+Rows younger than STATS_SETTLE_SECONDS, and everything after the first of
+them, wait for a later refresh so ids still being committed are not skipped.
+Workers may refresh at the same time: each counter update is conditional on
+the high-water id it started from, and the refresh that loses is rolled back.
+    
+    python -m backend.app_stats --rebuild
+"""
+import argparse
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Counter name -> (model, creation timestamp column); the name is also the stats_daily column
+APPEND_ONLY = {
+    "users": (models.User, models.User.created_at),
+    "conversations": (models.Conversation, models.Conversation.created_at),
+    "messages": (models.Message, models.Message.timestamp),
+}
+PRODUCTS = "products"
+ACTIVE_CONVERSATIONS = "active_conversations"
+ACTIVE_USERS = "active_users"
+
+def _as_date(value: Any) -> date:
+    # SQLite returns date() as text
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _advance(db: Session, counters: Dict[str, models.StatsCounter], name: str, value_change, high_water_id: int,
+             now: datetime, absolute: bool = False) -> bool:
+    """
+    Move a counter forward from the high-water id it was read at; False if
+    another refresh moved it first
+    """
+    counter = counters.get(name)
+    if counter is None:
+        db.add(models.StatsCounter(name=name, value=value_change, high_water_id=high_water_id, refreshed_at=now))
+        return True
+    result = db.execute(
+        update(models.StatsCounter)
+        .where(models.StatsCounter.name == name, models.StatsCounter.high_water_id == counter.high_water_id)
+        .values(
+            value=value_change if absolute else models.StatsCounter.value + value_change,
+            high_water_id=high_water_id,
+            refreshed_at=now
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def refresh(db: Session, now: Optional[datetime] = None) -> bool:
+    """Bring the snapshot up to date; False when a concurrent refresh got there first"""
+    now = now or datetime.now(timezone.utc)
+    settled = now - timedelta(seconds=settings.STATS_SETTLE_SECONDS)
+    counters = {c.name: c for c in db.execute(select(models.StatsCounter)).scalars().all()}
+    daily: Dict[date, Counter] = defaultdict(Counter)
+    advanced = True
+    
+    for name, (model, created) in APPEND_ONLY.items():
+        high_water = counters[name].high_water_id if name in counters else 0
+        new_rows = model.id > high_water
+        unsettled = db.execute(select(func.min(model.id)).where(new_rows, created >= settled)).scalar()
+        if unsettled is not None:
+            new_rows = new_rows & (model.id < unsettled)
+        day = func.date(created)
+        rows = db.execute(select(day, func.count(), func.max(model.id)).where(new_rows).group_by(day)).all()
+        for row_day, count, _ in rows:
+            if row_day is not None:
+                daily[_as_date(row_day)][name] += count
+        top = max((max_id for _, _, max_id in rows), default=high_water)
+        advanced &= _advance(db, counters, name, sum(count for _, count, _ in rows), top, now)
+    
+    # Products are recounted only when the catalogue change log has moved
+    position = db.execute(select(func.coalesce(func.max(models.CatalogChange.id), 0))).scalar()
+    products = counters.get(PRODUCTS)
+    if products is None or products.high_water_id != position:
+        count = db.execute(select(func.count()).select_from(models.Product)).scalar()
+        advanced &= _advance(db, counters, PRODUCTS, count, position, now, absolute=True)
+    else:
+        advanced &= _advance(db, counters, PRODUCTS, 0, position, now)
+    
+    since = now - timedelta(hours=settings.STATS_ACTIVE_HOURS)
+    active, active_users = db.execute(
+        select(func.count(), func.count(models.Conversation.user_id.distinct()))
+        .where(models.Conversation.updated_at >= since)
+    ).one()
+    for name, value in ((ACTIVE_CONVERSATIONS, active), (ACTIVE_USERS, active_users)):
+        high_water = counters[name].high_water_id if name in counters else 0
+        advanced &= _advance(db, counters, name, value, high_water, now, absolute=True)
+    
+    if not advanced:
+        db.rollback()
+        return False
+    
+    for row_day, counts in daily.items():
+        result = db.execute(
+            update(models.StatsDaily)
+            .where(models.StatsDaily.day == row_day)
+            .values(**{name: getattr(models.StatsDaily, name) + counts[name] for name in APPEND_ONLY})
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.add(models.StatsDaily(day=row_day, **{name: counts[name] for name in APPEND_ONLY}))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker created the same counter or day first
+        db.rollback()
+        return False
+    return True
+
+def read_snapshot(db: Session) -> Dict[str, Any]:
+    """The stored statistics with the last STATS_DAYS days and the snapshot age"""
+    counters = {c.name: c for c in db.execute(select(models.StatsCounter)).scalars().all()}
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=settings.STATS_DAYS - 1)
+    days = db.execute(
+        select(models.StatsDaily).where(models.StatsDaily.day >= first_day).order_by(models.StatsDaily.day)
+    ).scalars().all()
+    refreshed = [_as_utc(c.refreshed_at) for c in counters.values() if c.refreshed_at is not None]
+    refreshed_at = min(refreshed) if refreshed else None
+    snapshot = {name: int(counters[name].value) if name in counters else 0 for name in (
+        "users", PRODUCTS, "conversations", "messages", ACTIVE_CONVERSATIONS, ACTIVE_USERS
+    )}
+    snapshot.update(
+        active_window_hours=settings.STATS_ACTIVE_HOURS,
+        per_day=[
+            {"date": row.day.isoformat(), "users": row.users, "conversations": row.conversations, "messages": row.messages}
+            for row in days
+        ],
+        refreshed_at=refreshed_at.isoformat() if refreshed_at else None,
+        age_seconds=round((datetime.now(timezone.utc) - refreshed_at).total_seconds(), 1) if refreshed_at else None
+    )
+    return snapshot
+
+def refresh_if_stale(session_factory, max_age: float) -> bool:
+    """Refresh unless the snapshot is younger than max_age seconds; True when refreshed"""
+    db = session_factory()
+    try:
+        age = read_snapshot(db)["age_seconds"]
+        if age is not None and age < max_age:
+            return False
+        return refresh(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def refresh_forever(session_factory, interval: float):
+    """Background task: refresh the snapshot every `interval` seconds off the event loop"""
+    while True:
+        try:
+            # A little short of the interval, so workers polling in step still refresh
+            await asyncio.to_thread(refresh_if_stale, session_factory, interval * 0.9)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error refreshing statistics")
+        await asyncio.sleep(interval)
+
+def rebuild(db: Session):
+    """Drop the snapshot and count everything again"""
+    db.execute(delete(models.StatsCounter))
+    db.execute(delete(models.StatsDaily))
+    db.commit()
+    refresh(db)
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or rebuild the materialized statistics")
+    parser.add_argument("--rebuild", action="store_true", help="Recount everything from scratch")
+    args = parser.parse_args()
+    
+    from backend.database import SessionLocal, create_tables
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            rebuild(db)
+        else:
+            refresh(db)
+        snapshot = read_snapshot(db)
+    finally:
+        db.close()
+    print(", ".join(f"{name}={snapshot[name]}" for name in ("users", PRODUCTS, "conversations", "messages", ACTIVE_CONVERSATIONS)))
+
+if __name__ == "__main__":
+    main()
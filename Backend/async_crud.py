@@ -0,0 +1,205 @@
+"""
+Async CRUD operations used by the non-blocking chat pipeline
+"""
+from dataclasses import dataclass
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Sequence, Tuple
+from backend import models, query_parser, schemas, search
+from backend.config import settings
+from backend.database import AsyncSessionLocal
+from backend.group_commit import GroupCommitter
+
+# Product operations
+async def search_products(db: AsyncSession, query: str, limit: int = 20, offset: int = 0) -> List[models.Product]:
+    """Full-text search over name, category, brand and description, best matches first"""
+    return await find_products(db, query_parser.parse_query(query), limit=limit, offset=offset)
+
+async def find_products(
+    db: AsyncSession,
+    parsed: query_parser.ParsedQuery,
+    limit: int = 20,
+    offset: int = 0
+) -> List[models.Product]:
+    """Ranked search for a parsed query, with its brand, category, price, rating and stock filters"""
+    if parsed.is_empty:
+        return []
+    
+    async def run(terms):
+        stmt = search.build_search_statement(
+            db.bind.dialect.name,
+            terms,
+            limit=limit,
+            offset=offset,
+            brands=parsed.brands,
+            categories=parsed.categories,
+            min_price=parsed.min_price,
+            max_price=parsed.max_price,
+            min_rating=parsed.min_rating,
+            in_stock=parsed.in_stock
+        )
+        result = await db.execute(stmt)
+        return list(result.scalars().all())
+    
+    products = await run(parsed.terms)
+    # Leftover keywords can be too specific ("Samsung phones" vs "smartphone");
+    # the structured filters alone are still a useful answer
+    if not products and parsed.terms and parsed.has_filters:
+        products = await run([])
+    return products
+
+async def get_products_by_ids(
+    db: AsyncSession,
+    product_ids: List[int],
+    parsed: Optional[query_parser.ParsedQuery] = None
+) -> List[models.Product]:
+    """Products with the given IDs, in that order, restricted by the query's filters"""
+    if not product_ids:
+        return []
+    stmt = select(models.Product).where(models.Product.id.in_(product_ids))
+    if parsed is not None:
+        stmt = search.apply_filters(
+            stmt, parsed.brands, parsed.categories, parsed.min_price, parsed.max_price,
+            parsed.min_rating, parsed.in_stock
+        )
+    result = await db.execute(stmt)
+    by_id = {product.id: product for product in result.scalars().all()}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+async def get_brands_and_categories(db: AsyncSession) -> Tuple[List[str], List[str]]:
+    """Distinct non-empty brands and categories in the catalogue"""
+    brands = await db.execute(
+        select(models.Product.brand).where(models.Product.brand.is_not(None)).distinct()
+    )
+    categories = await db.execute(
+        select(models.Product.category).where(models.Product.category.is_not(None)).distinct()
+    )
+    return list(brands.scalars().all()), list(categories.scalars().all())
+
+# User operations
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    """Get a user by ID"""
+    return await db.get(models.User, user_id)
+
+# Conversation operations
+async def get_conversation(db: AsyncSession, conversation_id: int) -> Optional[models.Conversation]:
+    """Get a conversation by ID"""
+    return await db.get(models.Conversation, conversation_id)
+
+async def update_conversation_title(db: AsyncSession, conversation_id: int, title: str):
+    """Set a conversation's title without touching updated_at"""
+    await db.execute(
+        update(models.Conversation)
+        .where(models.Conversation.id == conversation_id)
+        .values(title=title, updated_at=models.Conversation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+# Message operations
+async def get_conversation_messages(db: AsyncSession, conversation_id: int, after_id: int = 0) -> List[models.Message]:
+    """Get messages for a conversation in chronological order, optionally only those after a message ID"""
+    stmt = select(models.Message).filter(models.Message.conversation_id == conversation_id)
+    if after_id:
+        stmt = stmt.filter(models.Message.id > after_id)
+    result = await db.execute(stmt.order_by(models.Message.timestamp, models.Message.id))
+    return list(result.scalars().all())
+
+# Chat turn persistence
+@dataclass
+class ChatTurn:
+    """A user message and its AI reply; conversation_id None starts a conversation"""
+    user_id: int
+    conversation_id: Optional[int]
+    title: str
+    user_content: str
+    ai_content: str
+    summary_update: Optional[Tuple[str, int]] = None
+
+async def save_chat_turn(
+    db: AsyncSession,
+    user_id: int,
+    conversation_id: Optional[int],
+    title: str,
+    user_content: str,
+    ai_content: str,
+    summary_update: Optional[Tuple[str, int]] = None
+) -> Tuple[int, schemas.Message, schemas.Message]:
+    """
+    Persist one chat turn in a single transaction (see write_chat_turns).
+    With MESSAGE_GROUP_COMMIT the transaction is shared with concurrent
+    turns and this returns once it has committed.
+    """
+    turn = ChatTurn(user_id, conversation_id, title, user_content, ai_content, summary_update)
+    if settings.MESSAGE_GROUP_COMMIT:
+        return await chat_turn_committer.submit(turn)
+    return (await write_chat_turns(db, [turn]))[0]
+
+async def write_chat_turns(
+    db: AsyncSession,
+    turns: Sequence[ChatTurn]
+) -> List[Tuple[int, schemas.Message, schemas.Message]]:
+    """
+    Write chat turns and commit: create new conversations in one statement,
+    touch continued ones (storing any rolling summary), then insert every
+    user and AI message in one statement. Ids and timestamps come back via
+    RETURNING, so nothing is re-read after the commit.
+    """
+    conversation_ids = [turn.conversation_id for turn in turns]
+    new = [index for index, turn in enumerate(turns) if turn.conversation_id is None]
+    if new:
+        result = await db.execute(
+            insert(models.Conversation).returning(models.Conversation.id, sort_by_parameter_order=True),
+            [{"user_id": turns[index].user_id, "title": turns[index].title} for index in new]
+        )
+        for index, conversation_id in zip(new, result.scalars().all()):
+            conversation_ids[index] = conversation_id
+    
+    touched = [turn.conversation_id for turn in turns if turn.conversation_id is not None and turn.summary_update is None]
+    if touched:
+        await db.execute(
+            update(models.Conversation)
+            .where(models.Conversation.id.in_(touched))
+            .values(updated_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+    for turn in turns:
+        if turn.conversation_id is not None and turn.summary_update is not None:
+            summary, summary_until_message_id = turn.summary_update
+            await db.execute(
+                update(models.Conversation)
+                .where(models.Conversation.id == turn.conversation_id)
+                .values(updated_at=func.now(), summary=summary, summary_until_message_id=summary_until_message_id)
+                .execution_options(synchronize_session=False)
+            )
+    
+    rows = []
+    for conversation_id, turn in zip(conversation_ids, turns):
+        rows.append({"conversation_id": conversation_id, "content": turn.user_content, "is_user_message": True})
+        rows.append({"conversation_id": conversation_id, "content": turn.ai_content, "is_user_message": False})
+    result = await db.execute(
+        insert(models.Message).returning(
+            models.Message.id, models.Message.timestamp, sort_by_parameter_order=True
+        ),
+        rows
+    )
+    saved = result.all()
+    await db.commit()
+    
+    messages = [
+        schemas.Message(id=row.id, timestamp=row.timestamp, **data)
+        for row, data in zip(saved, rows)
+    ]
+    return [
+        (conversation_id, messages[2 * index], messages[2 * index + 1])
+        for index, conversation_id in enumerate(conversation_ids)
+    ]
+
+# Concurrent chat turns written by one transaction (MESSAGE_GROUP_COMMIT)
+chat_turn_committer = GroupCommitter(
+    write_chat_turns,
+    AsyncSessionLocal,
+    settings.MESSAGE_GROUP_COMMIT_WINDOW_MS / 1000,
+    settings.MESSAGE_GROUP_COMMIT_MAX_BATCH,
+    name="chat_turns"
+)
@@ -0,0 +1,345 @@
+"""
+Background jobs for work that does not belong on the request path
+
+Handlers are registered per job kind and receive the job's JSON payload;
+they must be safe to run more than once. submit() only enqueues, so a chat
+turn returns as soon as its messages are saved. BACKGROUND_WORKERS tasks per
+worker process run the queued jobs, and a job that raises is retried with
+exponential backoff up to BACKGROUND_MAX_ATTEMPTS times. A job submitted
+with a key is skipped while another job with that key is still queued.
+
+The in-process queue is bounded. Jobs that do not fit, and jobs still queued,
+running or waiting to retry at shutdown, are saved to the background_jobs
+table. Every worker process polls the table and claims jobs from it with a
+lease, so saved jobs run later, possibly elsewhere, instead of being lost.
+Jobs out of attempts stay in the table with their last error.
+
+drain() waits until nothing is queued, running, waiting to retry or being
+saved, so tests and benchmarks can check the effects of jobs
+deterministically.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, or_, select, update
+
+from backend import metrics, models
+from backend.config import settings
+from backend.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Jobs claimed from the table per poll when the queue is unbounded
+CLAIM_BATCH = 100
+
+@dataclass(eq=False)
+class Job:
+    kind: str
+    payload: Dict[str, Any]
+    key: Optional[str] = None
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    # background_jobs row of a job claimed from the table
+    row_id: Optional[int] = None
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+class JobRunner:
+    """Bounded in-process job queue with worker tasks, retries and a durable overflow table"""
+    
+    def __init__(self, workers: int, queue_size: int, max_attempts: int, retry_seconds: float):
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_seconds = retry_seconds
+        self._handlers: Dict[str, Handler] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(0, queue_size))
+        self._keys = set()
+        self._running = set()
+        self._waiting: Dict[Job, asyncio.TimerHandle] = {}
+        self._saving = set()
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Jobs queued, running, waiting to retry or being saved
+        self._outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.outcomes: Dict[str, Counter] = defaultdict(Counter)
+    
+    def register(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+    
+    def submit(self, kind: str, payload: Dict[str, Any], key: Optional[str] = None):
+        """Queue a job; may be called from any thread"""
+        job = Job(kind, payload, key)
+        loop = self._loop
+        if loop is not None and _running_loop() is not loop:
+            loop.call_soon_threadsafe(self._enqueue, job)
+        else:
+            self._enqueue(job)
+    
+    def _busy(self, change: int):
+        self._outstanding += change
+        if self._outstanding:
+            self._idle.clear()
+        else:
+            self._idle.set()
+    
+    def _enqueue(self, job: Job):
+        if job.key is not None and job.key in self._keys:
+            self.outcomes[job.kind]["deduplicated"] += 1
+            return
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._save_later([job])
+            return
+        if job.key is not None:
+            self._keys.add(job.key)
+        self._busy(1)
+    
+    def _save_later(self, jobs: List[Job], error: Optional[str] = None):
+        """Write jobs to the table in a task of their own"""
+        if _running_loop() is None:
+            logger.warning("Dropping %d background jobs: no event loop to save them from", len(jobs))
+            return
+        self._busy(1)
+        task = asyncio.ensure_future(self._save(jobs, error))
+        self._saving.add(task)
+        
+        def done(task):
+            self._saving.discard(task)
+            self._busy(-1)
+        task.add_done_callback(done)
+    
+    async def _save(self, jobs: Sequence[Job], error: Optional[str] = None):
+        """Insert jobs into the table, or release the claim on those that came from it"""
+        failed_at = datetime.now(timezone.utc) if error is not None else None
+        try:
+            async with AsyncSessionLocal() as db:
+                new = [job for job in jobs if job.row_id is None]
+                if new:
+                    await db.execute(insert(models.BackgroundJob), [
+                        {
+                            "kind": job.kind,
+                            "payload": json.dumps(job.payload),
+                            "attempts": job.attempts,
+                            "failed_at": failed_at,
+                            "last_error": error
+                        }
+                        for job in new
+                    ])
+                for job in jobs:
+                    if job.row_id is not None:
+                        await db.execute(
+                            update(models.BackgroundJob)
+                            .where(models.BackgroundJob.id == job.row_id)
+                            .values(claimed_at=None, attempts=job.attempts, failed_at=failed_at, last_error=error)
+                        )
+                await db.commit()
+        except Exception:
+            logger.exception("Error saving %d background jobs; they are lost", len(jobs))
+            return
+        if error is None:
+            for job in jobs:
+                self.outcomes[job.kind]["saved"] += 1
+    
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+    
+    async def _run(self, job: Job):
+        if job.key is not None:
+            self._keys.discard(job.key)
+        metrics.BACKGROUND_JOB_WAIT_SECONDS.observe(time.perf_counter() - job.enqueued_at, kind=job.kind)
+        job.attempts += 1
+        self._running.add(job)
+        started = time.perf_counter()
+        outcome = "cancelled"
+        try:
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"No handler for background job kind {job.kind!r}")
+            await handler(job.payload)
+            outcome = "succeeded"
+            if job.row_id is not None:
+                await self._delete(job.row_id)
+        except asyncio.CancelledError:
+            # Shutdown saves the job to the table
+            raise
+        except Exception as e:
+            outcome = self._retry_or_fail(job, e)
+        finally:
+            if outcome != "cancelled":
+                self._running.discard(job)
+                self._busy(-1)
+                self.outcomes[job.kind][outcome] += 1
+                metrics.BACKGROUND_JOB_SECONDS.observe(time.perf_counter() - started, kind=job.kind, outcome=outcome)
+    
+    async def _delete(self, row_id: int):
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(models.BackgroundJob).where(models.BackgroundJob.id == row_id))
+                await db.commit()
+        except Exception:
+            # The lease expires and the job runs again
+            logger.exception("Error deleting finished background job %s", row_id)
+    
+    def _retry_or_fail(self, job: Job, error: Exception) -> str:
+        if job.attempts < self.max_attempts:
+            delay = self.retry_seconds * 2 ** (job.attempts - 1)
+            logger.warning(
+                "Background job %s failed (attempt %d of %d), retrying in %.1fs: %s",
+                job.kind, job.attempts, self.max_attempts, delay, type(error).__name__
+            )
+            self._busy(1)
+            self._waiting[job] = asyncio.get_running_loop().call_later(delay, self._requeue, job)
+            return "retried"
+        logger.error("Background job %s failed after %d attempts", job.kind, job.attempts, exc_info=error)
+        self._save_later([job], error=f"{type(error).__name__}: {error}")
+        return "failed"
+    
+    def _requeue(self, job: Job):
+        self._waiting.pop(job, None)
+        job.enqueued_at = time.perf_counter()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._save_later([job])
+            self._busy(-1)
+    
+    async def claim(self) -> int:
+        """Move claimable jobs from the table into the queue while it has room; the number moved"""
+        room = self._queue.maxsize - self._queue.qsize() if self._queue.maxsize else CLAIM_BATCH
+        if room <= 0:
+            return 0
+        now = datetime.now(timezone.utc)
+        lease_expired = now - timedelta(seconds=settings.BACKGROUND_LEASE_SECONDS)
+        table = models.BackgroundJob
+        claimed = []
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(table)
+                .where(
+                    table.failed_at.is_(None),
+                    table.attempts < self.max_attempts,
+                    or_(table.claimed_at.is_(None), table.claimed_at < lease_expired)
+                )
+                .order_by(table.id)
+                .limit(room)
+            )).scalars().all()
+            for row in rows:
+                # Another worker process may claim the same row; only one update matches
+                unchanged = table.claimed_at.is_(None) if row.claimed_at is None else table.claimed_at == row.claimed_at
+                result = await db.execute(
+                    update(table)
+                    .where(table.id == row.id, unchanged)
+                    .values(claimed_at=now, attempts=table.attempts + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    claimed.append(Job(row.kind, json.loads(row.payload), attempts=row.attempts, row_id=row.id))
+            await db.commit()
+        for job in claimed:
+            self._enqueue(job)
+        return len(claimed)
+    
+    async def _poll(self, interval: float):
+        while True:
+            try:
+                await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error claiming background jobs")
+            await asyncio.sleep(interval)
+    
+    def start(self, poll_seconds: float = 0):
+        """Start the workers, and polling of the table every poll_seconds (0: never)"""
+        self._loop = asyncio.get_running_loop()
+        # The queue and idle event bind to the loop that first waits on them;
+        # start afresh in this one, keeping jobs submitted before start
+        queued = []
+        while not self._queue.empty():
+            queued.append(self._queue.get_nowait())
+        self._queue = asyncio.Queue(maxsize=self._queue.maxsize)
+        for job in queued:
+            self._queue.put_nowait(job)
+        self._idle = asyncio.Event()
+        if not self._outstanding:
+            self._idle.set()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if poll_seconds > 0:
+            self._tasks.append(asyncio.create_task(self._poll(poll_seconds)))
+    
+    async def stop(self, timeout: float):
+        """Give outstanding jobs up to `timeout` seconds, then save the rest to the table"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        
+        left = list(self._running)
+        self._running.clear()
+        for job, handle in self._waiting.items():
+            handle.cancel()
+            left.append(job)
+        self._waiting.clear()
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait())
+            self._queue.task_done()
+        self._keys.clear()
+        if left:
+            logger.info("Saving %d unfinished background jobs", len(left))
+            await self._save(left)
+        await asyncio.gather(*self._saving, return_exceptions=True)
+        self._outstanding = 0
+        self._idle.set()
+    
+    async def drain(self, durable: bool = False):
+        """
+        Wait until no job is queued, running, waiting to retry or being saved;
+        with durable, also run the claimable jobs of the table. Needs start().
+        """
+        while True:
+            await self._idle.wait()
+            if not durable or not await self.claim():
+                return
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "running": len(self._running),
+            "retrying": len(self._waiting),
+            "max_attempts": self.max_attempts,
+            "jobs": {kind: dict(outcomes) for kind, outcomes in sorted(self.outcomes.items())}
+        }
+
+job_runner = JobRunner(
+    settings.BACKGROUND_WORKERS,
+    settings.BACKGROUND_QUEUE_SIZE,
+    settings.BACKGROUND_MAX_ATTEMPTS,
+    settings.BACKGROUND_RETRY_SECONDS
+)
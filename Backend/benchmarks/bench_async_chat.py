@@ -0,0 +1,123 @@
+"""
+Benchmark: concurrent /api/chat throughput of a single worker
+
+Starts a stub LLM server and one uvicorn worker running backend.main:app on a
+temporary SQLite database, then drives increasing numbers of concurrent chats
+while probing /health to show the event loop stays responsive.
+
+    python -m backend.benchmarks.bench_async_chat --latency-ms 500 --levels 1,16,64,256
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from backend.benchmarks.harness import (
+    find_free_port, percentile, start_app_process, start_stub_process, stop_processes
+)
+
+async def run_level(base_url: str, user_id: int, concurrency: int, total: int):
+    """
+    Send `total` chats with at most `concurrency` in flight, probing /health meanwhile
+    """
+    chat_latencies = []
+    health_latencies = []
+    errors = 0
+    done = asyncio.Event()
+    limits = httpx.Limits(max_connections=concurrency + 8, max_keepalive_connections=concurrency + 8)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def one_chat(i: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/chat", json={"user_id": user_id, "message": f"Do you have laptops? #{i}"})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                chat_latencies.append(time.perf_counter() - started)
+        
+        async def probe_health():
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    await client.get("/health")
+                    health_latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.05)
+        
+        probe = asyncio.create_task(probe_health())
+        started = time.perf_counter()
+        await asyncio.gather(*(one_chat(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe
+    
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": total / elapsed,
+        "chat_p50_ms": statistics.median(chat_latencies) * 1000,
+        "chat_p95_ms": percentile(chat_latencies, 95) * 1000,
+        "health_p50_ms": statistics.median(health_latencies) * 1000 if health_latencies else 0.0,
+        "health_max_ms": max(health_latencies) * 1000 if health_latencies else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat benchmark against a stub LLM")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Stub LLM completion latency")
+    parser.add_argument("--levels", default="1,16,64,128", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=0, help="Chats per level (default: 4x the level)")
+    parser.add_argument("--max-concurrency", type=int, default=256, help="CHAT_MAX_CONCURRENCY for the worker")
+    args = parser.parse_args()
+    
+    # Settings are read at import time, so configure the environment first
+    tmpdir = tempfile.mkdtemp(prefix="bench_chat_")
+    llm_port = find_free_port()
+    app_port = find_free_port()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ.setdefault("XAI_API_KEY", "stub-key")
+    os.environ["CHAT_MAX_CONCURRENCY"] = str(args.max_concurrency)
+    
+    from backend import crud, schemas
+    from backend.database import SessionLocal, create_tables
+    
+    create_tables()
+    db = SessionLocal()
+    try:
+        user_id = crud.create_user(db, schemas.UserCreate(username="bench_user")).id
+    finally:
+        db.close()
+    
+    processes = [
+        start_stub_process(llm_port, "--latency-ms", str(args.latency_ms)),
+        start_app_process(app_port, dict(os.environ)),
+    ]
+    base_url = f"http://127.0.0.1:{app_port}"
+    
+    try:
+        print(f"Stub LLM latency: {args.latency_ms:.0f} ms, CHAT_MAX_CONCURRENCY={args.max_concurrency}")
+        print(f"{'conc':>6} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'health p50':>11} {'health max':>11}")
+        for level in [int(x) for x in args.levels.split(",")]:
+            result = asyncio.run(run_level(base_url, user_id, level, args.requests or level * 4))
+            print(
+                f"{result['concurrency']:>6} {result['requests']:>6} {result['errors']:>4} "
+                f"{result['throughput_rps']:>8.1f} {result['chat_p50_ms']:>8.0f} {result['chat_p95_ms']:>8.0f} "
+                f"{result['health_p50_ms']:>11.1f} {result['health_max_ms']:>11.1f}"
+            )
+    finally:
+        stop_processes(processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: streaming bulk loader versus the previous per-row loader
+
+Scales backend/sample_products.csv up to --rows rows (unique SKUs), then loads
+it into a fresh SQLite database (or --database-url) with:
+- the previous path: a Pydantic model and crud.create_product (commit +
+  refresh) per row, on the first --legacy-rows rows
+- bulk_load.load_products with chunked upserts (COPY on PostgreSQL)
+
+    python -m backend.benchmarks.bench_bulk_load --rows 1000000 --legacy-rows 20000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_products.csv")
+
+def write_scaled_csv(path: str, rows: int):
+    """Repeat the sample catalogue with unique SKUs until it has `rows` rows"""
+    with open(SAMPLE_CSV, "r", encoding="utf-8", newline="") as file:
+        reader = csv.DictReader(file)
+        fieldnames = reader.fieldnames
+        sample = list(reader)
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(rows):
+            row = dict(sample[i % len(sample)])
+            row["sku"] = f"{row['sku']}-{i // len(sample)}"
+            writer.writerow(row)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk loader benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000, help="Rows loaded through the old per-row path")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--database-url", default="", help="Use this database instead of a temporary SQLite file")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    
+    from backend import bulk_load, crud, models, schemas
+    from backend.database import SessionLocal, create_tables, engine
+    
+    create_tables()
+    csv_path = os.path.join(tmpdir, "products.csv")
+    write_scaled_csv(csv_path, args.rows)
+    print(f"Wrote {args.rows} rows to {csv_path}")
+    
+    # Previous loader: Pydantic model + commit/refresh per row
+    legacy_rows = min(args.legacy_rows, args.rows)
+    db = SessionLocal()
+    started = time.perf_counter()
+    try:
+        with open(csv_path, "r", encoding="utf-8", newline="") as file:
+            for i, row in enumerate(csv.DictReader(file)):
+                if i >= legacy_rows:
+                    break
+                product = bulk_load.parse_product_row(row)
+                crud.create_product(db, schemas.ProductCreate(**product))
+    finally:
+        db.close()
+    legacy_seconds = time.perf_counter() - started
+    
+    with engine.begin() as conn:
+        conn.execute(models.Product.__table__.delete())
+    
+    report = bulk_load.load_products(csv_path, chunk_size=args.chunk_size, verbose=False)
+    
+    print(f"{'loader':<12} {'rows':>10} {'seconds':>9} {'rows/s':>10}")
+    print(f"{'per-row':<12} {legacy_rows:>10} {legacy_seconds:>9.2f} {legacy_rows / legacy_seconds:>10,.0f}")
+    print(f"{'bulk':<12} {report.rows:>10} {report.seconds:>9.2f} {report.rows_per_second:>10,.0f}")
+
+if __name__ == "__main__":
+    main()
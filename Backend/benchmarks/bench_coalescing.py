@@ -0,0 +1,117 @@
+"""
+Benchmark: bursts of identical first-turn questions on a cold response cache
+
+Each burst sends the same question from --burst users at once, as happens
+when a promoted product draws the same first question within milliseconds.
+The bursts run against a worker with LLM_COALESCE off and on, reporting the
+upstream LLM calls made, latency, and that every request still saved its own
+reply.
+
+    python -m backend.benchmarks.bench_coalescing --bursts 10 --burst 50 --latency-ms 800
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from backend.benchmarks.harness import (
+    find_free_port, percentile, start_app_process, start_stub_process, stop_processes
+)
+from backend.benchmarks.synthetic import generate_question
+
+async def run_bursts(base_url: str, questions, user_ids):
+    latencies = []
+    ai_message_ids = set()
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        
+        async def one(user_id: int, question: str):
+            nonlocal errors
+            started = time.perf_counter()
+            response = await client.post("/api/chat", json={"user_id": user_id, "message": question})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+                return
+            ai_message_ids.add(response.json()["ai_message"]["id"])
+        
+        started = time.perf_counter()
+        for question in questions:
+            await asyncio.gather(*(one(user_id, question) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        llm = (await client.get("/api/stats/llm")).json()
+        coalescing = (await client.get("/api/stats/response-cache")).json()["coalescing"]
+    upstream = sum(p["tiers"]["default"]["calls_total"] for p in llm["providers"].values())
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "saved_replies": len(ai_message_ids),
+        "upstream_calls": upstream,
+        "coalesced": coalescing["coalesced"],
+        "seconds": elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Identical-question bursts with and without LLM call coalescing")
+    parser.add_argument("--bursts", type=int, default=10, help="Distinct questions, sent one burst after another")
+    parser.add_argument("--burst", type=int, default=50, help="Concurrent requests per burst")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Stub LLM completion latency")
+    parser.add_argument("--seed", type=int, default=20)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    questions = [generate_question(rng) for _ in range(args.bursts)]
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_coalescing_")
+    llm_port = find_free_port()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ.setdefault("XAI_API_KEY", "stub-key")
+    # Titles are separate calls per conversation; leave them out of the count
+    os.environ["LLM_TITLE_GENERATION"] = "False"
+    
+    from backend import bulk_load, crud, schemas
+    from backend.database import SessionLocal, create_tables, engine
+    
+    create_tables()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    bulk_load.load_products(os.path.join(os.path.dirname(__file__), "..", "sample_products.csv"), verbose=False)
+    db = SessionLocal()
+    try:
+        user_ids = [crud.create_user(db, schemas.UserCreate(username=f"bench_{i}")).id for i in range(args.burst)]
+    finally:
+        db.close()
+    
+    stub = start_stub_process(llm_port, "--latency-ms", str(args.latency_ms))
+    modes = [
+        ("no coalescing", {"LLM_COALESCE": "False"}),
+        ("coalescing", {"LLM_COALESCE": "True"}),
+    ]
+    try:
+        print(f"{args.bursts} bursts of {args.burst} identical questions, stub LLM latency {args.latency_ms:.0f} ms")
+        print(f"{'mode':>14} {'requests':>9} {'err':>4} {'replies':>8} {'upstream':>9} {'coalesced':>10} {'seconds':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, env in modes:
+            app_port = find_free_port()
+            # A fresh worker per mode starts with an empty response cache
+            app = start_app_process(app_port, {**os.environ, **env})
+            try:
+                result = asyncio.run(run_bursts(f"http://127.0.0.1:{app_port}", questions, user_ids))
+            finally:
+                stop_processes([app])
+            print(
+                f"{name:>14} {result['requests']:>9} {result['errors']:>4} {result['saved_replies']:>8} "
+                f"{result['upstream_calls']:>9} {result['coalesced']:>10} {result['seconds']:>8.1f} "
+                f"{result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f}"
+            )
+    finally:
+        stop_processes([stub])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: prompt tokens per LLM call against conversation length
+
+Replays a synthetic conversation turn by turn and compares the prompt size of
+sending the full history (the previous behaviour) with the token-budgeted
+context window plus rolling summary.
+
+    python -m backend.benchmarks.bench_context_window --turns 500 --budget 3000
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from backend import context_window
+
+USER_WORDS = "do you have any wireless headphones laptops under budget with good battery life for travel and work".split()
+AI_WORDS = "sure here are some options that match what you described including price availability and ratings from our catalogue".split()
+
+def synthetic_message(rng: random.Random, message_id: int, is_user_message: bool):
+    words = USER_WORDS if is_user_message else AI_WORDS
+    length = rng.randint(10, 40) if is_user_message else rng.randint(60, 200)
+    return SimpleNamespace(
+        id=message_id,
+        is_user_message=is_user_message,
+        content=" ".join(rng.choice(words) for _ in range(length))
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt tokens versus conversation length")
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--budget", type=int, default=3000)
+    parser.add_argument("--summary-tokens", type=int, default=500)
+    args = parser.parse_args()
+    
+    rng = random.Random(41)
+    system_prompt = "You are a helpful e-commerce assistant. " * 20
+    product_context = "Available products:\n" + "\n".join(f"- Product {i} - $99.99 - Rating 4.5/5" for i in range(5))
+    checkpoints = {t for t in (1, 5, 10, 25, 50, 100, 200, 500, 1000, 2000) if t <= args.turns} | {args.turns}
+    
+    history = []
+    summary = None
+    pending = []  # messages not yet folded into the summary
+    build_seconds = 0.0
+    print(f"{'turns':>6} {'full history tokens':>20} {'budgeted tokens':>16} {'summary tokens':>15}")
+    for turn in range(1, args.turns + 1):
+        current = synthetic_message(rng, len(history) + 1, True)
+        full = [{"role": "system", "content": system_prompt}]
+        full += [{"role": "user" if m.is_user_message else "assistant", "content": m.content} for m in history]
+        full += [{"role": "user", "content": current.content}, {"role": "system", "content": f"Relevant product information: {product_context}"}]
+        
+        started = time.perf_counter()
+        candidates = pending
+        while True:
+            messages, evicted = context_window.build_context(
+                system_prompt, candidates, current.content, args.budget,
+                summary=summary, product_context=product_context
+            )
+            if not evicted:
+                break
+            summary = context_window.extend_summary(summary, evicted, args.summary_tokens)
+            candidates = candidates[len(evicted):]
+        pending = candidates
+        build_seconds += time.perf_counter() - started
+        
+        if turn in checkpoints:
+            print(
+                f"{turn:>6} {context_window.count_message_tokens(full):>20} "
+                f"{context_window.count_message_tokens(messages):>16} {context_window.count_tokens(summary or ''):>15}"
+            )
+        
+        reply = synthetic_message(rng, len(history) + 2, False)
+        history += [current, reply]
+        pending = pending + [current, reply]
+    
+    print(f"Average context build time: {build_seconds / args.turns * 1000:.3f} ms per turn")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: chat turn inserts, one transaction per turn versus group commit
+
+--writers concurrent tasks each save --turns chat turns, one after another
+as a request would (every --new-every'th turn starts a new conversation,
+the rest continue the writer's conversation). The same workload runs with a
+commit per turn and through a GroupCommitter at each window, reporting
+throughput, save latency and batch sizes, then checks every message was
+stored once and in order.
+
+    python -m backend.benchmarks.bench_group_commit --writers 64 --turns 50 --windows 1,2,5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from backend.benchmarks.harness import percentile
+
+async def run_mode(committer, writers: int, turns: int, new_every: int, conversation_ids, label: str):
+    from sqlalchemy import func, select
+    from backend import async_crud, models
+    from backend.database import AsyncSessionLocal
+    
+    latencies = []
+    
+    async def writer(index: int):
+        conversation_id = conversation_ids[index]
+        for turn_number in range(turns):
+            turn = async_crud.ChatTurn(
+                user_id=index + 1,
+                conversation_id=None if turn_number % new_every == new_every - 1 else conversation_id,
+                title="Conversation",
+                user_content=f"{label} {index} {turn_number} question",
+                ai_content=f"{label} {index} {turn_number} answer"
+            )
+            started = time.perf_counter()
+            if committer is None:
+                async with AsyncSessionLocal() as db:
+                    await async_crud.write_chat_turns(db, [turn])
+            else:
+                await committer.submit(turn)
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(index) for index in range(writers)))
+    elapsed = time.perf_counter() - started
+    
+    # Every message once, and each writer's conversation in submission order
+    async with AsyncSessionLocal() as db:
+        stored = (await db.execute(
+            select(func.count()).select_from(models.Message).where(models.Message.content.like(f"{label} %"))
+        )).scalar_one()
+        assert stored == writers * turns * 2, (stored, writers * turns * 2)
+        for index in range(writers):
+            contents = (await db.execute(
+                select(models.Message.content)
+                .where(models.Message.conversation_id == conversation_ids[index], models.Message.content.like(f"{label} %"))
+                .order_by(models.Message.id)
+            )).scalars().all()
+            numbers = [int(content.split()[2]) for content in contents]
+            assert numbers == sorted(numbers), f"conversation {conversation_ids[index]} out of order"
+    return {
+        "turns_per_second": writers * turns / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn commits versus group commit for chat turn inserts")
+    parser.add_argument("--writers", type=int, default=64, help="Concurrent writers")
+    parser.add_argument("--turns", type=int, default=50, help="Turns saved by each writer")
+    parser.add_argument("--new-every", type=int, default=5, help="Every n-th turn starts a new conversation")
+    parser.add_argument("--windows", default="1,2,5", help="Group commit windows in milliseconds")
+    parser.add_argument("--max-batch", type=int, default=200)
+    parser.add_argument("--database-url", default="", help="Use this database instead of a temporary SQLite file")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_group_commit_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    
+    from sqlalchemy import insert
+    from backend import async_crud, models
+    from backend.database import AsyncSessionLocal, create_tables, engine
+    from backend.group_commit import GroupCommitter
+    
+    create_tables()
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"username": f"group_commit_{i}"} for i in range(args.writers)])
+        conversation_ids = [
+            conn.execute(insert(models.Conversation).values(user_id=i + 1, title="Conversation")).inserted_primary_key[0]
+            for i in range(args.writers)
+        ]
+    
+    modes = [("per-turn commit", None)]
+    for window_ms in (float(window) for window in args.windows.split(",")):
+        modes.append((f"group {window_ms:g} ms", GroupCommitter(
+            async_crud.write_chat_turns, AsyncSessionLocal, window_ms / 1000, args.max_batch, name="bench"
+        )))
+    
+    print(f"{args.writers} writers x {args.turns} turns on {engine.dialect.name}")
+    print(f"{'mode':<16} {'turns/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'batches':>8} {'avg batch':>10}")
+    for label_index, (name, committer) in enumerate(modes):
+        result = asyncio.run(run_mode(committer, args.writers, args.turns, args.new_every, conversation_ids, f"m{label_index}"))
+        stats = committer.stats() if committer is not None else {"batches": args.writers * args.turns, "average_batch": 1.0}
+        print(
+            f"{name:<16} {result['turns_per_second']:>9.0f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {stats['batches']:>8} {stats['average_batch']:>10.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
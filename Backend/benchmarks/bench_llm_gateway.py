@@ -0,0 +1,132 @@
+"""
+Benchmark: LLM gateway against a plain client under injected provider faults
+
+Starts the stub LLM in its own process and, for each fault scenario, sends the
+same batch of completions through a default AsyncOpenAI client (as the chat
+service used before the gateway) and through LLMGateway, reporting success
+rate and latency percentiles. Faults are switched through /admin/faults.
+
+    python -m backend.benchmarks.bench_llm_gateway --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from backend.benchmarks.harness import find_free_port, percentile, start_stub_process, stop_processes
+
+# name -> faults applied to the stub for the scenario
+SCENARIOS = {
+    "healthy": {},
+    "errors": {"error_rate": 0.2, "error_status": 503},
+    "slow_tail": {"slow_rate": 0.05, "slow_ms": 3000},
+    "stalls": {"hang_rate": 0.05, "hang_seconds": 20},
+    "outage": {"error_rate": 1.0, "error_status": 503},
+}
+
+async def run_batch(complete, total: int, concurrency: int):
+    """Send `total` completions with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await complete(model="stub", messages=[{"role": "user", "content": f"Request {i}"}], max_tokens=50)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return {
+        "elapsed": time.perf_counter() - started,
+        "success": (total - failures) / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+async def run_scenario(base_url: str, admin_url: str, faults: dict, args) -> dict:
+    from openai import AsyncOpenAI
+    from backend.llm_gateway import LLMGateway
+    
+    results = {}
+    async with httpx.AsyncClient() as admin:
+        await admin.post(admin_url, json={"error_rate": 0, "hang_rate": 0, "slow_rate": 0, **faults})
+    
+    plain = AsyncOpenAI(base_url=base_url, api_key="stub-key")
+    results["plain"] = await run_batch(plain.chat.completions.create, args.requests, args.concurrency)
+    await plain.close()
+    
+    gateway = LLMGateway(
+        base_url=base_url,
+        api_key="stub-key",
+        connect_timeout=1.0,
+        read_timeout=args.read_timeout,
+        total_timeout=args.total_timeout,
+        hedge=args.hedge,
+        hedge_min_delay=0.05,
+        breaker_failure_rate=args.breaker_failure_rate,
+        breaker_reset=args.breaker_reset,
+        http2=False
+    )
+    # Warm the latency window so the hedging deadline exists from the start
+    async with httpx.AsyncClient() as admin:
+        await admin.post(admin_url, json={"error_rate": 0, "hang_rate": 0, "slow_rate": 0})
+    await run_batch(gateway.complete, 40, args.concurrency)
+    async with httpx.AsyncClient() as admin:
+        await admin.post(admin_url, json={"error_rate": 0, "hang_rate": 0, "slow_rate": 0, **faults})
+    before = gateway.stats()
+    results["gateway"] = await run_batch(gateway.complete, args.requests, args.concurrency)
+    after = gateway.stats()
+    results["gateway"].update(
+        retries=after["retries"] - before["retries"],
+        hedged=after["hedged"] - before["hedged"],
+        rejected=after["circuit_rejected"] - before["circuit_rejected"],
+    )
+    await gateway.aclose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM gateway resilience benchmark against a fault-injecting stub")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.2)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--read-timeout", type=float, default=2.0, help="Gateway read timeout (s)")
+    parser.add_argument("--total-timeout", type=float, default=10.0, help="Gateway deadline per call (s)")
+    parser.add_argument("--no-hedge", dest="hedge", action="store_false")
+    parser.add_argument("--breaker-failure-rate", type=float, default=0.5)
+    parser.add_argument("--breaker-reset", type=float, default=30.0)
+    args = parser.parse_args()
+    
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    port = find_free_port()
+    stub = start_stub_process(port, "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma))
+    base_url = f"http://127.0.0.1:{port}/v1"
+    admin_url = f"http://127.0.0.1:{port}/admin/faults"
+    
+    try:
+        print(f"Stub latency {args.latency_ms:.0f} ms (sigma {args.latency_sigma}), {args.requests} requests at concurrency {args.concurrency}")
+        print(f"{'scenario':<10} {'client':<8} {'ok %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'total s':>8} {'retries':>8} {'hedged':>7} {'rejected':>9}")
+        for name in args.scenarios.split(","):
+            results = asyncio.run(run_scenario(base_url, admin_url, SCENARIOS[name], args))
+            for client, r in results.items():
+                print(
+                    f"{name:<10} {client:<8} {r['success'] * 100:>6.1f} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} "
+                    f"{r['p99_ms']:>8.0f} {r['max_ms']:>8.0f} {r['elapsed']:>8.1f} "
+                    f"{r.get('retries', '-'):>8} {r.get('hedged', '-'):>7} {r.get('rejected', '-'):>9}"
+                )
+    finally:
+        stop_processes([stub])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: multi-provider routing across stub LLM providers
+
+Starts a fast and a slow stub provider and sends batches of completions
+through LLMRouter in phases: both healthy, the fast provider down (faults
+switched on through /admin/faults), and recovered. Reports which provider
+served the calls, the fallbacks and the latency per phase, plus where title
+calls (fast tier) went.
+
+    python -m backend.benchmarks.bench_llm_router --fast-ms 150 --slow-ms 600 --requests 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from backend.benchmarks.harness import find_free_port, percentile, start_stub_process, stop_processes
+
+async def run_phase(router, total: int, concurrency: int, purpose: str = "chat"):
+    """Send `total` completions and count the provider that answered each one"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    served = {}
+    failures = 0
+    calls_before = {p.name: sum(p.calls.values()) - sum(p.failures.values()) for p in router.providers}
+    fallbacks_before = router.fallbacks
+    
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await router.complete([{"role": "user", "content": f"Request {i}"}], purpose=purpose, max_tokens=50)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+    
+    await asyncio.gather(*(one(i) for i in range(total)))
+    for provider in router.providers:
+        served[provider.name] = sum(provider.calls.values()) - sum(provider.failures.values()) - calls_before[provider.name]
+    return {
+        "served": served,
+        "fallbacks": router.fallbacks - fallbacks_before,
+        "success": (total - failures) / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+async def run(args, fast_url: str, slow_url: str):
+    from backend.llm_router import ProviderConfig, create_router
+    
+    router = create_router([
+        ProviderConfig(name="fast", base_url=f"{fast_url}/v1", api_key="stub-key", model="big", fast_model="small"),
+        ProviderConfig(name="slow", base_url=f"{slow_url}/v1", api_key="stub-key", model="big"),
+    ])
+    phases = [
+        ("healthy", None),
+        ("fast down", {"error_rate": 1.0}),
+        ("recovered", {"error_rate": 0.0}),
+    ]
+    print(f"{'phase':<10} {'ok %':>6} {'fast':>6} {'slow':>6} {'fallbacks':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    async with httpx.AsyncClient() as admin:
+        for name, faults in phases:
+            if faults is not None:
+                await admin.post(f"{fast_url}/admin/faults", json=faults)
+            if name == "recovered":
+                # Let the breaker's reset timeout pass so a probe can close it
+                await asyncio.sleep(args.breaker_reset + 0.5)
+            result = await run_phase(router, args.requests, args.concurrency)
+            print(
+                f"{name:<10} {result['success'] * 100:>6.1f} {result['served'].get('fast', 0):>6} "
+                f"{result['served'].get('slow', 0):>6} {result['fallbacks']:>10} "
+                f"{result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f}"
+            )
+        titles = await run_phase(router, args.requests // 4, args.concurrency, purpose="title")
+        print(f"{'titles':<10} {titles['success'] * 100:>6.1f} {titles['served'].get('fast', 0):>6} {titles['served'].get('slow', 0):>6}")
+    await router.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-provider LLM routing benchmark against stub providers")
+    parser.add_argument("--fast-ms", type=float, default=150.0)
+    parser.add_argument("--slow-ms", type=float, default=600.0)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--breaker-reset", type=float, default=5.0)
+    args = parser.parse_args()
+    
+    # Settings are read at import time, so configure the environment first
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ["LLM_BREAKER_RESET_SECONDS"] = str(args.breaker_reset)
+    os.environ.setdefault("LLM_HTTP2", "False")
+    
+    fast_port = find_free_port()
+    slow_port = find_free_port()
+    processes = [
+        start_stub_process(fast_port, "--latency-ms", str(args.fast_ms), "--latency-sigma", "0.2"),
+        start_stub_process(slow_port, "--latency-ms", str(args.slow_ms), "--latency-sigma", "0.2"),
+    ]
+    try:
+        asyncio.run(run(args, f"http://127.0.0.1:{fast_port}", f"http://127.0.0.1:{slow_port}"))
+    finally:
+        stop_processes(processes)
+
+if __name__ == "__main__":
+    main()
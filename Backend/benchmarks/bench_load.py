@@ -0,0 +1,425 @@
+"""
+Load test: mixed API workload at a fixed request rate
+
+Seeds synthetic users, conversations, messages and products into a temporary
+SQLite database (or --database-url, e.g. a local Postgres), starts a stub LLM
+and backend.main:app, then sends an open-loop mix of chat, search, history and
+conversation listing requests at --rps. Reports latency percentiles and
+throughput per endpoint and writes them, with the commit and configuration,
+to a JSON file that later runs can be compared against.
+
+    python -m backend.benchmarks.bench_load --rps 50 --duration 60 --output base.json
+    python -m backend.benchmarks.bench_load --rps 50 --duration 60 --baseline base.json
+    python -m backend.benchmarks.bench_load --compare base.json new.json
+
+Latency is measured from the time a request was scheduled, not sent, so a
+saturated server shows up in the percentiles instead of lowering the rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from backend.benchmarks.harness import (
+    find_free_port, percentile, start_app_process, start_stub_process, stop_processes
+)
+from backend.benchmarks.synthetic import batched, generate_products, generate_question, generate_search_query
+
+DEFAULT_MIX = "chat=0.2,search=0.4,history=0.25,listing=0.15"
+WORKLOADS = ("chat", "stream", "search", "history", "listing")
+
+# Compared metrics and whether a higher value is worse
+COMPARED_METRICS = (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput_rps", False))
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse 'chat=0.2,search=0.4' into normalized workload weights"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise ValueError(f"Unknown workload {name!r}, expected one of {', '.join(WORKLOADS)}")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Workload mix needs a positive weight")
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+def seed_database(engine, users: int, conversations: int, messages_per_conversation: int,
+                  products: int, seed: int) -> Dict:
+    """
+    Insert the synthetic data set into an empty database, then build the search
+    and vector indexes the way a bulk import would
+    """
+    from sqlalchemy import func, insert, select
+    from backend import models, search, vector_index
+    from backend.config import settings
+    
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for batch in batched(generate_products(products, seed), 20_000):
+            conn.execute(insert(models.Product), batch)
+        
+        conn.execute(insert(models.User), [
+            {"username": f"load_user_{i}", "email": f"load_user_{i}@example.com", "full_name": f"Load User {i}"}
+            for i in range(users)
+        ])
+        user_ids = conn.execute(select(models.User.id).order_by(models.User.id)).scalars().all()
+        
+        for batch in batched(({"user_id": user_ids[i % len(user_ids)], "title": f"Conversation {i}"}
+                              for i in range(conversations)), 20_000):
+            conn.execute(insert(models.Conversation), batch)
+        conversation_ids = conn.execute(select(models.Conversation.id).order_by(models.Conversation.id)).scalars().all()
+        
+        def messages():
+            for conversation_id in conversation_ids:
+                for i in range(messages_per_conversation):
+                    is_user = i % 2 == 0
+                    yield {
+                        "conversation_id": conversation_id,
+                        "content": generate_question(rng) if is_user else "Here are a few options from our catalogue.",
+                        "is_user_message": is_user,
+                    }
+        for batch in batched(messages(), 20_000):
+            conn.execute(insert(models.Message), batch)
+        message_count = conn.execute(select(func.count(models.Message.id))).scalar_one()
+    loaded = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    search.ensure_search_index(engine)
+    if settings.VECTOR_INDEX_PATH and products:
+        vector_index.build_index(engine, settings.VECTOR_INDEX_PATH)
+    indexed = time.perf_counter() - started
+    
+    return {
+        "users": len(user_ids),
+        "conversations": len(conversation_ids),
+        "messages": message_count,
+        "products": products,
+        "load_seconds": round(loaded, 2),
+        "index_seconds": round(indexed, 2),
+    }
+
+def load_targets(engine) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """User ids and (conversation id, owner id) pairs the workload picks from"""
+    from sqlalchemy import select
+    from backend import models
+    
+    with engine.connect() as conn:
+        user_ids = conn.execute(select(models.User.id)).scalars().all()
+        conversations = [tuple(row) for row in conn.execute(
+            select(models.Conversation.id, models.Conversation.user_id)
+        )]
+    return user_ids, conversations
+
+def build_request(workload: str, rng: random.Random, user_ids: List[int],
+                  conversations: List[Tuple[int, int]]) -> Tuple[str, str, Optional[Dict], Optional[Dict]]:
+    """Method, path, query parameters and JSON body of one request of a workload"""
+    if workload in ("chat", "stream"):
+        body = {"message": generate_question(rng)}
+        if conversations and rng.random() < 0.5:
+            body["conversation_id"], body["user_id"] = rng.choice(conversations)
+        else:
+            body["user_id"] = rng.choice(user_ids)
+        return "POST", "/api/chat" if workload == "chat" else "/api/chat/stream", None, body
+    if workload == "search":
+        return "GET", "/api/products/search", {"q": generate_search_query(rng), "limit": 20}, None
+    if workload == "history":
+        conversation_id, _ = rng.choice(conversations)
+        return "GET", f"/api/conversations/{conversation_id}/messages", {"limit": 20}, None
+    return "GET", f"/api/users/{rng.choice(user_ids)}/conversations", None, None
+
+async def run_load(base_url: str, rps: float, duration: float, mix: Dict[str, float], arrival: str,
+                   user_ids: List[int], conversations: List[Tuple[int, int]], seed: int,
+                   max_in_flight: int, timeout: float) -> Dict:
+    """
+    Open-loop load: requests are scheduled at a fixed (or Poisson) rate and
+    sent whether or not earlier ones have finished
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples: Dict[str, List[Tuple[float, int]]] = {name: [] for name in names}
+    dropped = 0
+    in_flight = 0
+    tasks = set()
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def one_request(workload: str, scheduled: float, method: str, path: str, params, body):
+            nonlocal in_flight
+            status = 0
+            try:
+                if workload == "stream":
+                    async with client.stream(method, path, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                        status = response.status_code
+                else:
+                    response = await client.request(method, path, params=params, json=body)
+                    status = response.status_code
+            except httpx.HTTPError:
+                pass
+            finally:
+                in_flight -= 1
+            samples[workload].append((time.perf_counter() - scheduled, status))
+        
+        started = time.perf_counter()
+        next_at = started
+        while next_at - started < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            workload = rng.choices(names, weights)[0]
+            request = build_request(workload, rng, user_ids, conversations)
+            if in_flight >= max_in_flight:
+                dropped += 1
+            else:
+                in_flight += 1
+                task = asyncio.create_task(one_request(workload, next_at, *request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            next_at += rng.expovariate(rps) if arrival == "poisson" else 1 / rps
+        sent_for = time.perf_counter() - started
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    
+    endpoints = {name: summarize(samples[name], elapsed) for name in names}
+    total = summarize([sample for name in names for sample in samples[name]], elapsed)
+    total.update(
+        target_rps=rps,
+        offered_rps=round(sum(len(s) for s in samples.values()) / sent_for, 2) if sent_for else 0.0,
+        dropped=dropped,
+        duration_seconds=round(elapsed, 2),
+    )
+    return {"endpoints": endpoints, "total": total}
+
+def summarize(samples: List[Tuple[float, int]], elapsed: float) -> Dict:
+    """Latency percentiles (ms), error count and throughput of a list of samples"""
+    latencies = [latency for latency, _ in samples]
+    ok = [latency for latency, status in samples if 200 <= status < 400]
+    status_codes: Dict[str, int] = {}
+    for _, status in samples:
+        key = str(status) if status else "error"
+        status_codes[key] = status_codes.get(key, 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "status_codes": status_codes,
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+def scrape_server_metrics(base_url: str) -> Dict:
+    """
+    Mean chat stage latency and database queries per request from /metrics
+    (of the one worker that answers the scrape)
+    """
+    try:
+        text = httpx.get(f"{base_url}/metrics", timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    pattern = re.compile(r'^(\w+)_(sum|count)\{(\w+)="([^"]*)"\} (\S+)$')
+    totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match and match.group(1) in ("chat_stage_duration_seconds", "db_queries_per_request"):
+            name, kind, _, label, value = match.groups()
+            totals.setdefault((name, label), {})[kind] = float(value)
+    result: Dict[str, Dict[str, float]] = {"chat_stage_mean_ms": {}, "db_queries_per_request_mean": {}}
+    for (name, label), values in sorted(totals.items()):
+        if not values.get("count"):
+            continue
+        mean = values.get("sum", 0.0) / values["count"]
+        if name == "chat_stage_duration_seconds":
+            result["chat_stage_mean_ms"][label] = round(mean * 1000, 2)
+        else:
+            result["db_queries_per_request_mean"][label] = round(mean, 2)
+    return result
+
+def git_revision() -> Dict:
+    """Commit of the working tree the run measured"""
+    import backend
+    source_dir = os.path.dirname(os.path.realpath(backend.__file__))
+    
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=source_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def print_results(results: Dict):
+    print(f"{'endpoint':<10} {'reqs':>7} {'err':>5} {'rps':>8} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    rows = list(results["endpoints"].items()) + [("total", results["total"])]
+    for name, entry in rows:
+        print(
+            f"{name:<10} {entry['requests']:>7} {entry['errors']:>5} {entry['throughput_rps']:>8.1f} "
+            f"{entry['mean_ms']:>9.1f} {entry['p50_ms']:>8.1f} {entry['p95_ms']:>8.1f} "
+            f"{entry['p99_ms']:>8.1f} {entry['max_ms']:>8.1f}"
+        )
+    total = results["total"]
+    print(f"target {total['target_rps']} rps, offered {total['offered_rps']} rps, dropped {total['dropped']}")
+
+def compare_results(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    Print the relative change of each endpoint's percentiles and throughput and
+    return the regressions larger than `threshold` percent
+    """
+    regressions = []
+    print(f"Baseline {baseline['meta'].get('commit') or '?'} -> current {current['meta'].get('commit') or '?'}")
+    print(f"{'endpoint':<10} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    names = [name for name in current["endpoints"] if name in baseline["endpoints"]]
+    for name in names + ["total"]:
+        before = baseline["total"] if name == "total" else baseline["endpoints"][name]
+        after = current["total"] if name == "total" else current["endpoints"][name]
+        for metric, higher_is_worse in COMPARED_METRICS:
+            old, new = before[metric], after[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change > threshold if higher_is_worse else change < -threshold
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<10} {metric:<15} {old:>10.1f} {new:>10.1f} {change:>+7.1f}%{flag}")
+            if worse:
+                regressions.append(f"{name} {metric} {change:+.1f}%")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed-rate mixed workload load test against a stub LLM")
+    parser.add_argument("--database-url", default="", help="Empty database to seed, or one seeded by a previous run (default: temporary SQLite)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--messages-per-conversation", type=int, default=20)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=41, help="Seed of the data set and request sequence")
+    parser.add_argument("--rps", type=float, default=20.0, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Unmeasured seconds at the same rate first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Workload weights, of {', '.join(WORKLOADS)}")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Requests beyond this many in flight are dropped")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Median stub LLM latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Lognormal spread of the stub latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform jitter of the stub latency")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--completion-tokens-max", type=int, default=0)
+    parser.add_argument("--token-interval-ms", type=float, default=0.0)
+    parser.add_argument("--output", default="", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default="", help="Compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Only compare two result files")
+    args = parser.parse_args()
+    
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if compare_results(baseline, current, args.threshold) else 0)
+    
+    mix = parse_mix(args.mix)
+    
+    # Settings are read at import time, so configure the environment first
+    tmpdir = tempfile.mkdtemp(prefix="bench_load_")
+    llm_port = find_free_port()
+    app_port = find_free_port()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ.setdefault("XAI_API_KEY", "stub-key")
+    os.environ.setdefault("VECTOR_INDEX_PATH", os.path.join(tmpdir, "vector_index"))
+    # One log line per request would measure the terminal as much as the app
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    
+    from sqlalchemy import func, select, text
+    from backend import models
+    from backend.database import Base, engine
+    
+    if engine.dialect.name == "sqlite":
+        # Readers do not block the writer; persists in the database file
+        with engine.connect() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        seeded = conn.execute(select(func.count(models.User.id))).scalar_one() > 0
+    if seeded:
+        seed_report = {"reused": True}
+        print("Reusing the data already in the database")
+    else:
+        seed_report = seed_database(
+            engine, args.users, args.conversations, args.messages_per_conversation, args.products, args.seed
+        )
+        print(
+            f"Seeded {seed_report['users']} users, {seed_report['conversations']} conversations, "
+            f"{seed_report['messages']} messages and {seed_report['products']} products "
+            f"in {seed_report['load_seconds']}s (+{seed_report['index_seconds']}s indexing)"
+        )
+    user_ids, conversations = load_targets(engine)
+    engine.dispose()
+    
+    stub_args = [
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--latency-sigma", str(args.latency_sigma), "--completion-tokens", str(args.completion_tokens),
+        "--completion-tokens-max", str(args.completion_tokens_max), "--token-interval-ms", str(args.token_interval_ms),
+    ]
+    processes = [start_stub_process(llm_port, *stub_args)]
+    try:
+        processes.append(start_app_process(app_port, dict(os.environ), workers=args.workers))
+        base_url = f"http://127.0.0.1:{app_port}"
+        
+        if args.warmup > 0:
+            asyncio.run(run_load(
+                base_url, args.rps, args.warmup, mix, args.arrival, user_ids, conversations,
+                args.seed + 1, args.max_in_flight, args.timeout
+            ))
+        results = asyncio.run(run_load(
+            base_url, args.rps, args.duration, mix, args.arrival, user_ids, conversations,
+            args.seed, args.max_in_flight, args.timeout
+        ))
+        results["server"] = scrape_server_metrics(base_url)
+    finally:
+        stop_processes(processes)
+    
+    results["meta"] = {
+        **git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": engine.dialect.name,
+        "python": platform.python_version(),
+        "seed_data": seed_report,
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "baseline", "output")},
+    }
+    print_results(results)
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare_results(baseline, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
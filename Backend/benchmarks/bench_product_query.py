@@ -0,0 +1,104 @@
+"""
+Benchmark: filtered product listings, offset versus keyset paging, and facets
+
+Builds a synthetic catalogue in a temporary SQLite database with the
+composite product indexes, then times reading a page at increasing depth
+through a filtered, sorted listing with LIMIT/OFFSET and with product_query
+keyset cursors, and facet counts from the precomputed table against SQL
+GROUP BY.
+
+    python -m backend.benchmarks.bench_product_query --products 1000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Product query engine benchmark on a synthetic catalogue")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--depths", default="1,10,100,1000,5000", help="Page numbers to time")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement")
+    parser.add_argument("--database-url", default="", help="Use this database instead of a temporary SQLite file")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_product_query_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    
+    from sqlalchemy import insert
+    from backend import models, product_query
+    from backend.benchmarks.synthetic import batched, generate_products
+    from backend.database import SessionLocal, create_tables, engine
+    
+    create_tables()
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for batch in batched(generate_products(args.products), 20_000):
+            conn.execute(insert(models.Product), batch)
+    print(f"Loaded {args.products} products in {time.perf_counter() - started:.1f}s")
+    
+    def timed(fn):
+        runs = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = fn()
+            runs.append(time.perf_counter() - started)
+        return statistics.median(runs) * 1000, result
+    
+    listings = [
+        ("all, price_asc", product_query.ProductFilters(), "price_asc"),
+        ("Laptops, price_asc", product_query.ProductFilters(categories=("Laptops",)), "price_asc"),
+        ("Sony in stock, rating", product_query.ProductFilters(brands=("Sony",), in_stock=True), "rating"),
+    ]
+    depths = [int(depth) for depth in args.depths.split(",")]
+    db = SessionLocal()
+    try:
+        print(f"{'listing':<24} {'page':>6} {'offset ms':>10} {'keyset ms':>10}")
+        for name, filters, sort in listings:
+            # Walk the cursors once to find where each timed page starts
+            cursors = {1: None}
+            after, page = None, 1
+            while page < max(depths):
+                rows = product_query.fetch_rows(db, filters, sort=sort, after=after, limit=args.page_size + 1)
+                if len(rows) <= args.page_size:
+                    break
+                page += 1
+                last = rows[args.page_size - 1]
+                after = (getattr(last, product_query.SORTS[sort][0]), last.id)
+                cursors[page] = after
+            for depth in depths:
+                if depth not in cursors:
+                    continue
+                offset_stmt = (
+                    product_query.build_page_statement(engine.dialect.name, filters, sort=sort, limit=args.page_size)
+                    .offset((depth - 1) * args.page_size)
+                )
+                offset_ms, offset_rows = timed(lambda: db.execute(offset_stmt).scalars().all())
+                keyset_ms, keyset_rows = timed(
+                    lambda: product_query.fetch_rows(db, filters, sort=sort, after=cursors[depth], limit=args.page_size)
+                )
+                assert [p.id for p in offset_rows] == [p.id for p in keyset_rows]
+                print(f"{name:<24} {depth:>6} {offset_ms:>10.1f} {keyset_ms:>10.1f}")
+        
+        print()
+        started = time.perf_counter()
+        table = product_query.get_facet_table(db)
+        print(f"Facet table built in {(time.perf_counter() - started) * 1000:.0f} ms ({len(table.counts)} groups)")
+        print(f"{'facets':<40} {'sql ms':>10} {'precomputed ms':>15}")
+        facet_filters = [
+            ("no filters", product_query.ProductFilters()),
+            ("Laptops + Phones, in stock", product_query.ProductFilters(categories=("Laptops", "Phones"), in_stock=True)),
+            ("Apple, Samsung", product_query.ProductFilters(brands=("Apple", "Samsung"))),
+        ]
+        for name, filters in facet_filters:
+            sql_ms, sql_result = timed(lambda: product_query.count_facets_in_sql(db, filters))
+            table_ms, table_result = timed(lambda: table.facets(filters))
+            assert sql_result == table_result
+            print(f"{name:<40} {sql_ms:>10.1f} {table_ms:>15.2f}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark: replay a JSONL log of chat requests with and without the response cache
+
+Each line of the log is a JSON object with a "message" (and optionally a
+"user" label; requests with the same label share a user). Every request
+starts a new conversation, as first questions are the ones that repeat.
+Without --log a synthetic log of paraphrased shopping questions is replayed.
+The log is replayed sequentially against a worker with the cache disabled,
+with the exact tier, and with the exact plus semantic tiers.
+
+    python -m backend.benchmarks.bench_response_cache --log requests.jsonl --latency-ms 800
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from backend.benchmarks.harness import (
+    find_free_port, percentile, start_app_process, start_stub_process, stop_processes
+)
+
+TEMPLATES = [
+    "What {item} do you have under ${price}?",
+    "what {item} do you have under ${price}",
+    "Which {item} do you have under ${price}?",
+    "Do you have any {item} under ${price}?",
+    "Show me {item} under ${price}",
+    "Any good {item}?",
+]
+ITEMS = ["laptops", "phones", "headphones", "monitors", "tablets", "smartwatches"]
+PRICES = [200, 500, 1000]
+
+def synthetic_log(count: int, seed: int = 14):
+    """Skewed mix of paraphrased questions, like a real request log"""
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(ITEMS))]
+    for i in range(count):
+        item = rng.choices(ITEMS, weights=weights)[0]
+        yield {"user": f"u{i % 20}", "message": rng.choice(TEMPLATES).format(item=item, price=rng.choice(PRICES))}
+
+def read_log(path: str):
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def replay(base_url: str, requests, user_ids):
+    latencies = []
+    errors = 0
+    with httpx.Client(base_url=base_url, timeout=120) as client:
+        started = time.perf_counter()
+        for request in requests:
+            request_started = time.perf_counter()
+            response = client.post("/api/chat", json={
+                "user_id": user_ids[request.get("user", "default")],
+                "message": request["message"],
+                "include_history": False
+            })
+            if response.status_code != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+        stats = client.get("/api/stats/response-cache").json()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "hit_rate": stats["hit_rate"],
+        "saved_llm_seconds": stats["saved_llm_seconds"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay chat requests with and without the response cache")
+    parser.add_argument("--log", help="JSONL file of requests (default: synthetic)")
+    parser.add_argument("--requests", type=int, default=300, help="Synthetic requests when no log is given")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Stub LLM completion latency")
+    parser.add_argument("--similarity", type=float, default=0.9, help="RESPONSE_CACHE_SIMILARITY")
+    args = parser.parse_args()
+    
+    requests = list(read_log(args.log) if args.log else synthetic_log(args.requests))
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_response_cache_")
+    llm_port = find_free_port()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ.setdefault("XAI_API_KEY", "stub-key")
+    
+    from backend import bulk_load, crud, schemas
+    from backend.database import SessionLocal, create_tables
+    
+    create_tables()
+    bulk_load.load_products(os.path.join(os.path.dirname(__file__), "..", "sample_products.csv"), verbose=False)
+    db = SessionLocal()
+    try:
+        user_ids = {}
+        for label in sorted({r.get("user", "default") for r in requests}):
+            user_ids[label] = crud.create_user(db, schemas.UserCreate(username=f"bench_{label}")).id
+    finally:
+        db.close()
+    
+    stub = start_stub_process(llm_port, "--latency-ms", str(args.latency_ms))
+    modes = [
+        ("no cache", {"RESPONSE_CACHE_MAX_ENTRIES": "0"}),
+        ("exact", {"RESPONSE_CACHE_SEMANTIC": "False"}),
+        ("exact+semantic", {"RESPONSE_CACHE_SEMANTIC": "True", "RESPONSE_CACHE_SIMILARITY": str(args.similarity)}),
+    ]
+    try:
+        print(f"Replaying {len(requests)} requests, stub LLM latency {args.latency_ms:.0f} ms")
+        print(f"{'mode':>16} {'err':>4} {'seconds':>8} {'p50 ms':>8} {'p95 ms':>8} {'hit rate':>9} {'saved s':>8}")
+        for name, env in modes:
+            app_port = find_free_port()
+            app = start_app_process(app_port, {**os.environ, **env})
+            try:
+                result = replay(f"http://127.0.0.1:{app_port}", requests, user_ids)
+            finally:
+                stop_processes([app])
+            print(
+                f"{name:>16} {result['errors']:>4} {result['seconds']:>8.1f} {result['p50_ms']:>8.0f} "
+                f"{result['p95_ms']:>8.0f} {result['hit_rate']:>9.1%} {result['saved_llm_seconds']:>8.1f}"
+            )
+    finally:
+        stop_processes([stub])
+
+if __name__ == "__main__":
+    main()
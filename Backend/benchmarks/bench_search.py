@@ -0,0 +1,77 @@
+"""
+Benchmark: full-text product search versus the previous four-column ILIKE scan
+
+Builds a synthetic catalogue in a temporary SQLite database (FTS5 index) and
+times a set of queries through both the old and the new search paths.
+
+    python -m backend.benchmarks.bench_search --products 1000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search benchmark on a synthetic catalogue")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query")
+    parser.add_argument("--database-url", default="", help="Use this database instead of a temporary SQLite file")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_search_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    
+    from sqlalchemy import insert, or_, select
+    from backend import crud, models, search
+    from backend.benchmarks.synthetic import batched, generate_products
+    from backend.database import Base, SessionLocal, engine
+    
+    # Load rows first and build the index afterwards, as a bulk import would
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for batch in batched(generate_products(args.products), 20_000):
+            conn.execute(insert(models.Product), batch)
+    loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    search.ensure_search_index(engine)
+    indexed = time.perf_counter() - started
+    print(f"Loaded {args.products} products in {loaded:.1f}s, built search index in {indexed:.1f}s")
+    
+    def legacy_search(db, query):
+        # The previous implementation: unranked ILIKE scan, sliced in Python
+        term = f"%{query}%"
+        return db.query(models.Product).filter(or_(
+            models.Product.name.ilike(term),
+            models.Product.category.ilike(term),
+            models.Product.brand.ilike(term),
+            models.Product.description.ilike(term),
+        )).all()[:5]
+    
+    queries = [
+        "wireless headphones",
+        "Sony",
+        "gaming laptop with fast charging",
+        "Do you have any waterproof speakers for the beach?",
+        "noise cancellation",
+    ]
+    
+    db = SessionLocal()
+    try:
+        print(f"{'query':<52} {'ilike ms':>10} {'fts ms':>10} {'hits':>6}")
+        for query in queries:
+            timings = {}
+            for name, fn in (("ilike", legacy_search), ("fts", lambda d, q: crud.search_products(d, q, limit=5))):
+                runs = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    results = fn(db, query)
+                    runs.append(time.perf_counter() - started)
+                timings[name] = (statistics.median(runs) * 1000, len(results))
+            print(f"{query[:52]:<52} {timings['ilike'][0]:>10.1f} {timings['fts'][0]:>10.1f} {timings['fts'][1]:>6}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: /api/stats from COUNT(*) scans versus the materialized snapshot
+
+Fills a temporary SQLite database with users, conversations and messages,
+then times the four COUNT(*) queries the endpoint used to run, the first
+(full) snapshot refresh, an incremental refresh after new messages, and a
+snapshot read.
+
+    python -m backend.benchmarks.bench_stats --messages 5000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from backend.benchmarks.synthetic import batched
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics endpoint benchmark")
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    parser.add_argument("--messages-per-conversation", type=int, default=20)
+    parser.add_argument("--new-messages", type=int, default=1000, help="Messages added before the incremental refresh")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", default="", help="Use this database instead of a temporary SQLite file")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_stats_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    # Freshly inserted rows count straight away
+    os.environ["STATS_SETTLE_SECONDS"] = "0"
+    
+    from sqlalchemy import insert, select
+    from backend import app_stats, models
+    from backend.database import SessionLocal, create_tables, engine
+    
+    create_tables()
+    conversations = max(1, args.messages // args.messages_per_conversation)
+    users = max(1, conversations // 10)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"username": f"stats_user_{i}"} for i in range(users)])
+        for batch in batched(({"user_id": i % users + 1, "title": "Conversation"} for i in range(conversations)), 20_000):
+            conn.execute(insert(models.Conversation), batch)
+        rows = (
+            {"conversation_id": i // args.messages_per_conversation + 1, "content": "message", "is_user_message": i % 2 == 0}
+            for i in range(args.messages)
+        )
+        for batch in batched(rows, 50_000):
+            conn.execute(insert(models.Message), batch)
+    print(f"Loaded {users} users, {conversations} conversations, {args.messages} messages in {time.perf_counter() - started:.1f}s")
+    
+    def timed(fn, repeat=args.repeat):
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - started)
+        return statistics.median(runs) * 1000
+    
+    db = SessionLocal()
+    try:
+        def count_scans():
+            # What /api/stats ran on every call before the snapshot
+            for model in (models.User, models.Product, models.Conversation, models.Message):
+                db.query(model).count()
+        
+        results = [("COUNT(*) x4", timed(count_scans))]
+        results.append(("first refresh (full)", timed(lambda: app_stats.refresh(db), repeat=1)))
+        with engine.begin() as conn:
+            conn.execute(insert(models.Message), [
+                {"conversation_id": 1, "content": "message", "is_user_message": True} for _ in range(args.new_messages)
+            ])
+        results.append((f"refresh after {args.new_messages} messages", timed(lambda: app_stats.refresh(db), repeat=1)))
+        results.append(("incremental refresh, no new rows", timed(lambda: app_stats.refresh(db))))
+        results.append(("snapshot read", timed(lambda: app_stats.read_snapshot(db))))
+        snapshot = app_stats.read_snapshot(db)
+        assert snapshot["messages"] == args.messages + args.new_messages, snapshot
+    finally:
+        db.close()
+    
+    for name, ms in results:
+        print(f"{name:<36} {ms:>10.1f} ms")
+
+if __name__ == "__main__":
+    main()
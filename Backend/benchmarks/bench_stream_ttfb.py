@@ -0,0 +1,105 @@
+"""
+Benchmark: time-to-first-byte of /api/chat versus /api/chat/stream
+
+The stub LLM emits its first token after --latency-ms and then one token every
+--token-interval-ms, which is how real completions behave. The buffered
+endpoint can only answer after the last token; the streaming one forwards the
+first token as soon as it arrives.
+
+    python -m backend.benchmarks.bench_stream_ttfb --latency-ms 300 --token-interval-ms 20 --tokens 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from backend.benchmarks.harness import (
+    find_free_port, percentile, start_app_process, start_stub_process, stop_processes
+)
+
+async def measure_buffered(client: httpx.AsyncClient, user_id: int, runs: int):
+    """TTFB and total time of the buffered /api/chat endpoint"""
+    ttfb, total = [], []
+    for i in range(runs):
+        started = time.perf_counter()
+        async with client.stream("POST", "/api/chat", json={"user_id": user_id, "message": f"Show me laptops #{i}"}) as response:
+            async for _ in response.aiter_bytes():
+                if len(ttfb) == i:
+                    ttfb.append(time.perf_counter() - started)
+        total.append(time.perf_counter() - started)
+    return ttfb, ttfb, total
+
+async def measure_streaming(client: httpx.AsyncClient, user_id: int, runs: int):
+    """TTFB, time to first token and total time of /api/chat/stream"""
+    ttfb, first_token, total = [], [], []
+    for i in range(runs):
+        started = time.perf_counter()
+        seen_first_byte = seen_token = False
+        async with client.stream("POST", "/api/chat/stream", json={"user_id": user_id, "message": f"Show me laptops #{i}"}) as response:
+            async for line in response.aiter_lines():
+                if not seen_first_byte:
+                    ttfb.append(time.perf_counter() - started)
+                    seen_first_byte = True
+                if line == "event: token" and not seen_token:
+                    first_token.append(time.perf_counter() - started)
+                    seen_token = True
+        total.append(time.perf_counter() - started)
+    return ttfb, first_token, total
+
+def summarize(name: str, ttfb, first_token, total):
+    print(
+        f"{name:<18} {statistics.median(ttfb) * 1000:>9.0f} {percentile(ttfb, 95) * 1000:>9.0f} "
+        f"{statistics.median(first_token) * 1000:>12.0f} {statistics.median(total) * 1000:>10.0f}"
+    )
+
+async def run(base_url: str, user_id: int, runs: int):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        print(f"{'endpoint':<18} {'ttfb p50':>9} {'ttfb p95':>9} {'1st token':>12} {'total p50':>10}")
+        summarize("/api/chat", *await measure_buffered(client, user_id, runs))
+        summarize("/api/chat/stream", *await measure_streaming(client, user_id, runs))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare TTFB of buffered and streaming chat")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Stub delay before the first token")
+    parser.add_argument("--token-interval-ms", type=float, default=20.0, help="Stub delay between tokens")
+    parser.add_argument("--tokens", type=int, default=200, help="Completion length in tokens")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_stream_")
+    llm_port = find_free_port()
+    app_port = find_free_port()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ.setdefault("XAI_API_KEY", "stub-key")
+    
+    from backend import crud, schemas
+    from backend.database import SessionLocal, create_tables
+    
+    create_tables()
+    db = SessionLocal()
+    try:
+        user_id = crud.create_user(db, schemas.UserCreate(username="bench_user")).id
+    finally:
+        db.close()
+    
+    processes = [
+        start_stub_process(
+            llm_port,
+            "--latency-ms", str(args.latency_ms),
+            "--token-interval-ms", str(args.token_interval_ms),
+            "--completion-tokens", str(args.tokens),
+        ),
+        start_app_process(app_port, dict(os.environ)),
+    ]
+    try:
+        asyncio.run(run(f"http://127.0.0.1:{app_port}", user_id, args.runs))
+    finally:
+        stop_processes(processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark: vector index build and top-k query latency on CPU
+
+Embeds a synthetic catalogue at each size and times top-k cosine queries
+against the memory-mapped index, both exact and IVF (with the recall of the
+IVF results against the exact ones).
+
+    python -m backend.benchmarks.bench_vector_search --sizes 100000,1000000 --k 20
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+QUERIES = [
+    "something to block noise on flights",
+    "cheap laptop for school",
+    "waterproof speaker for the beach",
+    "camera with optical zoom",
+    "ergonomic keyboard for long typing sessions",
+    "fast charging phone",
+    "gaming monitor high refresh rate",
+    "lightweight earbuds for running",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector index build and query latency")
+    parser.add_argument("--sizes", default="100000,1000000", help="Comma separated catalogue sizes")
+    parser.add_argument("--k", type=int, default=20, help="Hits per query")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query")
+    args = parser.parse_args()
+    
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    from backend import vector_index
+    from backend.benchmarks.synthetic import batched, generate_products
+    
+    embedder = vector_index.get_embedder()
+    print(f"Embedder: {embedder.name}")
+    print(f"{'products':>10} {'mode':>6} {'embed/s':>10} {'save s':>7} {'index MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        path = tempfile.mkdtemp(prefix="bench_vector_")
+        ids = np.arange(1, size + 1, dtype=np.int64)
+        vectors = np.empty((size, embedder.dimensions), dtype=np.float32)
+        started = time.perf_counter()
+        filled = 0
+        for batch in batched(generate_products(size), vector_index.EMBED_BATCH_SIZE):
+            texts = [vector_index.product_text(SimpleNamespace(**row)) for row in batch]
+            vectors[filled:filled + len(batch)] = embedder.embed(texts)
+            filled += len(batch)
+        embed_seconds = time.perf_counter() - started
+        query_vectors = embedder.embed(QUERIES)
+        
+        exact_hits = None
+        for mode, use_ivf in (("exact", False), ("ivf", True)):
+            started = time.perf_counter()
+            vector_index.VectorIndex(ids, vectors, embedder.name).save(path, use_ivf=use_ivf)
+            save_seconds = time.perf_counter() - started
+            index = vector_index.VectorIndex.load(path)
+            hits = [{pid for pid, _ in index.search(query, args.k)} for query in query_vectors]
+            timings = []
+            for _ in range(args.repeat):
+                for query in query_vectors:
+                    started = time.perf_counter()
+                    index.search(query, args.k)
+                    timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            if exact_hits is None:
+                exact_hits = hits
+            recall = statistics.mean(len(h & e) / max(len(e), 1) for h, e in zip(hits, exact_hits))
+            print(
+                f"{size:>10} {mode:>6} {size / embed_seconds:>10,.0f} {save_seconds:>7.1f} "
+                f"{index.vectors.nbytes / (1024 * 1024):>9.0f} {statistics.median(timings):>8.1f} "
+                f"{timings[int(len(timings) * 0.95) - 1]:>8.1f} {recall:>7.2f}"
+            )
+            del index
+
+if __name__ == "__main__":
+    main()
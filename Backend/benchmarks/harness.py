@@ -0,0 +1,76 @@
+"""
+Process helpers shared by the benchmarks: free ports, stub LLM and app workers
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+def find_free_port() -> int:
+    """Ask the OS for a free localhost port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def package_root() -> str:
+    """Directory that contains the backend package, used as cwd for child processes"""
+    import backend
+    return os.path.dirname(os.path.dirname(os.path.abspath(backend.__file__)))
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    """Block until something accepts connections on localhost:port"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def start_stub_process(port: int, *extra_args: str) -> subprocess.Popen:
+    """
+    Start the stub LLM server in its own process so it does not compete for the GIL
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "backend.benchmarks.stub_llm", "--port", str(port), *extra_args],
+        cwd=package_root()
+    )
+    wait_for_port(port)
+    return process
+
+def start_app_process(port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    """
+    Start uvicorn running backend.main:app with the given environment
+    (one worker unless told otherwise). Benchmarks send many chats per
+    user, so the per-user rate limit is off unless env sets it.
+    """
+    env = {"CHAT_USER_RATE_PER_MINUTE": "0", **env}
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "backend.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=package_root(),
+        env=env
+    )
+    wait_for_port(port)
+    return process
+
+def stop_processes(processes):
+    """Terminate child processes and wait for them to exit"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+def percentile(values, pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of floats (llm_gateway.percentile).
+    Imported on first use: importing backend modules reads the settings,
+    which benchmarks set in the environment after importing the harness.
+    """
+    from backend.llm_gateway import percentile as nearest_rank_percentile
+    return nearest_rank_percentile(values, pct)
@@ -0,0 +1,202 @@
+"""
+Local stub of an OpenAI-compatible chat completions server for benchmarks
+
+Run standalone with:
+    python -m backend.benchmarks.stub_llm --port 9100 --latency-ms 500
+
+Faults for resilience tests:
+    python -m backend.benchmarks.stub_llm --port 9100 --error-rate 0.1 --slow-rate 0.05 --slow-ms 3000
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+# Injected faults: share of requests answered with error_status, share that
+# stall for hang_seconds, and share delayed by an extra slow_ms
+FAULT_DEFAULTS = {
+    "error_rate": 0.0,
+    "error_status": 503,
+    "hang_rate": 0.0,
+    "hang_seconds": 300.0,
+    "slow_rate": 0.0,
+    "slow_ms": 2000.0,
+}
+
+def create_stub_app(
+    latency_ms: float = 500.0,
+    jitter_ms: float = 0.0,
+    completion_tokens: int = 60,
+    token_interval_ms: float = 0.0,
+    latency_sigma: float = 0.0,
+    completion_tokens_max: int = 0,
+    faults: Optional[Dict[str, float]] = None
+) -> FastAPI:
+    """
+    Build a stub app that answers /v1/chat/completions after a simulated delay.
+    With stream=true the first chunk arrives after latency_ms and the rest
+    follow every token_interval_ms.
+    
+    The delay is latency_ms +/- jitter_ms (uniform), or lognormal with median
+    latency_ms when latency_sigma > 0, which gives the long tail of real
+    providers. Completions are completion_tokens long, or uniformly between
+    completion_tokens and completion_tokens_max when that is larger.
+    
+    `faults` (see FAULT_DEFAULTS) injects errors, stalls and slow responses;
+    GET/POST /admin/faults reads or changes them while the server runs, e.g.
+    to take the provider down and bring it back.
+    """
+    app = FastAPI(title="Stub LLM")
+    active_faults = {**FAULT_DEFAULTS, **(faults or {})}
+    
+    @app.get("/admin/faults")
+    async def get_faults():
+        return active_faults
+    
+    @app.post("/admin/faults")
+    async def set_faults(request: Request):
+        changes = await request.json()
+        unknown = set(changes) - set(FAULT_DEFAULTS)
+        if unknown:
+            return JSONResponse({"error": f"Unknown faults: {', '.join(sorted(unknown))}"}, status_code=400)
+        active_faults.update({name: float(value) for name, value in changes.items()})
+        return active_faults
+    
+    def draw_delay() -> float:
+        if latency_sigma > 0:
+            return random.lognormvariate(math.log(max(latency_ms, 1e-3)), latency_sigma) / 1000
+        return max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+    
+    def draw_tokens() -> int:
+        if completion_tokens_max > completion_tokens:
+            return random.randint(completion_tokens, completion_tokens_max)
+        return completion_tokens
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            body = await request.json()
+        except ClientDisconnect:
+            # Cancelled by the client (e.g. the losing side of a hedged call)
+            return Response(status_code=499)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+        delay = draw_delay()
+        tokens = draw_tokens()
+        
+        roll = random.random()
+        if roll < active_faults["error_rate"]:
+            status_code = int(active_faults["error_status"])
+            headers = {"Retry-After": "1"} if status_code == 429 else None
+            return JSONResponse(
+                {"error": {"message": "Injected fault", "type": "server_error"}},
+                status_code=status_code, headers=headers
+            )
+        roll -= active_faults["error_rate"]
+        if roll < active_faults["hang_rate"]:
+            # A stalled upstream: accept the request and never answer in time
+            await asyncio.sleep(active_faults["hang_seconds"])
+        elif roll - active_faults["hang_rate"] < active_faults["slow_rate"]:
+            delay += active_faults["slow_ms"] / 1000
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        
+        if body.get("stream"):
+            async def chunks():
+                await asyncio.sleep(delay)
+                for i in range(tokens):
+                    if i and token_interval_ms:
+                        await asyncio.sleep(token_interval_ms / 1000)
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": "token "}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": tokens,
+                            "total_tokens": prompt_tokens + tokens
+                        }
+                    }
+                    yield f"data: {json.dumps(usage_chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        
+        # Non-streaming callers wait for the whole generation
+        await asyncio.sleep(delay + tokens * token_interval_ms / 1000)
+        content = " ".join(["token"] * tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens
+            }
+        }
+    
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Delay before the first token")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--token-interval-ms", type=float, default=0.0, help="Delay between generated tokens")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Lognormal latency spread (0: uniform jitter)")
+    parser.add_argument("--completion-tokens-max", type=int, default=0, help="Draw completion lengths up to this many tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that stall for --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=300.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests delayed by an extra --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=2000.0)
+    args = parser.parse_args()
+    
+    faults = {name: getattr(args, name) for name in FAULT_DEFAULTS}
+    app = create_stub_app(
+        args.latency_ms, args.jitter_ms, args.completion_tokens, args.token_interval_ms,
+        args.latency_sigma, args.completion_tokens_max, faults
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
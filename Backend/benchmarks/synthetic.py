@@ -0,0 +1,88 @@
+"""
+Synthetic catalogue generator shared by the benchmarks
+"""
+import random
+from typing import Dict, Iterator, List
+
+BRANDS = [
+    "Apple", "Samsung", "Sony", "Dell", "HP", "Lenovo", "ASUS", "Acer", "LG", "Bose",
+    "Logitech", "Microsoft", "Google", "Nintendo", "Canon", "Nikon", "Philips", "Razer",
+    "Corsair", "SanDisk", "Garmin", "Fitbit", "Anker", "JBL", "Xiaomi",
+]
+CATEGORIES = [
+    "Electronics", "Laptops", "Phones", "Audio", "Cameras", "Gaming", "Accessories",
+    "Monitors", "Storage", "Wearables", "Tablets", "Networking", "Smart Home",
+]
+NOUNS = [
+    "laptop", "phone", "headphones", "earbuds", "speaker", "monitor", "keyboard", "mouse",
+    "camera", "lens", "tablet", "watch", "router", "charger", "drive", "console", "controller",
+    "webcam", "microphone", "projector", "printer", "television", "soundbar", "tracker",
+]
+ADJECTIVES = [
+    "wireless", "portable", "ultra", "pro", "compact", "gaming", "noise-canceling", "waterproof",
+    "smart", "premium", "lightweight", "curved", "mechanical", "bluetooth", "fast", "silent",
+    "ergonomic", "rugged", "slim", "4K", "HDR", "rechargeable", "foldable", "budget",
+]
+FEATURES = [
+    "long battery life", "USB-C charging", "active noise cancellation", "high refresh rate",
+    "fast charging", "all-day comfort", "studio quality sound", "low latency", "water resistance",
+    "backlit keys", "optical zoom", "voice assistant support", "dual band wifi", "metal body",
+]
+
+def generate_products(count: int, seed: int = 41) -> Iterator[Dict]:
+    """
+    Yield `count` product rows with the columns of models.Product
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        brand = rng.choice(BRANDS)
+        noun = rng.choice(NOUNS)
+        adjectives = rng.sample(ADJECTIVES, 2)
+        features = rng.sample(FEATURES, 2)
+        yield {
+            "name": f"{brand} {adjectives[0].title()} {noun.title()} {i % 1000}",
+            "category": rng.choice(CATEGORIES),
+            "price": round(rng.uniform(5, 3000), 2),
+            "description": f"{adjectives[1].capitalize()} {noun} with {features[0]} and {features[1]}",
+            "brand": brand,
+            "sku": f"SYN-{i:09d}",
+            "stock_quantity": rng.randint(0, 500),
+            "rating": round(rng.uniform(1, 5), 1),
+        }
+
+def batched(rows: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    """Group an iterator of rows into lists of at most `size`"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+QUESTION_TEMPLATES = [
+    "Do you have {adjective} {noun}s?",
+    "I need a {noun} with {feature}",
+    "Show me {brand} {noun}s under ${price}",
+    "What is the best {adjective} {noun} for travel?",
+    "Is there a {brand} {noun} with {feature}?",
+    "Compare your {adjective} {noun}s",
+]
+
+def generate_question(rng: random.Random) -> str:
+    """A shopping question over the synthetic catalogue vocabulary"""
+    return rng.choice(QUESTION_TEMPLATES).format(
+        adjective=rng.choice(ADJECTIVES),
+        noun=rng.choice(NOUNS),
+        feature=rng.choice(FEATURES),
+        brand=rng.choice(BRANDS),
+        price=rng.choice((50, 100, 200, 500, 1000)),
+    )
+
+def generate_search_query(rng: random.Random) -> str:
+    """A short product search query such as 'sony wireless headphones'"""
+    words = [rng.choice(ADJECTIVES), rng.choice(NOUNS)]
+    if rng.random() < 0.5:
+        words.insert(0, rng.choice(BRANDS))
+    return " ".join(words)
@@ -0,0 +1,233 @@
+"""
+Streaming bulk loader for product CSV files
+
+Parses the CSV in fixed-size chunks (memory stays bounded by the chunk size)
+and upserts each chunk by SKU in its own transaction:
+- PostgreSQL + psycopg2: COPY into a temporary staging table, then one
+  INSERT ... SELECT ... ON CONFLICT (sku) DO UPDATE
+- otherwise: a batched executemany INSERT ... ON CONFLICT (sku) DO UPDATE
+
+Each row carries a content hash; conflicting rows whose hash is unchanged are
+left untouched so updated_at only moves when a product really changes. For
+delta ingestion with per-product change tracking see backend.catalog_sync.
+
+Usage:
+    python -m backend.bulk_load backend/sample_products.csv --chunk-size 5000
+"""
+import argparse
+import csv
+import hashlib
+import io
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+
+from backend import catalog_events, models, vector_index
+from backend.config import settings
+
+# Source columns covered by the content hash
+SOURCE_COLUMNS = ["name", "category", "price", "description", "brand", "sku", "stock_quantity", "rating"]
+
+PRODUCT_COLUMNS = SOURCE_COLUMNS + ["content_hash"]
+
+# Columns overwritten when an incoming row matches an existing SKU
+UPDATE_COLUMNS = [c for c in PRODUCT_COLUMNS if c != "sku"]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+@dataclass
+class LoadReport:
+    """Totals of a bulk load"""
+    rows: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def compute_content_hash(product: Dict) -> str:
+    """SHA-1 of the normalized source values of a product row"""
+    values = ["" if product[c] is None else repr(product[c]) for c in SOURCE_COLUMNS]
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+def parse_product_row(row: Dict[str, str]) -> Optional[Dict]:
+    """
+    Convert one CSV row to product column values; None for rows without a name
+    """
+    name = (row.get("name") or "").strip()
+    if not name:
+        return None
+    price = row.get("price")
+    stock = row.get("stock_quantity")
+    rating = row.get("rating")
+    product = {
+        "name": name,
+        "category": (row.get("category") or "").strip() or None,
+        "price": float(price) if price else None,
+        "description": (row.get("description") or "").strip() or None,
+        "brand": (row.get("brand") or "").strip() or None,
+        "sku": (row.get("sku") or "").strip() or None,
+        "stock_quantity": int(stock) if stock else 0,
+        "rating": float(rating) if rating else None,
+    }
+    product["content_hash"] = compute_content_hash(product)
+    return product
+
+def iter_product_chunks(csv_file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, report: Optional[LoadReport] = None) -> Iterator[List[Dict]]:
+    """
+    Stream parsed product rows from a CSV file in chunks of at most chunk_size.
+    Within a chunk the last row for a SKU wins.
+    """
+    with open(csv_file_path, "r", encoding="utf-8", newline="") as file:
+        chunk: Dict[object, Dict] = {}
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            try:
+                product = parse_product_row(row)
+            except ValueError as e:
+                print(f"Skipping line {line_number} of {csv_file_path}: {e}")
+                product = None
+            if product is None:
+                if report is not None:
+                    report.skipped += 1
+                continue
+            # Rows without a SKU cannot conflict with each other
+            key = product["sku"] if product["sku"] is not None else ("line", line_number)
+            chunk[key] = product
+            if len(chunk) >= chunk_size:
+                yield list(chunk.values())
+                chunk = {}
+        if chunk:
+            yield list(chunk.values())
+
+def upsert_products(conn: Connection, rows: List[Dict]):
+    """
+    Insert product rows, updating existing products with the same SKU
+    """
+    if not rows:
+        return
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql_insert(models.Product)
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(models.Product)
+    else:
+        conn.execute(models.Product.__table__.insert(), rows)
+        return
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Product.sku],
+        set_={**{c: stmt.excluded[c] for c in UPDATE_COLUMNS}, "updated_at": func.now()},
+        where=models.Product.content_hash.is_distinct_from(stmt.excluded.content_hash)
+    )
+    conn.execute(stmt, rows)
+
+def copy_products(conn: Connection, rows: List[Dict]):
+    """
+    PostgreSQL fast path: COPY the chunk into a temporary staging table and
+    upsert from there in one statement
+    """
+    if not rows:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[c] is None else row[c] for c in PRODUCT_COLUMNS])
+    buffer.seek(0)
+    
+    columns = ", ".join(PRODUCT_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in UPDATE_COLUMNS)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS products_staging "
+            f"(LIKE products INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        cursor.copy_expert(f"COPY products_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO products ({columns}) SELECT {columns} FROM products_staging "
+            f"ON CONFLICT (sku) DO UPDATE SET {updates}, updated_at = now() "
+            f"WHERE products.content_hash IS DISTINCT FROM EXCLUDED.content_hash"
+        )
+    finally:
+        cursor.close()
+
+def supports_copy(engine: Engine) -> bool:
+    """COPY is used on PostgreSQL through psycopg2"""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+def load_products(
+    csv_file_path: str,
+    engine: Optional[Engine] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    use_copy: Optional[bool] = None,
+    verbose: bool = True,
+    build_vector_index: bool = True
+) -> LoadReport:
+    """
+    Bulk load a product CSV file, one transaction per chunk, reporting
+    per-chunk throughput, then rebuild the product vector index
+    """
+    if engine is None:
+        from backend.database import engine
+    if use_copy is None:
+        use_copy = supports_copy(engine)
+    write_chunk = copy_products if use_copy else upsert_products
+    
+    report = LoadReport()
+    started = time.perf_counter()
+    for chunk in iter_product_chunks(csv_file_path, chunk_size, report):
+        chunk_started = time.perf_counter()
+        with engine.begin() as conn:
+            write_chunk(conn, chunk)
+        elapsed = time.perf_counter() - chunk_started
+        report.rows += len(chunk)
+        report.chunks += 1
+        if verbose:
+            print(f"Chunk {report.chunks}: {len(chunk)} rows in {elapsed:.2f}s ({len(chunk) / elapsed:,.0f} rows/s)")
+    report.seconds = time.perf_counter() - started
+    
+    # Which products changed is not tracked here, so caches reload everything
+    if report.rows:
+        change = catalog_events.CatalogChange(full_reload=True)
+        with engine.begin() as conn:
+            catalog_events.record(conn, change)
+        if build_vector_index and settings.VECTOR_INDEX_PATH:
+            index_started = time.perf_counter()
+            index = vector_index.build_index(engine)
+            if verbose:
+                print(f"Vector index: {len(index)} products in {time.perf_counter() - index_started:.2f}s")
+        catalog_events.publish(change)
+    
+    if verbose:
+        print(
+            f"Loaded {report.rows} products from {csv_file_path} in {report.seconds:.2f}s "
+            f"({report.rows_per_second:,.0f} rows/s, {report.skipped} rows skipped, "
+            f"{'COPY' if use_copy else 'executemany'})"
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load products from a CSV file")
+    parser.add_argument("csv_file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--no-copy", action="store_true", help="Use executemany upserts even on PostgreSQL")
+    parser.add_argument("--skip-vector-index", action="store_true", help="Do not rebuild the product vector index")
+    args = parser.parse_args()
+    
+    from backend.database import create_tables
+    create_tables()
+    load_products(
+        args.csv_file,
+        chunk_size=args.chunk_size,
+        use_copy=False if args.no_copy else None,
+        build_vector_index=not args.skip_vector_index
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Catalogue change events
+
+Writers (loaders, catalogue sync, crud.create_product) describe what changed
+as a CatalogChange. Changes are recorded in the catalog_changes table in the
+writer's transaction and published to in-process subscribers. API workers
+that did not make the change pick it up by polling the table, so caches
+derived from products are invalidated selectively across processes.
+
+Ids are handed out when a row is inserted, not when it commits, so a long
+loader transaction can commit below ids a poll has already read. Holes in
+the ids a poll skips over are remembered and read again until they fill;
+one still open after CATALOG_GAP_SECONDS (a rollback, or a transaction
+longer than that) reloads the caches. Each worker stores the position below
+which it has read everything in catalog_readers, and rows below the lowest
+position of the workers polled within CATALOG_READER_TIMEOUT_SECONDS are
+deleted.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import models
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CatalogChange:
+    """Product ids touched by one catalogue write; full_reload when unknown"""
+    inserted: List[int] = field(default_factory=list)
+    updated: List[int] = field(default_factory=list)
+    deleted: List[int] = field(default_factory=list)
+    full_reload: bool = False
+    
+    @property
+    def is_empty(self) -> bool:
+        return not (self.inserted or self.updated or self.deleted or self.full_reload)
+    
+    @property
+    def product_ids(self) -> List[int]:
+        return self.inserted + self.updated + self.deleted
+
+Subscriber = Callable[[CatalogChange], None]
+
+# Change log rows read per query
+POLL_BATCH = 10_000
+# Holes in the change log ids awaited at once; past this the caches are reloaded
+MAX_GAPS = 100
+
+_subscribers: List[Subscriber] = []
+_lock = threading.Lock()
+_version = 0
+_last_change_id: Optional[int] = None
+# Ids below _last_change_id not read yet: (first, last, monotonic time noticed)
+_gaps: List[Tuple[int, int, float]] = []
+_reader = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_registered = False
+
+def subscribe(callback: Subscriber):
+    """Register a callback invoked for every catalogue change"""
+    with _lock:
+        _subscribers.append(callback)
+
+def get_version() -> int:
+    """Monotonic counter bumped by every published change in this process"""
+    return _version
+
+def publish(change: CatalogChange):
+    """Notify in-process subscribers of a change"""
+    global _version
+    if change.is_empty:
+        return
+    with _lock:
+        _version += 1
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(change)
+        except Exception:
+            logger.exception("Error in catalogue change subscriber")
+
+def record(conn: Connection, change: CatalogChange):
+    """
+    Write a change to the catalog_changes log inside the caller's transaction
+    so other processes can replay it
+    """
+    if change.is_empty:
+        return
+    rows = (
+        [{"product_id": pid, "change_type": "insert"} for pid in change.inserted] +
+        [{"product_id": pid, "change_type": "update"} for pid in change.updated] +
+        [{"product_id": pid, "change_type": "delete"} for pid in change.deleted]
+    )
+    if change.full_reload:
+        rows.append({"product_id": None, "change_type": "reload"})
+    conn.execute(insert(models.CatalogChange), rows)
+
+def _mark_read(change_id: int, now: float):
+    """Move past a change log id, opening a gap for the ids skipped or closing the one it fills"""
+    global _last_change_id
+    if change_id > _last_change_id:
+        if change_id > _last_change_id + 1:
+            _gaps.append((_last_change_id + 1, change_id - 1, now))
+        _last_change_id = change_id
+        return
+    for index, (first, last, noticed) in enumerate(_gaps):
+        if first <= change_id <= last:
+            _gaps[index:index + 1] = [
+                (start, end, noticed) for start, end in ((first, change_id - 1), (change_id + 1, last)) if start <= end
+            ]
+            return
+
+def _close_gaps(now: float) -> bool:
+    """Give up on gaps open too long, or too many of them; True when caches must be reloaded"""
+    if len(_gaps) > MAX_GAPS:
+        logger.warning("%d holes in the catalogue change log; reloading caches", len(_gaps))
+        _gaps.clear()
+        return True
+    expired = [(first, last) for first, last, noticed in _gaps if now - noticed > settings.CATALOG_GAP_SECONDS]
+    if not expired:
+        return False
+    for first, last in expired:
+        logger.info("Catalogue change ids %d-%d never committed (rolled back or too slow); reloading caches", first, last)
+    _gaps[:] = [gap for gap in _gaps if now - gap[2] <= settings.CATALOG_GAP_SECONDS]
+    return True
+
+async def _store_position(db: AsyncSession) -> bool:
+    """
+    Save this worker's position and prune the rows every live worker has
+    read; True when this worker had been given up on, so rows it needed may
+    be gone
+    """
+    global _registered
+    readers = models.CatalogReader
+    now = datetime.now(timezone.utc)
+    position = _gaps[0][0] - 1 if _gaps else _last_change_id
+    result = await db.execute(
+        update(readers).where(readers.reader == _reader).values(position=position, polled_at=now)
+    )
+    lost = False
+    if result.rowcount == 0:
+        await db.execute(insert(readers).values(reader=_reader, position=position, polled_at=now))
+        lost = _registered
+        _registered = True
+    await db.execute(
+        delete(readers).where(readers.polled_at < now - timedelta(seconds=settings.CATALOG_READER_TIMEOUT_SECONDS))
+    )
+    # Strictly below, so the newest row stays and SQLite never reuses its id
+    oldest = (await db.execute(select(func.min(readers.position)))).scalar_one()
+    await db.execute(delete(models.CatalogChange).where(models.CatalogChange.id < oldest))
+    await db.commit()
+    return lost
+
+async def poll(db: AsyncSession) -> int:
+    """
+    Publish changes logged by other processes since the previous poll and
+    return how many were read. The first poll only records the current
+    position.
+    """
+    global _last_change_id
+    table = models.CatalogChange
+    if _last_change_id is None:
+        result = await db.execute(select(func.coalesce(func.max(table.id), 0)))
+        _last_change_id = result.scalar_one()
+        await _store_position(db)
+        return 0
+    
+    read = 0
+    after = None
+    while True:
+        unread = or_(table.id > _last_change_id, *(table.id.between(first, last) for first, last, _ in _gaps))
+        query = select(table.id, table.product_id, table.change_type).where(unread)
+        if after is not None:
+            query = query.where(table.id > after)
+        rows = (await db.execute(query.order_by(table.id).limit(POLL_BATCH))).all()
+        now = time.monotonic()
+        change = CatalogChange()
+        for row in rows:
+            _mark_read(row.id, now)
+            if row.change_type == "reload":
+                change.full_reload = True
+            elif row.change_type == "insert":
+                change.inserted.append(row.product_id)
+            elif row.change_type == "update":
+                change.updated.append(row.product_id)
+            elif row.change_type == "delete":
+                change.deleted.append(row.product_id)
+        publish(change)
+        read += len(rows)
+        if len(rows) < POLL_BATCH:
+            break
+        after = rows[-1].id
+    
+    reload = _close_gaps(time.monotonic())
+    if await _store_position(db) or reload:
+        publish(CatalogChange(full_reload=True))
+    return read
+
+async def poll_forever(session_factory, interval: float):
+    """Background task: poll the change log every `interval` seconds"""
+    while True:
+        try:
+            async with session_factory() as db:
+                await poll(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error polling catalogue changes")
+        await asyncio.sleep(interval)
@@ -0,0 +1,230 @@
+"""
+Incremental catalogue sync
+
+Applies a product CSV as a delta against the products table, keyed by SKU:
+- every row is hashed (bulk_load.compute_content_hash) and compared with the
+  stored content_hash of the same SKU
+- new SKUs are inserted, changed rows updated (updated_at = now), unchanged
+  rows are not written at all
+- with delete_missing, products whose SKU is absent from the file are deleted
+  (the file's SKUs are staged in a temporary table and missing products
+  found with an anti-join, so memory does not grow with the catalogue)
+
+Each chunk is applied in one transaction together with its catalog_changes
+log entries, so caches are invalidated only for the products that changed;
+the vector index re-embeds just those products at the end of the run.
+Rows without a SKU cannot be matched across runs and are skipped.
+
+Usage:
+    python -m backend.catalog_sync backend/sample_products.csv --delete-missing
+"""
+import argparse
+import csv
+import io
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, MetaData, String, Table, bindparam, delete, exists, func, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from backend import bulk_load, catalog_events, models, vector_index
+from backend.config import settings
+
+DELETE_BATCH_SIZE = 1000
+
+# SKUs of the file being synced with delete_missing; a temporary table on
+# the sync's connection
+seen_skus = Table("catalog_sync_seen_skus", MetaData(), Column("sku", String, index=True), prefixes=["TEMPORARY"])
+
+@dataclass
+class SyncReport:
+    """Totals of a catalogue sync"""
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def sync_chunk(conn: Connection, rows: List[Dict]) -> catalog_events.CatalogChange:
+    """
+    Insert new and update changed products of one chunk; returns the ids touched
+    """
+    change = catalog_events.CatalogChange()
+    if not rows:
+        return change
+    
+    existing = {
+        row.sku: (row.id, row.content_hash)
+        for row in conn.execute(
+            select(models.Product.sku, models.Product.id, models.Product.content_hash)
+            .where(models.Product.sku.in_([r["sku"] for r in rows]))
+        )
+    }
+    
+    new_rows = []
+    changed_rows = []
+    for row in rows:
+        current = existing.get(row["sku"])
+        if current is None:
+            new_rows.append(row)
+        elif current[1] != row["content_hash"]:
+            changed_rows.append({**row, "product_id": current[0]})
+    
+    if new_rows:
+        result = conn.execute(
+            insert(models.Product).returning(models.Product.id, sort_by_parameter_order=True),
+            new_rows
+        )
+        change.inserted = list(result.scalars())
+    
+    if changed_rows:
+        conn.execute(
+            update(models.Product)
+            .where(models.Product.id == bindparam("product_id"))
+            .values(
+                **{c: bindparam(f"new_{c}") for c in bulk_load.UPDATE_COLUMNS},
+                updated_at=func.now()
+            )
+            .execution_options(synchronize_session=False),
+            [
+                {"product_id": row["product_id"], **{f"new_{c}": row[c] for c in bulk_load.UPDATE_COLUMNS}}
+                for row in changed_rows
+            ]
+        )
+        change.updated = [row["product_id"] for row in changed_rows]
+    
+    catalog_events.record(conn, change)
+    return change
+
+def stage_seen_skus(conn: Connection, skus: List[str]):
+    """Add a chunk's SKUs to the staging table, with COPY on PostgreSQL"""
+    if not skus:
+        return
+    if not bulk_load.supports_copy(conn.engine):
+        conn.execute(insert(seen_skus), [{"sku": sku} for sku in skus])
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([sku] for sku in skus)
+    buffer.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {seen_skus.name} (sku) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+def delete_missing_products(conn: Connection) -> List[int]:
+    """
+    Delete products whose SKU is not in the staging table, in batches of
+    DELETE_BATCH_SIZE, one transaction each
+    """
+    product = models.Product
+    missing = (
+        select(product.id)
+        .where(product.sku.is_not(None), ~exists().where(seen_skus.c.sku == product.sku))
+        .order_by(product.id)
+        .limit(DELETE_BATCH_SIZE)
+    )
+    deleted = []
+    last_id = 0
+    while True:
+        with conn.begin():
+            batch = list(conn.execute(missing.where(product.id > last_id)).scalars())
+            if not batch:
+                return deleted
+            conn.execute(delete(product).where(product.id.in_(batch)))
+            catalog_events.record(conn, catalog_events.CatalogChange(deleted=batch))
+        deleted += batch
+        last_id = batch[-1]
+
+def sync_products(
+    csv_file_path: str,
+    engine: Optional[Engine] = None,
+    chunk_size: int = bulk_load.DEFAULT_CHUNK_SIZE,
+    delete_missing: bool = False,
+    verbose: bool = True
+) -> SyncReport:
+    """
+    Apply a product CSV as a delta, one transaction per chunk
+    """
+    if engine is None:
+        from backend.database import engine
+    
+    report = SyncReport()
+    total_change = catalog_events.CatalogChange()
+    load_report = bulk_load.LoadReport()
+    started = time.perf_counter()
+    
+    # One connection for the run, so the SKU staging table stays visible
+    with engine.connect() as conn:
+        if delete_missing:
+            with conn.begin():
+                seen_skus.drop(conn, checkfirst=True)
+                seen_skus.create(conn)
+        try:
+            for chunk in bulk_load.iter_product_chunks(csv_file_path, chunk_size, load_report):
+                rows = [row for row in chunk if row["sku"] is not None]
+                report.skipped += len(chunk) - len(rows)
+                
+                with conn.begin():
+                    change = sync_chunk(conn, rows)
+                    if delete_missing:
+                        stage_seen_skus(conn, [row["sku"] for row in rows])
+                catalog_events.publish(change)
+                total_change.inserted += change.inserted
+                total_change.updated += change.updated
+                
+                report.rows += len(rows)
+                report.inserted += len(change.inserted)
+                report.updated += len(change.updated)
+                report.unchanged += len(rows) - len(change.inserted) - len(change.updated)
+            
+            if delete_missing:
+                deleted = delete_missing_products(conn)
+                report.deleted = len(deleted)
+                total_change.deleted = deleted
+        finally:
+            if delete_missing:
+                # Pooled connections outlive the run, and the table with them
+                if conn.in_transaction():
+                    conn.rollback()
+                with conn.begin():
+                    seen_skus.drop(conn, checkfirst=True)
+    
+    # Re-embed only the products that changed
+    if not total_change.is_empty and settings.VECTOR_INDEX_PATH:
+        vector_index.update_index(engine, total_change)
+    if total_change.deleted:
+        catalog_events.publish(catalog_events.CatalogChange(deleted=total_change.deleted))
+    
+    report.skipped += load_report.skipped
+    report.seconds = time.perf_counter() - started
+    
+    if verbose:
+        print(
+            f"Synced {report.rows} products from {csv_file_path} in {report.seconds:.2f}s "
+            f"({report.rows_per_second:,.0f} rows/s): {report.inserted} inserted, "
+            f"{report.updated} updated, {report.unchanged} unchanged, "
+            f"{report.deleted} deleted, {report.skipped} skipped"
+        )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync products from a CSV file")
+    parser.add_argument("csv_file")
+    parser.add_argument("--chunk-size", type=int, default=bulk_load.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--delete-missing", action="store_true", help="Delete products whose SKU is not in the file")
+    args = parser.parse_args()
+    
+    from backend.database import create_tables
+    create_tables()
+    sync_products(args.csv_file, chunk_size=args.chunk_size, delete_missing=args.delete_missing)
+
+if __name__ == "__main__":
+    main()
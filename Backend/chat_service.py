@@ -2,135 +2,305 @@
 Chat service for handling LLM integration and business logic
 Milestone 5: LLM Integration and Business Logic
 """
+import logging
 import os
 import json
-from typing import Optional, Dict, Any
-from openai import OpenAI
-from sqlalchemy.orm import Session
-from backend import crud, models, schemas
+import time
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend import admission, async_crud, background_jobs, catalog_events, context_window, llm_router, metrics, models, product_cache, query_parser, schemas
+from backend.database import AsyncSessionLocal
+from backend.response_cache import fingerprint, llm_flights, response_cache
 from backend.config import settings
 
+EMPTY_RESPONSE = "I apologize, but I couldn't generate a response. Please try again."
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble processing your request right now. Please try again later."
+TITLE_PROMPT = (
+    "Write a title of at most six words for a shopping conversation that starts "
+    "with the user's message. Reply with the title only."
+)
+
+logger = logging.getLogger(__name__)
+
 class ChatService:
     """
-    Service class for handling chat functionality with Groq LLM integration
+    Service class for handling chat functionality with LLM integration
     """
     
     def __init__(self):
-        # Initialize xAI client using OpenAI-compatible interface
-        self.client = OpenAI(
-            base_url="https://api.x.ai/v1",
-            api_key=settings.GROQ_API_KEY
-        )
-        self.model = settings.GROQ_MODEL
+        # Registered OpenAI-compatible providers, each behind timeouts,
+        # retries and a circuit breaker, chosen per call by the router
+        self.llm = llm_router.create_router()
+        # New conversations get an LLM-written title once the turn is saved
+        background_jobs.job_runner.register("title", self._write_title)
+        # Bound the number of completions in flight so a burst of chats
+        # queues here instead of exhausting sockets and DB connections;
+        # a chat that waits too long for a slot is refused
+        self.llm_slots = admission.llm_slots
     
-    def process_chat_message(
+    async def process_chat_message(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         user_id: int, 
         message: str, 
-        conversation_id: Optional[int] = None
+        conversation_id: Optional[int] = None,
+        include_history: bool = True
     ) -> Dict[str, Any]:
         """
         Process a chat message through the complete pipeline:
-        1. Save user message to DB
+        1. Load the conversation and its history
         2. Generate AI response using LLM
-        3. Save AI response to DB
-        4. Return complete conversation context
-        """
-        
-        # Get or create conversation
-        if conversation_id:
-            conversation = crud.get_conversation(db, conversation_id)
-            if not conversation or conversation.user_id != user_id:
-                raise ValueError("Invalid conversation ID or access denied")
-        else:
-            # Create new conversation
-            conversation_data = schemas.ConversationCreate(
-                user_id=user_id,
-                title=self._generate_conversation_title(message)
-            )
-            conversation = crud.create_conversation(db, conversation_data)
-        
-        # Save user message
-        user_message_data = schemas.MessageCreate(
-            conversation_id=int(conversation.id),
-            content=message,
-            is_user_message=True
-        )
-        user_message = crud.create_message(db, user_message_data)
+        3. Save the conversation, user message and AI response in one transaction
+        4. Return complete conversation context (or only the new pair of
+           messages when include_history is False)
+        """
         
-        # Get conversation history for context
-        conversation_history = crud.get_conversation_messages(db, int(conversation.id))
+        with metrics.span("load_history"):
+            # Get existing conversation (None starts a new one)
+            conversation = await self._load_conversation(db, user_id, conversation_id)
+            
+            # Get conversation history once; the prompt only uses the part not
+            # yet folded into the rolling summary, so read just that part unless
+            # the full history is echoed back
+            conversation_history = []
+            summarized_until = 0
+            if conversation is not None:
+                summarized_until = conversation.summary_until_message_id or 0
+                conversation_history = await async_crud.get_conversation_messages(
+                    db, int(conversation.id), after_id=0 if include_history else summarized_until
+                )
+            recent_history = [m for m in conversation_history if m.id > summarized_until]
         
         # Generate AI response
-        ai_response = self._generate_ai_response(db, conversation_history, message)
+        ai_response, summary_update = await self._generate_ai_response(db, conversation, recent_history, message)
         
-        # Save AI message
-        ai_message_data = schemas.MessageCreate(
-            conversation_id=int(conversation.id),
-            content=ai_response,
-            is_user_message=False
-        )
-        ai_message = crud.create_message(db, ai_message_data)
+        # Save the whole turn
+        with metrics.span("save_turn"):
+            saved_conversation_id, user_message, ai_message = await async_crud.save_chat_turn(
+                db,
+                user_id=user_id,
+                conversation_id=int(conversation.id) if conversation is not None else None,
+                title=self._generate_conversation_title(message),
+                user_content=message,
+                ai_content=ai_response,
+                summary_update=summary_update
+            )
+        self._submit_title(conversation, saved_conversation_id, message)
         
-        # Get updated conversation messages
-        updated_messages = crud.get_conversation_messages(db, int(conversation.id))
+        # Previously loaded history plus the two new rows
+        updated_messages = [user_message, ai_message]
+        if include_history:
+            updated_messages = [schemas.Message.model_validate(m) for m in conversation_history] + updated_messages
         
         return {
-            "conversation_id": int(conversation.id),
+            "conversation_id": saved_conversation_id,
             "user_message": user_message,
             "ai_message": ai_message,
             "messages": updated_messages
         }
     
-    def _generate_ai_response(self, db: Session, conversation_history: list, current_message: str) -> str:
+    async def stream_chat_message(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        message: str,
+        conversation_id: Optional[int] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
         """
-        Generate AI response using Groq LLM with business logic
+        Streaming variant of process_chat_message. Yields (event, data) pairs:
+        - "start" once the conversation has been validated (conversation_id is
+          null for a new conversation)
+        - "token" for every content delta received from the LLM
+        - "done" after the turn has been persisted, with the new ids
         """
-        try:
-            # Build conversation context
-            messages = [
-                {
-                    "role": "system",
-                    "content": self._get_system_prompt()
-                }
-            ]
+        with metrics.span("load_history"):
+            conversation = await self._load_conversation(db, user_id, conversation_id)
             
-            # Add conversation history
-            for msg in conversation_history[:-1]:  # Exclude the current message
-                role = "user" if msg.is_user_message else "assistant"
-                messages.append({
-                    "role": role,
-                    "content": msg.content
-                })
+            recent_history = []
+            if conversation is not None:
+                recent_history = await async_crud.get_conversation_messages(
+                    db, int(conversation.id), after_id=conversation.summary_until_message_id or 0
+                )
+        
+        yield "start", {
+            "conversation_id": int(conversation.id) if conversation is not None else None
+        }
+        
+        parts = []
+        summary_update = None
+        try:
+            messages, summary_update = await self._build_llm_messages(db, conversation, recent_history, message)
+            await db.commit()
             
-            # Add current user message
-            messages.append({
-                "role": "user",
-                "content": current_message
-            })
+            prompt_fingerprint = fingerprint(messages, message, catalog_events.get_version())
+            cached = response_cache.get(prompt_fingerprint)
+            if cached is not None:
+                parts.append(cached)
+                yield "token", {"delta": cached}
+            else:
+                started = time.perf_counter()
+                async with self.llm_slots.slot():
+                    with metrics.span("llm"):
+                        stream = self.llm.stream(
+                            messages=messages,
+                            temperature=0.7,
+                            max_tokens=1000,
+                            stream_options={"include_usage": True}
+                        )
+                        async for chunk in stream:
+                            # The final chunk carries usage and no choices
+                            metrics.record_llm_usage(getattr(chunk, "usage", None))
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                parts.append(delta)
+                                yield "token", {"delta": delta}
+                if parts:
+                    response_cache.put(prompt_fingerprint, "".join(parts), time.perf_counter() - started)
+        except admission.AdmissionRejected:
+            raise
+        except llm_router.NoProviderError:
+            logger.warning("No LLM provider available; streaming the fallback response")
+            if not parts:
+                parts.append(FALLBACK_RESPONSE)
+                yield "token", {"delta": FALLBACK_RESPONSE}
+        except Exception:
+            logger.exception("Error streaming AI response")
+            if not parts:
+                parts.append(FALLBACK_RESPONSE)
+                yield "token", {"delta": FALLBACK_RESPONSE}
+        
+        # Persist the turn once, after generation completes
+        with metrics.span("save_turn"):
+            saved_conversation_id, user_message, ai_message = await async_crud.save_chat_turn(
+                db,
+                user_id=user_id,
+                conversation_id=int(conversation.id) if conversation is not None else None,
+                title=self._generate_conversation_title(message),
+                user_content=message,
+                ai_content="".join(parts) or EMPTY_RESPONSE,
+                summary_update=summary_update
+            )
+        self._submit_title(conversation, saved_conversation_id, message)
+        
+        yield "done", {
+            "conversation_id": saved_conversation_id,
+            "user_message_id": user_message.id,
+            "ai_message_id": ai_message.id
+        }
+    
+    async def _load_conversation(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        conversation_id: Optional[int]
+    ) -> Optional[models.Conversation]:
+        """
+        Load the user's conversation; None means a new conversation will be
+        created when the turn is saved
+        """
+        if not conversation_id:
+            return None
+        conversation = await async_crud.get_conversation(db, conversation_id)
+        if not conversation or conversation.user_id != user_id:
+            raise ValueError("Invalid conversation ID or access denied")
+        return conversation
+    
+    async def _build_llm_messages(
+        self,
+        db: AsyncSession,
+        conversation: Optional[models.Conversation],
+        recent_history: list,
+        current_message: str
+    ) -> Tuple[List[Dict[str, str]], Optional[Tuple[str, int]]]:
+        """
+        Build the chat completion messages within the context token budget:
+        system prompt, rolling summary, recent history, current message and
+        any relevant product context. Turns that no longer fit are folded
+        into the rolling summary, returned as (summary, summary_until_message_id)
+        so it can be saved with the turn.
+        """
+        # Check if we need to query product database
+        with metrics.span("product_search"):
+            product_context = await self._get_product_context(db, current_message)
+        
+        with metrics.span("build_prompt"):
+            summary = conversation.summary if conversation is not None else None
+            summary_until_message_id = None
+            history = list(recent_history)
+            while True:
+                messages, evicted = context_window.build_context(
+                    self._get_system_prompt(),
+                    history,
+                    current_message,
+                    budget=settings.CONTEXT_TOKEN_BUDGET,
+                    summary=summary,
+                    product_context=product_context
+                )
+                if not evicted:
+                    break
+                summary = context_window.extend_summary(summary, evicted, settings.CONTEXT_SUMMARY_TOKENS)
+                summary_until_message_id = int(evicted[-1].id)
+                history = history[len(evicted):]
+        
+        summary_update = (summary, summary_until_message_id) if summary_until_message_id else None
+        return messages, summary_update
+    
+    async def _generate_ai_response(
+        self,
+        db: AsyncSession,
+        conversation: Optional[models.Conversation],
+        recent_history: list,
+        current_message: str
+    ) -> Tuple[str, Optional[Tuple[str, int]]]:
+        """
+        Generate AI response using Groq LLM with business logic.
+        Returns the response text and any rolling summary update.
+        """
+        summary_update = None
+        try:
+            messages, summary_update = await self._build_llm_messages(db, conversation, recent_history, current_message)
             
-            # Check if we need to query product database
-            product_context = self._get_product_context(db, current_message)
-            if product_context:
-                messages.append({
-                    "role": "system",
-                    "content": f"Relevant product information: {product_context}"
-                })
+            # End the read transaction so no pooled connection is held
+            # while waiting on the LLM
+            await db.commit()
             
-            # Call xAI API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,  # type: ignore
-                temperature=0.7,
-                max_tokens=1000
-            )
+            # Identical (or, with the semantic tier, near-identical) prompts
+            # are answered from the response cache
+            prompt_fingerprint = fingerprint(messages, current_message, catalog_events.get_version())
+            cached = response_cache.get(prompt_fingerprint)
+            if cached is not None:
+                return cached, summary_update
             
-            return response.choices[0].message.content or "I apologize, but I couldn't generate a response. Please try again."
+            async def call_llm() -> Optional[str]:
+                started = time.perf_counter()
+                async with self.llm_slots.slot():
+                    response = await self.llm.complete(
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=1000
+                    )
+                metrics.record_llm_usage(response.usage)
+                content = response.choices[0].message.content
+                if content:
+                    response_cache.put(prompt_fingerprint, content, time.perf_counter() - started)
+                return content
             
-        except Exception as e:
-            print(f"Error generating AI response: {e}")
-            return "I apologize, but I'm having trouble processing your request right now. Please try again later."
+            # Identical prompts already waiting on the LLM share its call;
+            # every caller still saves its own messages
+            with metrics.span("llm"):
+                content = await llm_flights.do(prompt_fingerprint.key, call_llm)
+            return content or EMPTY_RESPONSE, summary_update
+        
+        except admission.AdmissionRejected:
+            raise
+        except llm_router.NoProviderError:
+            logger.warning("No LLM provider available; returning the fallback response")
+            return FALLBACK_RESPONSE, summary_update
+        except Exception:
+            logger.exception("Error generating AI response")
+            return FALLBACK_RESPONSE, summary_update
     
     def _get_system_prompt(self) -> str:
         """
@@ -151,20 +321,22 @@ class ChatService:
         Always be helpful and try to guide the customer towards finding what they need.
         """
     
-    def _get_product_context(self, db: Session, message: str) -> Optional[str]:
+    async def _get_product_context(self, db: AsyncSession, message: str) -> Optional[str]:
         """
         Search for relevant products based on the message content and return context
         """
         try:
-            # Simple keyword extraction for product search
-            products = crud.search_products(db, message)
+            # Reduce the message to keywords plus brand, category and price
+            # filters, then fetch the top 5 most relevant products
+            vocabulary = await query_parser.get_vocabulary(db)
+            parsed = query_parser.parse_query(message, vocabulary)
+            if parsed.is_empty:
+                return None
+            products = await product_cache.find_products(db, parsed, limit=5)
             
             if not products:
                 return None
             
-            # Limit to top 5 most relevant products
-            products = products[:5]
-            
             context_parts = []
             for product in products:
                 context_parts.append(
@@ -172,18 +344,44 @@ class ChatService:
                 )
             
             return "Available products:\n" + "\n".join(context_parts)
-            
-        except Exception as e:
-            print(f"Error getting product context: {e}")
+        
+        except Exception:
+            logger.exception("Error getting product context")
             return None
     
     def _generate_conversation_title(self, first_message: str) -> str:
         """
         Generate a title for the conversation based on the first message
         """
-        # Simple title generation - could be enhanced with LLM
+        # Used until (or instead of) the LLM-written title
         words = first_message.split()[:5]
-        title = " ".join(words)
+        return self._clip_title(" ".join(words)) or "New Conversation"
+    
+    def _clip_title(self, title: str) -> str:
+        title = title.strip().strip('"').strip()
         if len(title) > 50:
             title = title[:47] + "..."
-        return title or "New Conversation"
+        return title
+    
+    def _submit_title(self, conversation: Optional[models.Conversation], conversation_id: int, message: str):
+        """Queue an LLM-written title when the turn started a new conversation"""
+        if conversation is not None or not settings.LLM_TITLE_GENERATION:
+            return
+        background_jobs.job_runner.submit("title", {"conversation_id": conversation_id, "message": message})
+    
+    async def _write_title(self, payload: Dict[str, Any]):
+        """Background job: ask the fast tier for a title and store it"""
+        response = await self.llm.complete(
+            messages=[
+                {"role": "system", "content": TITLE_PROMPT},
+                {"role": "user", "content": payload["message"]},
+            ],
+            purpose="title",
+            temperature=0.3,
+            max_tokens=16
+        )
+        title = self._clip_title(response.choices[0].message.content or "")
+        if not title:
+            return
+        async with AsyncSessionLocal() as db:
+            await async_crud.update_conversation_title(db, payload["conversation_id"], title)
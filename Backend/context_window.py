@@ -0,0 +1,92 @@
+"""
+Token-budgeted conversation context for LLM prompts
+
+Keeps the system prompt, product context and the most recent turns within a
+token budget. Turns that no longer fit are folded into a rolling summary
+stored on the conversation, which is extended incrementally instead of being
+recomputed from the whole history.
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _encoding = None
+
+# Fixed cost of the role/separator tokens around every chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Longest excerpt of a single message kept in the rolling summary
+SUMMARY_LINE_CHARS = 200
+
+def count_tokens(text: str) -> int:
+    """Tokens in a piece of text (tiktoken when available, else ~4 chars per token)"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    """Tokens of a list of chat completion messages, including per-message overhead"""
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+def summarize_message(is_user_message: bool, content: str) -> str:
+    """One compact summary line for a message"""
+    speaker = "User" if is_user_message else "Assistant"
+    text = re.sub(r"\s+", " ", content).strip()
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3].rstrip() + "..."
+    return f"{speaker}: {text}"
+
+def extend_summary(summary: Optional[str], evicted: Sequence, max_tokens: int) -> str:
+    """
+    Append compact lines for newly evicted messages to the rolling summary,
+    dropping its oldest lines if it grows past max_tokens
+    """
+    lines = summary.splitlines() if summary else []
+    lines.extend(summarize_message(m.is_user_message, m.content) for m in evicted)
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def build_context(
+    system_prompt: str,
+    history: Sequence,
+    current_message: str,
+    budget: int,
+    summary: Optional[str] = None,
+    product_context: Optional[str] = None
+) -> Tuple[List[Dict[str, str]], List]:
+    """
+    Assemble chat completion messages within `budget` tokens.
+    
+    `history` holds the not yet summarized messages before the current one,
+    oldest first. The newest turns that fit are kept verbatim; the rest are
+    returned as the second element so the caller can fold them into the
+    summary. The system prompt, summary, product context and current message
+    are always included.
+    """
+    head = [{"role": "system", "content": system_prompt}]
+    if summary:
+        head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    tail = [{"role": "user", "content": current_message}]
+    if product_context:
+        tail.append({"role": "system", "content": f"Relevant product information: {product_context}"})
+    
+    remaining = budget - count_message_tokens(head) - count_message_tokens(tail)
+    kept: List[Dict[str, str]] = []
+    cut = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        msg = history[index]
+        cost = count_tokens(msg.content) + MESSAGE_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        remaining -= cost
+        kept.append({"role": "user" if msg.is_user_message else "assistant", "content": msg.content})
+        cut = index
+    
+    kept.reverse()
+    return head + kept + tail, list(history[:cut])
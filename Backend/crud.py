@@ -1,18 +1,25 @@
 """
 CRUD operations for database models
 """
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import Optional, List
-from backend import models, schemas
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy import and_, desc, func, or_, select
+from typing import Optional, List, Tuple
+from backend import catalog_events, models, query_parser, schemas, search
+
+# Characters of the last message shown in conversation listings
+MESSAGE_PREVIEW_CHARS = 120
 
 # Product CRUD operations
 def create_product(db: Session, product: schemas.ProductCreate) -> models.Product:
     """Create a new product"""
     db_product = models.Product(**product.model_dump())
     db.add(db_product)
+    db.flush()
+    change = catalog_events.CatalogChange(inserted=[db_product.id])
+    catalog_events.record(db.connection(), change)
     db.commit()
     db.refresh(db_product)
+    catalog_events.publish(change)
     return db_product
 
 def get_product(db: Session, product_id: int) -> Optional[models.Product]:
@@ -23,15 +30,11 @@ def get_products(db: Session, skip: int = 0, limit: int = 100) -> List[models.Pr
     """Get list of products"""
     return db.query(models.Product).offset(skip).limit(limit).all()
 
-def search_products(db: Session, query: str) -> List[models.Product]:
-    """Search products by name, category, or brand"""
-    search_term = f"%{query}%"
-    return db.query(models.Product).filter(
-        (models.Product.name.ilike(search_term)) |
-        (models.Product.category.ilike(search_term)) |
-        (models.Product.brand.ilike(search_term)) |
-        (models.Product.description.ilike(search_term))
-    ).all()
+def search_products(db: Session, query: str, limit: int = 20, offset: int = 0) -> List[models.Product]:
+    """Full-text search over name, category, brand and description, best matches first"""
+    terms = query_parser.tokenize(query)
+    stmt = search.build_search_statement(db.get_bind().dialect.name, terms, limit=limit, offset=offset)
+    return list(db.execute(stmt).scalars().all())
 
 # User CRUD operations
 def create_user(db: Session, user: schemas.UserCreate) -> models.User:
@@ -59,16 +62,64 @@ def create_conversation(db: Session, conversation: schemas.ConversationCreate) -
     db.refresh(db_conversation)
     return db_conversation
 
-def get_conversation(db: Session, conversation_id: int) -> Optional[models.Conversation]:
-    """Get a conversation by ID"""
-    return db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+def get_conversation(db: Session, conversation_id: int, include_messages: bool = False) -> Optional[models.Conversation]:
+    """Get a conversation by ID, optionally with its messages loaded in one extra query"""
+    query = db.query(models.Conversation)
+    if include_messages:
+        query = query.options(selectinload(models.Conversation.messages))
+    return query.filter(models.Conversation.id == conversation_id).first()
 
 def get_user_conversations(db: Session, user_id: int) -> List[models.Conversation]:
-    """Get all conversations for a user"""
-    return db.query(models.Conversation).filter(
+    """Get all conversations for a user with their messages (loaded in one extra query)"""
+    return db.query(models.Conversation).options(
+        selectinload(models.Conversation.messages)
+    ).filter(
         models.Conversation.user_id == user_id
     ).order_by(desc(models.Conversation.updated_at)).all()
 
+def get_user_conversation_summaries(db: Session, user_id: int) -> List[schemas.ConversationSummary]:
+    """
+    Get a user's conversations with message count and last message preview,
+    computed in a single aggregated query
+    """
+    user_conversation_ids = select(models.Conversation.id).where(models.Conversation.user_id == user_id)
+    stats = select(
+        models.Message.conversation_id,
+        func.count(models.Message.id).label("message_count"),
+        func.max(models.Message.id).label("last_message_id")
+    ).where(
+        models.Message.conversation_id.in_(user_conversation_ids)
+    ).group_by(models.Message.conversation_id).subquery()
+    last_message = aliased(models.Message)
+    
+    rows = db.execute(
+        select(
+            models.Conversation,
+            func.coalesce(stats.c.message_count, 0),
+            func.substr(last_message.content, 1, MESSAGE_PREVIEW_CHARS),
+            last_message.timestamp
+        )
+        .outerjoin(stats, stats.c.conversation_id == models.Conversation.id)
+        .outerjoin(last_message, last_message.id == stats.c.last_message_id)
+        .where(models.Conversation.user_id == user_id)
+        .order_by(desc(models.Conversation.updated_at))
+    ).all()
+    
+    return [
+        schemas.ConversationSummary(
+            id=conversation.id,
+            user_id=conversation.user_id,
+            title=conversation.title,
+            is_active=conversation.is_active,
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at,
+            message_count=message_count,
+            last_message_preview=preview,
+            last_message_at=last_message_at
+        )
+        for conversation, message_count, preview, last_message_at in rows
+    ]
+
 # Message CRUD operations
 def create_message(db: Session, message: schemas.MessageCreate) -> models.Message:
     """Create a new message"""
@@ -78,8 +129,47 @@ def create_message(db: Session, message: schemas.MessageCreate) -> models.Messag
     db.refresh(db_message)
     return db_message
 
-def get_conversation_messages(db: Session, conversation_id: int) -> List[models.Message]:
-    """Get all messages for a conversation in chronological order"""
-    return db.query(models.Message).filter(
-        models.Message.conversation_id == conversation_id
-    ).order_by(models.Message.timestamp).all()
+def get_conversation_messages(
+    db: Session,
+    conversation_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+) -> Tuple[List[models.Message], bool]:
+    """
+    Get messages for a conversation in chronological order, paged with keyset
+    cursors on (timestamp, id). `before`/`after` are message ids; without a
+    cursor the most recent `limit` messages are returned. Also returns
+    whether more messages exist beyond the page in the direction read.
+    Raises ValueError for a cursor that is not a message of the conversation.
+    """
+    query = db.query(models.Message).filter(models.Message.conversation_id == conversation_id)
+    
+    cursor_id = after if after is not None else before
+    if cursor_id is not None:
+        in_conversation = and_(models.Message.id == cursor_id, models.Message.conversation_id == conversation_id)
+        if db.query(models.Message.id).filter(in_conversation).first() is None:
+            raise ValueError(f"Message {cursor_id} is not in conversation {conversation_id}")
+        # Compared in SQL, as stored, rather than round-tripped through Python
+        cursor_timestamp = select(models.Message.timestamp).where(in_conversation).scalar_subquery()
+        if after is not None:
+            query = query.filter(or_(
+                models.Message.timestamp > cursor_timestamp,
+                and_(models.Message.timestamp == cursor_timestamp, models.Message.id > cursor_id)
+            ))
+        else:
+            query = query.filter(or_(
+                models.Message.timestamp < cursor_timestamp,
+                and_(models.Message.timestamp == cursor_timestamp, models.Message.id < cursor_id)
+            ))
+    
+    if limit is None:
+        return query.order_by(models.Message.timestamp, models.Message.id).all(), False
+    
+    if after is not None:
+        rows = query.order_by(models.Message.timestamp, models.Message.id).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+    
+    # Newest first to take the page closest to the cursor, then back to chronological
+    rows = query.order_by(desc(models.Message.timestamp), desc(models.Message.id)).limit(limit + 1).all()
+    return list(reversed(rows[:limit])), len(rows) > limit
@@ -2,23 +2,149 @@
 Database configuration and session management
 Milestone 2: Database Setup and Data Ingestion
 """
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 from backend.config import settings
 
+# Async drivers used for the non-blocking chat pipeline
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Upper bounds (ms) of the checkout wait histogram buckets
+POOL_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, float("inf"))
+
+class PoolMetrics:
+    """
+    Checkout counters and wait-time histogram for one connection pool
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_buckets = [0] * len(POOL_WAIT_BUCKETS_MS)
+    
+    def record_checkout(self, waited: float, timed_out: bool = False):
+        waited_ms = waited * 1000
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            for i, bound in enumerate(POOL_WAIT_BUCKETS_MS):
+                if waited_ms <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / attempts, 6) if attempts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_ms_buckets": {
+                    ("+Inf" if bound == float("inf") else str(bound)): count
+                    for bound, count in zip(POOL_WAIT_BUCKETS_MS, self.wait_buckets)
+                },
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+    
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool, InstrumentedQueuePool):
+    """Async-adapted variant of InstrumentedQueuePool for the async engine"""
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Map a sync DATABASE_URL onto the equivalent async driver URL
+    """
+    scheme, sep, rest = database_url.partition("://")
+    backend = scheme.split("+", 1)[0]
+    if backend == "postgres":
+        backend = "postgresql"
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend: {backend}")
+    return f"{ASYNC_DRIVERS[backend]}{sep}{rest}"
+
+def get_engine_options(database_url: str, is_async: bool = False) -> Dict[str, Any]:
+    """
+    Pick the pool for a database URL. In-memory SQLite has to share a single
+    connection (StaticPool); everything else gets a sized, recycled and
+    pre-pinged queue pool so concurrent requests use separate connections.
+    """
+    options: Dict[str, Any] = {"echo": settings.DEBUG}
+    is_sqlite = database_url.startswith("sqlite")
+    
+    if is_sqlite and not is_async:
+        options["connect_args"] = {"check_same_thread": False}
+    
+    if is_sqlite and (":memory:" in database_url or database_url.rstrip("/").endswith("sqlite:")):
+        options["poolclass"] = StaticPool
+        return options
+    
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    return options
+
 # Create database engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    poolclass=StaticPool,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-    echo=settings.DEBUG
-)
+engine = create_engine(settings.DATABASE_URL, **get_engine_options(settings.DATABASE_URL))
+
+# Create async database engine
+ASYNC_DATABASE_URL = get_async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **get_engine_options(ASYNC_DATABASE_URL, is_async=True))
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create AsyncSessionLocal class (objects stay usable after commit, no lazy IO)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -32,8 +158,43 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """
+    Dependency to get async database session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Current utilization and checkout metrics of the sync and async engine pools
+    """
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        entry: Dict[str, Any] = {"pool_class": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                max_overflow=pool._max_overflow,
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(0, pool.overflow()),
+            )
+        metrics = getattr(pool, "metrics", None)
+        if metrics is not None:
+            entry.update(metrics.snapshot())
+        stats[name] = entry
+    return stats
+
 def create_tables():
     """
-    Create all tables in the database
+    Create all tables in the database, plus the full-text search index.
+    Indexes added to an existing table are created as well.
     """
+    from backend import search
+    
     Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    search.ensure_search_index(engine)
@@ -0,0 +1,110 @@
+"""
+Group commit: many callers' writes in one transaction
+
+A GroupCommitter collects items submitted by concurrent requests and writes
+them with one call of its batch writer (multi-row statements) and a single
+commit, so a burst of N writes costs one transaction and one fsync instead
+of N. A batch is written once the first waiting item is `window` seconds
+old or `max_batch` items are waiting; while a batch is being written the
+next one fills up, so under load batches grow to what the database keeps up
+with.
+
+Durability: submit() returns only after the transaction holding the item
+has committed, so an acknowledged write is as durable as one committed on
+its own; a write whose submit() has not returned may be lost by a crash,
+like any uncommitted transaction. The submitter being cancelled (a client
+disconnect) does not cancel the write. When a batch fails its items are
+retried one transaction each, so a bad item fails only its own caller.
+Batches are written one at a time in submission order.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+# Writes the items on the session, commits, and returns one result per item
+BatchWriter = Callable[[AsyncSession, Sequence[Any]], Awaitable[List[Any]]]
+
+class GroupCommitter:
+    """Batches concurrent writes into one transaction per window"""
+    
+    def __init__(self, write_batch: BatchWriter, session_factory, window: float, max_batch: int, name: str = "default"):
+        self.write_batch = write_batch
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.name = name
+        # (item, future, submitted at) in submission order
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._full: Optional[asyncio.Event] = None
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+    
+    async def submit(self, item: Any) -> Any:
+        """Write `item` with the next batch; its result once the batch has committed"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.monotonic()))
+        if self._flusher is None or self._flusher.done():
+            self._full = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_pending())
+        elif len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await asyncio.shield(future)
+    
+    async def _flush_pending(self):
+        while self._pending:
+            # Let concurrent writes join until the oldest has waited a window
+            remaining = self._pending[0][2] + self.window - time.monotonic()
+            if remaining > 0 and len(self._pending) < self.max_batch:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            await self._write(batch)
+    
+    async def _write(self, batch: List[Tuple[Any, asyncio.Future, float]]):
+        started = time.perf_counter()
+        error = None
+        try:
+            async with self.session_factory() as db:
+                results = await self.write_batch(db, [item for item, _, _ in batch])
+        except Exception as e:
+            error = e
+        metrics.GROUP_COMMIT_SECONDS.observe(time.perf_counter() - started, committer=self.name)
+        if error is not None:
+            if len(batch) > 1:
+                logger.warning("Group commit of %d writes failed; committing them one by one", len(batch), exc_info=error)
+                self.fallbacks += 1
+                metrics.GROUP_COMMIT_FALLBACKS.inc(committer=self.name)
+                for entry in batch:
+                    await self._write([entry])
+            elif not batch[0][1].done():
+                batch[0][1].set_exception(error)
+            return
+        
+        self.batches += 1
+        self.items += len(batch)
+        metrics.GROUP_COMMIT_BATCH_SIZE.observe(len(batch), committer=self.name)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "writes": self.items,
+            "average_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "waiting": len(self._pending)
+        }
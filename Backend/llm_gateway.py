@@ -0,0 +1,409 @@
+"""
+Resilient gateway to an OpenAI-compatible chat completions API
+
+Every call goes through one LLMGateway per provider:
+- one pooled keep-alive HTTP client (HTTP/2 when the h2 package is
+  installed) with explicit connect, read, write and pool timeouts
+- an overall deadline per call covering all attempts
+- retries with full-jitter exponential backoff on connection errors,
+  timeouts, 429 and 5xx responses (Retry-After is honoured)
+- optional hedging: if a completion is still running after the recent p95
+  latency, a second identical request is sent and the first answer wins
+- a circuit breaker that fails fast once most recent calls failed and lets
+  a single probe through after the reset timeout
+
+Streams are retried only until their first chunk arrives; after that, tokens
+have been sent to the client and an error ends the stream.
+"""
+import asyncio
+import importlib.util
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Recent completion latencies kept for the hedging deadline, and how many
+# are needed before hedging starts
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+class LLMGatewayError(Exception):
+    """Base class of errors raised by the gateway itself"""
+
+class CircuitOpenError(LLMGatewayError):
+    """The provider is failing and calls are rejected without being sent"""
+
+class LLMTimeoutError(LLMGatewayError):
+    """The call did not finish within its overall deadline"""
+
+def is_retryable(error: BaseException) -> bool:
+    """Connection errors, timeouts, rate limits and server errors are worth another try"""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def counts_as_failure(error: BaseException) -> bool:
+    """Errors that say the provider is unhealthy (a 429 only says we are too fast)"""
+    if isinstance(error, openai.APIStatusError) and error.status_code == 429:
+        return False
+    return is_retryable(error)
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Seconds from a Retry-After header, if the error response carried one"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. When at least `min_calls` outcomes were recorded in
+    the last `window` seconds and `failure_rate` of them failed, the circuit
+    opens and calls are rejected for `reset_timeout` seconds; then it is
+    half-open and one probe call decides whether it closes or opens again.
+    
+    A failure rate rather than a count of consecutive failures, because with
+    many calls in flight fast error responses arrive in bursts ahead of the
+    slower successes.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 20, window: float = 10.0, reset_timeout: float = 30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+    
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be sent now"""
+        if self.failure_rate <= 0:
+            return
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("LLM provider circuit is open")
+    
+    def record_success(self):
+        self._record(False)
+    
+    def record_failure(self):
+        self._record(True)
+    
+    def release(self):
+        """Give up a half-open probe slot without a verdict (e.g. the call was cancelled)"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self._state != self.CLOSED:
+                # Only the probe's outcome counts outside the closed state
+                if not self._probe_in_flight:
+                    return
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                self._failures = 0
+                if failed:
+                    self._open(now, "the half-open probe failed")
+                else:
+                    self._state = self.CLOSED
+                    logger.info("LLM circuit closed")
+                return
+            
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._failures -= self._outcomes.popleft()[1]
+            if (
+                self.failure_rate > 0
+                and len(self._outcomes) >= self.min_calls
+                and self._failures >= self.failure_rate * len(self._outcomes)
+            ):
+                self._open(now, f"{self._failures} of {len(self._outcomes)} calls failed")
+                self._outcomes.clear()
+                self._failures = 0
+    
+    def _open(self, now: float, reason: str):
+        self._state = self.OPEN
+        self._opened_at = now
+        self.times_opened += 1
+        logger.warning("LLM circuit opened: %s", reason)
+
+class LLMGateway:
+    """Chat completions against one provider with timeouts, retries, hedging and a circuit breaker"""
+    
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        name: str = "default",
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        total_timeout: float = 60.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.25,
+        breaker_failure_rate: float = 0.5,
+        breaker_min_calls: int = 20,
+        breaker_window: float = 10.0,
+        breaker_reset: float = 30.0,
+        max_connections: int = 100,
+        keepalive_seconds: float = 30.0,
+        http2: bool = True
+    ):
+        self.name = name
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(breaker_failure_rate, breaker_min_calls, breaker_window, breaker_reset)
+        
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("h2 is not installed; the LLM client uses HTTP/1.1")
+            http2 = False
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_seconds
+            )
+        )
+        # Retries are ours, so the SDK must not retry on its own
+        self.client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=self.http_client,
+            timeout=timeout,
+            max_retries=0
+        )
+        
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+        }
+    
+    async def complete(self, **params) -> Any:
+        """chat.completions.create(**params) with retries, hedging and the circuit breaker"""
+        self._stats["calls"] += 1
+        try:
+            response = await self._with_retries(self._hedged_call, params)
+        except BaseException:
+            self._stats["failed"] += 1
+            raise
+        self._stats["succeeded"] += 1
+        return response
+    
+    async def stream(self, **params) -> AsyncIterator[Any]:
+        """
+        Streamed chat.completions.create(**params); connecting and waiting for
+        the first chunk are retried, the rest of the stream is not
+        """
+        self._stats["calls"] += 1
+        try:
+            stream, first = await self._with_retries(self._open_stream, params)
+        except BaseException:
+            self._stats["failed"] += 1
+            raise
+        self._stats["succeeded"] += 1
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
+    
+    async def _with_retries(self, call, params: Dict[str, Any]):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            remaining = deadline - loop.time()
+            verdict = False
+            try:
+                result = await asyncio.wait_for(call(params), timeout=max(remaining, 0.001))
+                self.breaker.record_success()
+                verdict = True
+                return result
+            except Exception as e:
+                error: BaseException = e
+                if counts_as_failure(error):
+                    self.breaker.record_failure()
+                    verdict = True
+                elif not is_retryable(error):
+                    # The provider answered; the request itself was bad
+                    self.breaker.record_success()
+                    verdict = True
+                    raise
+            finally:
+                if not verdict:
+                    self.breaker.release()
+            
+            if isinstance(error, asyncio.TimeoutError):
+                self._stats["timeouts"] += 1
+            remaining = deadline - loop.time()
+            if attempt >= self.max_retries or remaining <= 0:
+                if isinstance(error, asyncio.TimeoutError):
+                    raise LLMTimeoutError(f"LLM call exceeded {self.total_timeout:.1f}s") from error
+                raise error
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if delay >= remaining:
+                raise error
+            attempt += 1
+            self._stats["retries"] += 1
+            logger.info("Retrying LLM call (attempt %d) after %s", attempt + 1, type(error).__name__)
+            await asyncio.sleep(delay)
+    
+    async def _timed_call(self, params: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        response = await self.client.chat.completions.create(**params)
+        self._latencies.append(time.perf_counter() - started)
+        return response
+    
+    async def _hedged_call(self, params: Dict[str, Any]) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed_call(params)
+        
+        tasks = [asyncio.create_task(self._timed_call(params))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self._stats["hedged"] += 1
+                tasks.append(asyncio.create_task(self._timed_call(params)))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _open_stream(self, params: Dict[str, Any]):
+        stream = await self.client.chat.completions.create(stream=True, **params)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, first
+    
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a hedged request is sent, or None when hedging is off"""
+        if not self.hedge or self.breaker.state != CircuitBreaker.CLOSED or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.hedge_min_delay, percentile(list(self._latencies), self.hedge_percentile))
+    
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        return {
+            **self._stats,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+            "circuit_rejected": self.breaker.rejected,
+            "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        }
+    
+    async def aclose(self):
+        await self.http_client.aclose()
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of floats"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def create_gateway(name: str, base_url: str, api_key: str) -> LLMGateway:
+    """Gateway to one provider with the configured timeouts, retries and breaker"""
+    return LLMGateway(
+        base_url=base_url,
+        api_key=api_key,
+        name=name,
+        connect_timeout=settings.LLM_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=settings.LLM_READ_TIMEOUT_SECONDS,
+        total_timeout=settings.LLM_TOTAL_TIMEOUT_SECONDS,
+        max_retries=settings.LLM_MAX_RETRIES,
+        backoff_base=settings.LLM_RETRY_BACKOFF_MS / 1000,
+        backoff_max=settings.LLM_RETRY_BACKOFF_MAX_MS / 1000,
+        hedge=settings.LLM_HEDGE,
+        hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_MS / 1000,
+        breaker_failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+        breaker_min_calls=settings.LLM_BREAKER_MIN_CALLS,
+        breaker_window=settings.LLM_BREAKER_WINDOW_SECONDS,
+        breaker_reset=settings.LLM_BREAKER_RESET_SECONDS,
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        keepalive_seconds=settings.LLM_KEEPALIVE_SECONDS,
+        http2=settings.LLM_HTTP2
+    )
@@ -0,0 +1,307 @@
+"""
+Multi-provider LLM routing
+
+The registry holds one Provider per OpenAI-compatible endpoint, each with its
+own model, optional fast model, concurrency limit and token prices, and its
+own LLMGateway (timeouts, retries, circuit breaker). Providers come from
+LLM_PROVIDERS (a JSON list) or, by default, xAI plus Groq when GROQ_API_KEY
+is set.
+
+For every call the router ranks the providers by expected time to a
+successful answer (rolling median latency divided by the success rate),
+skipping open circuits and saturated providers, and falls back down the
+ranking when a provider fails. A small share of calls goes to a random
+provider so the statistics of the others stay current. Title generation and
+short prompts (LLM_FAST_PROMPT_TOKENS) use the fast tier: providers' fast
+models, ranked on their own statistics.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+from backend import context_window
+from backend.config import settings
+from backend.llm_gateway import CircuitBreaker, LLMGateway, create_gateway, percentile
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per provider and tier for the rolling statistics
+STATS_MAX_SAMPLES = 500
+
+DEFAULT_TIER = "default"
+FAST_TIER = "fast"
+
+@dataclass
+class ProviderConfig:
+    """One OpenAI-compatible endpoint in the registry"""
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+    fast_model: str = ""
+    max_concurrency: int = 64
+    # USD per 1000 prompt / completion tokens, for the cost statistics
+    input_cost_per_1k: float = 0.0
+    output_cost_per_1k: float = 0.0
+
+class RollingStats:
+    """Latencies and outcomes of the calls in the last `window` seconds"""
+    
+    def __init__(self, window: float):
+        self.window = window
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=STATS_MAX_SAMPLES)
+        self._lock = threading.Lock()
+    
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+    
+    def snapshot(self) -> Tuple[List[float], int, int]:
+        """Latencies of successful calls, number of calls, number of failures"""
+        horizon = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < horizon:
+                self._samples.popleft()
+            samples = list(self._samples)
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        return latencies, len(samples), sum(1 for _, _, ok in samples if not ok)
+    
+    def expected_seconds(self) -> Optional[float]:
+        """Median latency over the success rate; None without recent calls"""
+        latencies, calls, failures = self.snapshot()
+        if not calls:
+            return None
+        median = latencies[len(latencies) // 2] if latencies else 0.0
+        success_rate = (calls - failures) / calls
+        return median / max(success_rate, 0.05) if latencies else float("inf")
+
+class Provider:
+    """A registered provider: its gateway, concurrency limit and statistics per tier"""
+    
+    def __init__(self, config: ProviderConfig, gateway: LLMGateway, window: float):
+        self.config = config
+        self.gateway = gateway
+        self.semaphore = asyncio.Semaphore(config.max_concurrency)
+        self.in_flight = 0
+        self.stats = {DEFAULT_TIER: RollingStats(window), FAST_TIER: RollingStats(window)}
+        self.calls = {DEFAULT_TIER: 0, FAST_TIER: 0}
+        self.failures = {DEFAULT_TIER: 0, FAST_TIER: 0}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+    
+    @property
+    def name(self) -> str:
+        return self.config.name
+    
+    def model_for(self, tier: str) -> str:
+        if tier == FAST_TIER and self.config.fast_model:
+            return self.config.fast_model
+        return self.config.model
+    
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.config.max_concurrency
+    
+    def record_usage(self, usage: Any):
+        if usage is None:
+            return
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+    
+    @property
+    def cost_usd(self) -> float:
+        return (
+            self.prompt_tokens / 1000 * self.config.input_cost_per_1k
+            + self.completion_tokens / 1000 * self.config.output_cost_per_1k
+        )
+
+class NoProviderError(Exception):
+    """Every provider failed or rejected the call"""
+
+class LLMRouter:
+    """Sends each call to the provider expected to answer fastest, falling back on failure"""
+    
+    def __init__(self, providers: Sequence[Provider], explore: float = 0.05, fast_prompt_tokens: int = 0):
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = list(providers)
+        self.explore = explore
+        self.fast_prompt_tokens = fast_prompt_tokens
+        self.fallbacks = 0
+    
+    def tier_for(self, messages: Sequence[Dict[str, str]], purpose: str) -> str:
+        if purpose == "title":
+            return FAST_TIER
+        if self.fast_prompt_tokens and context_window.count_message_tokens(messages) <= self.fast_prompt_tokens:
+            return FAST_TIER
+        return DEFAULT_TIER
+    
+    def rank(self, tier: str) -> List[Provider]:
+        """Providers in the order they are tried for a call of this tier"""
+        def key(provider: Provider):
+            expected = provider.stats[tier].expected_seconds()
+            return (
+                provider.gateway.breaker.state == CircuitBreaker.OPEN,
+                provider.saturated,
+                # Fast calls prefer providers that have a fast model
+                tier == FAST_TIER and not provider.config.fast_model,
+                # Providers without recent calls are tried to learn their latency
+                0.0 if expected is None else expected,
+            )
+        ranked = sorted(self.providers, key=key)
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+    
+    async def complete(self, messages: List[Dict[str, str]], purpose: str = "chat", **params) -> Any:
+        """Chat completion from the best provider, falling back to the others"""
+        tier = self.tier_for(messages, purpose)
+        errors = []
+        for attempt, provider in enumerate(self.rank(tier)):
+            if attempt:
+                self.fallbacks += 1
+            started = time.perf_counter()
+            provider.calls[tier] += 1
+            provider.in_flight += 1
+            try:
+                async with provider.semaphore:
+                    response = await provider.gateway.complete(
+                        model=provider.model_for(tier), messages=messages, **params
+                    )
+            except Exception as e:
+                provider.failures[tier] += 1
+                provider.stats[tier].record(time.perf_counter() - started, False)
+                logger.warning("LLM provider %s failed (%s); trying the next one", provider.name, type(e).__name__)
+                errors.append(e)
+                continue
+            finally:
+                provider.in_flight -= 1
+            provider.stats[tier].record(time.perf_counter() - started, True)
+            provider.record_usage(getattr(response, "usage", None))
+            return response
+        raise NoProviderError(f"All LLM providers failed: {errors[-1]!r}") from errors[-1]
+    
+    async def stream(self, messages: List[Dict[str, str]], purpose: str = "chat", **params) -> AsyncIterator[Any]:
+        """
+        Streamed chat completion; falls back to the next provider only until
+        the first chunk has arrived
+        """
+        tier = self.tier_for(messages, purpose)
+        errors = []
+        for attempt, provider in enumerate(self.rank(tier)):
+            if attempt:
+                self.fallbacks += 1
+            started = time.perf_counter()
+            provider.calls[tier] += 1
+            provider.in_flight += 1
+            try:
+                async with provider.semaphore:
+                    chunks = provider.gateway.stream(model=provider.model_for(tier), messages=messages, **params)
+                    try:
+                        first = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        provider.failures[tier] += 1
+                        provider.stats[tier].record(time.perf_counter() - started, False)
+                        logger.warning("LLM provider %s failed (%s); trying the next one", provider.name, type(e).__name__)
+                        errors.append(e)
+                        continue
+                    # Time to first token is what the router optimizes for streams
+                    provider.stats[tier].record(time.perf_counter() - started, True)
+                    if first is None:
+                        return
+                    yield first
+                    async for chunk in chunks:
+                        provider.record_usage(getattr(chunk, "usage", None))
+                        yield chunk
+                    return
+            finally:
+                provider.in_flight -= 1
+        raise NoProviderError(f"All LLM providers failed: {errors[-1]!r}") from errors[-1]
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for provider in self.providers:
+            tiers = {}
+            for tier, rolling in provider.stats.items():
+                latencies, calls, failures = rolling.snapshot()
+                tiers[tier] = {
+                    "model": provider.model_for(tier),
+                    "calls_total": provider.calls[tier],
+                    "failures_total": provider.failures[tier],
+                    "recent_calls": calls,
+                    "recent_error_rate": round(failures / calls, 4) if calls else 0.0,
+                    "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                }
+            result[provider.name] = {
+                "base_url": provider.config.base_url,
+                "in_flight": provider.in_flight,
+                "max_concurrency": provider.config.max_concurrency,
+                "prompt_tokens": provider.prompt_tokens,
+                "completion_tokens": provider.completion_tokens,
+                "cost_usd": round(provider.cost_usd, 6),
+                "tiers": tiers,
+                "gateway": provider.gateway.stats(),
+            }
+        return result
+    
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.gateway.aclose()
+
+def load_provider_configs() -> List[ProviderConfig]:
+    """
+    Providers from LLM_PROVIDERS, e.g.
+    [{"name": "groq", "base_url": "https://api.groq.com/openai/v1", "api_key_env": "GROQ_API_KEY",
+      "model": "llama-3.3-70b-versatile", "fast_model": "llama-3.1-8b-instant", "max_concurrency": 32}]
+    or else xAI plus Groq when GROQ_API_KEY is set
+    """
+    if settings.LLM_PROVIDERS:
+        configs = []
+        for entry in json.loads(settings.LLM_PROVIDERS):
+            entry = dict(entry)
+            api_key_env = entry.pop("api_key_env", None)
+            if api_key_env:
+                entry["api_key"] = os.getenv(api_key_env, "")
+            configs.append(ProviderConfig(**entry))
+        return configs
+    
+    configs = [ProviderConfig(
+        name="xai",
+        base_url=settings.LLM_BASE_URL,
+        api_key=settings.XAI_API_KEY,
+        model=settings.LLM_MODEL,
+        fast_model=settings.LLM_FAST_MODEL,
+        max_concurrency=settings.CHAT_MAX_CONCURRENCY,
+    )]
+    if settings.GROQ_API_KEY:
+        configs.append(ProviderConfig(
+            name="groq",
+            base_url=settings.GROQ_BASE_URL,
+            api_key=settings.GROQ_API_KEY,
+            model=settings.GROQ_LLM_MODEL,
+            fast_model=settings.GROQ_FAST_MODEL,
+            max_concurrency=settings.CHAT_MAX_CONCURRENCY,
+        ))
+    return configs
+
+def create_router(configs: Optional[Sequence[ProviderConfig]] = None) -> LLMRouter:
+    """Router over the configured providers, each behind its own gateway"""
+    providers = [
+        Provider(
+            config,
+            create_gateway(config.name, config.base_url, config.api_key),
+            settings.LLM_ROUTER_WINDOW_SECONDS
+        )
+        for config in (configs if configs is not None else load_provider_configs())
+    ]
+    return LLMRouter(providers, explore=settings.LLM_ROUTER_EXPLORE, fast_prompt_tokens=settings.LLM_FAST_PROMPT_TOKENS)
@@ -0,0 +1,57 @@
+"""
+Logging setup shared by the API and the command line tools
+
+LOG_FORMAT=json writes one JSON object per record with the request id and
+any structured fields passed through `extra`; the default is plain text.
+"""
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+from backend import metrics
+from backend.config import settings
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id (or "-") to every record"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = metrics.current_request_id() or "-"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = None, log_format: str = None):
+    """Install a single stderr handler on the root logger"""
+    level = (level or settings.LOG_LEVEL).upper()
+    log_format = (log_format or settings.LOG_FORMAT).lower()
+    
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(RequestIdFilter())
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
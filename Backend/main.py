@@ -6,17 +6,28 @@ Complete implementation of all milestones:
 - Milestone 4: Core Chat API
 - Milestone 5: LLM Integration and Business Logic
 """
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
+import asyncio
+import json
+import logging
 import uvicorn
 
-from backend.database import get_db, create_tables
-from backend import crud, models, schemas
+from backend.database import AsyncSessionLocal, SessionLocal, async_engine, engine, get_db, get_async_db, get_pool_stats, create_tables
+from backend import admission, app_stats, crud, async_crud, catalog_events, metrics, product_cache, product_query, query_parser, schemas
+from backend.background_jobs import job_runner
+from backend.logging_config import configure_logging
+from backend.response_cache import llm_flights, response_cache
 from backend.chat_service import ChatService
 from backend.config import settings
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
@@ -33,14 +44,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, status, DB query count and request id for every request
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+metrics.registry.register_collector(lambda: metrics.collect_pool_stats(get_pool_stats()))
+metrics.registry.register_collector(lambda: metrics.collect_product_cache_stats(product_cache.product_cache.stats()))
+metrics.registry.register_collector(lambda: metrics.collect_response_cache_stats(response_cache.stats()))
+metrics.registry.register_collector(lambda: metrics.collect_llm_coalescing_stats(llm_flights.stats()))
+metrics.registry.register_collector(lambda: metrics.collect_background_job_stats(job_runner.stats()))
+metrics.registry.register_collector(lambda: metrics.collect_admission_stats(admission.chat_admission.stats()))
+
 # Initialize chat service
 chat_service = ChatService()
+metrics.registry.register_collector(lambda: metrics.collect_llm_router_stats(chat_service.llm.stats()))
+
+async def warm_catalog_caches(payload):
+    """Background job: rebuild the query vocabulary and facet counts after a catalogue change"""
+    async with AsyncSessionLocal() as db:
+        await query_parser.get_vocabulary(db)
+    
+    def build_facet_table():
+        db = SessionLocal()
+        try:
+            product_query.get_facet_table(db)
+        finally:
+            db.close()
+    await asyncio.to_thread(build_facet_table)
+
+job_runner.register("warm_catalog_caches", warm_catalog_caches)
+# A burst of changes queues one rebuild
+catalog_events.subscribe(lambda change: job_runner.submit("warm_catalog_caches", {}, key="warm_catalog_caches"))
 
 @app.on_event("startup")
 async def startup_event():
     """Create database tables on startup"""
     create_tables()
-    print("Database tables created/verified")
+    logger.info("Database tables created/verified")
+    # Titling and cache warming run off the request path
+    job_runner.start(settings.BACKGROUND_POLL_SECONDS)
+    # Replay catalogue changes made by loaders and other workers
+    app.state.catalog_poller = asyncio.create_task(
+        catalog_events.poll_forever(AsyncSessionLocal, settings.CATALOG_POLL_SECONDS)
+    )
+    # Keep the /api/stats snapshot fresh so requests only read it
+    app.state.stats_refresher = asyncio.create_task(
+        app_stats.refresh_forever(SessionLocal, settings.STATS_REFRESH_SECONDS)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and close the LLM connection pool"""
+    app.state.catalog_poller.cancel()
+    app.state.stats_refresher.cancel()
+    await job_runner.stop(settings.BACKGROUND_SHUTDOWN_SECONDS)
+    await chat_service.llm.aclose()
 
 # Root endpoint
 @app.get("/")
@@ -54,10 +112,20 @@ async def root():
             "health": "/health",
             "docs": "/docs",
             "chat": "/api/chat",
+            "chat_stream": "/api/chat/stream",
             "users": "/api/users",
             "products": "/api/products",
-            "search": "/api/products/search?q=query",
-            "stats": "/api/stats"
+            "search": "/api/products/search?q=query&limit=20&offset=0",
+            "product_query": "/api/products/query?category=...&brand=...&min_price=&max_price=&min_rating=&in_stock=true&sort=price_asc&cursor=&facets=true",
+            "product_facets": "/api/products/facets?category=...&brand=...",
+            "stats": "/api/stats",
+            "pool_stats": "/api/stats/pool",
+            "cache_stats": "/api/stats/cache",
+            "response_cache_stats": "/api/stats/response-cache",
+            "llm_stats": "/api/stats/llm",
+            "job_stats": "/api/stats/jobs",
+            "admission_stats": "/api/stats/admission",
+            "metrics": "/metrics"
         },
         "database": {
             "users": "2 demo users created",
@@ -65,9 +133,15 @@ async def root():
             "ready": True
         },
         "ai_integration": {
-            "provider": "xAI (Grok)",
-            "model": settings.GROQ_MODEL,
-            "status": "configured" if settings.GROQ_API_KEY else "needs_api_key"
+            "providers": [
+                {
+                    "name": provider.name,
+                    "model": provider.config.model,
+                    "fast_model": provider.config.fast_model or provider.config.model,
+                    "status": "configured" if provider.config.api_key else "needs_api_key"
+                }
+                for provider in chat_service.llm.providers
+            ]
         }
     }
 
@@ -105,22 +179,84 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
 @app.get("/api/products", response_model=List[schemas.Product])
 async def get_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """Get list of products"""
-    return crud.get_products(db, skip=skip, limit=limit)
+    return product_cache.get_products(db, skip=skip, limit=limit)
 
-@app.get("/api/products/search")
-async def search_products(q: str, db: Session = Depends(get_db)):
-    """Search products by query"""
+@app.get("/api/products/search", response_model=List[schemas.Product])
+async def search_products(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    """Search products by query, best matches first"""
     if not q or len(q.strip()) < 2:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Search query must be at least 2 characters long"
         )
-    return crud.search_products(db, q)
+    return product_cache.search_products(db, q, limit=limit, offset=offset)
+
+def get_product_filters(
+    category: List[str] = Query([], description="Categories to include (repeatable)"),
+    brand: List[str] = Query([], description="Brands to include (repeatable)"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    min_rating: Optional[float] = Query(None, ge=0, le=5),
+    in_stock: bool = Query(False, description="Only products with stock_quantity > 0")
+) -> product_query.ProductFilters:
+    """Dependency building the structured product filters from query parameters"""
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="min_price must not exceed max_price"
+        )
+    return product_query.ProductFilters(
+        categories=tuple(category),
+        brands=tuple(brand),
+        min_price=min_price,
+        max_price=max_price,
+        min_rating=min_rating,
+        in_stock=in_stock
+    )
+
+@app.get("/api/products/query", response_model=schemas.ProductPage)
+async def query_products(
+    filters: product_query.ProductFilters = Depends(get_product_filters),
+    sort: str = Query("id", description="One of " + ", ".join(product_query.SORTS)),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    facets: bool = Query(False, description="Include category and brand facet counts"),
+    db: Session = Depends(get_db)
+):
+    """Filter and sort products, paged with keyset cursors"""
+    if sort not in product_query.SORTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown sort '{sort}'; use one of: {', '.join(product_query.SORTS)}"
+        )
+    try:
+        products, next_cursor = product_cache.query_products(db, filters, sort=sort, cursor=cursor, limit=limit)
+    except product_query.InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return schemas.ProductPage(
+        products=[schemas.Product.model_validate(product) for product in products],
+        has_more=next_cursor is not None,
+        next_cursor=next_cursor,
+        facets=product_query.get_facets(db, filters) if facets else None
+    )
+
+@app.get("/api/products/facets", response_model=schemas.ProductFacets)
+async def get_product_facets(
+    filters: product_query.ProductFilters = Depends(get_product_filters),
+    db: Session = Depends(get_db)
+):
+    """Product counts per category and brand for the given filters"""
+    return product_query.get_facets(db, filters)
 
 @app.get("/api/products/{product_id}", response_model=schemas.Product)
 async def get_product(product_id: int, db: Session = Depends(get_db)):
     """Get product by ID"""
-    product = crud.get_product(db, product_id)
+    product = product_cache.get_product(db, product_id)
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -129,9 +265,16 @@ async def get_product(product_id: int, db: Session = Depends(get_db)):
     return product
 
 # Conversation endpoints
-@app.get("/api/users/{user_id}/conversations", response_model=List[schemas.Conversation])
-async def get_user_conversations(user_id: int, db: Session = Depends(get_db)):
-    """Get all conversations for a user"""
+@app.get(
+    "/api/users/{user_id}/conversations",
+    response_model=Union[List[schemas.ConversationSummary], List[schemas.Conversation]]
+)
+async def get_user_conversations(user_id: int, include_messages: bool = False, db: Session = Depends(get_db)):
+    """
+    Get all conversations for a user. By default returns lightweight
+    summaries (message count and last message preview); full message
+    bodies only with include_messages=true.
+    """
     # Verify user exists
     user = crud.get_user(db, user_id)
     if not user:
@@ -139,12 +282,14 @@ async def get_user_conversations(user_id: int, db: Session = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    return crud.get_user_conversations(db, user_id)
+    if include_messages:
+        return [schemas.Conversation.model_validate(c) for c in crud.get_user_conversations(db, user_id)]
+    return crud.get_user_conversation_summaries(db, user_id)
 
 @app.get("/api/conversations/{conversation_id}", response_model=schemas.Conversation)
 async def get_conversation(conversation_id: int, db: Session = Depends(get_db)):
     """Get conversation by ID"""
-    conversation = crud.get_conversation(db, conversation_id)
+    conversation = crud.get_conversation(db, conversation_id, include_messages=True)
     if not conversation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -152,28 +297,56 @@ async def get_conversation(conversation_id: int, db: Session = Depends(get_db)):
         )
     return conversation
 
-@app.get("/api/conversations/{conversation_id}/messages", response_model=List[schemas.Message])
-async def get_conversation_messages(conversation_id: int, db: Session = Depends(get_db)):
-    """Get all messages for a conversation"""
+@app.get("/api/conversations/{conversation_id}/messages", response_model=schemas.MessagePage)
+async def get_conversation_messages(
+    conversation_id: int,
+    before: Optional[int] = Query(None, description="Return messages older than this message id"),
+    after: Optional[int] = Query(None, description="Return messages newer than this message id"),
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    """Get one page of messages for a conversation (latest page by default)"""
+    if before is not None and after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either 'before' or 'after', not both"
+        )
     conversation = crud.get_conversation(db, conversation_id)
     if not conversation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation not found"
         )
-    return crud.get_conversation_messages(db, conversation_id)
+    try:
+        messages, has_more = crud.get_conversation_messages(
+            db, conversation_id, before=before, after=after, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return schemas.MessagePage(
+        messages=messages,
+        has_more=has_more,
+        before_cursor=messages[0].id if messages else before,
+        after_cursor=messages[-1].id if messages else after
+    )
 
 # Milestone 4: Core Chat API
 @app.post("/api/chat", response_model=schemas.ChatResponse)
-async def chat(chat_request: schemas.ChatRequest, db: Session = Depends(get_db)):
+async def chat(chat_request: schemas.ChatRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Main chat endpoint - handles user messages and generates AI responses
     Milestone 4: Core Chat API
     Milestone 5: LLM Integration and Business Logic
     """
     try:
+        # Refuse early, with Retry-After, when overloaded or over the user's rate
+        await admission.chat_admission.admit(chat_request.user_id)
+        
         # Verify user exists
-        user = crud.get_user(db, chat_request.user_id)
+        user = await async_crud.get_user(db, chat_request.user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -188,42 +361,159 @@ async def chat(chat_request: schemas.ChatRequest, db: Session = Depends(get_db))
             )
         
         # Process chat message through the service
-        result = chat_service.process_chat_message(
+        result = await chat_service.process_chat_message(
             db=db,
             user_id=chat_request.user_id,
             message=chat_request.message.strip(),
-            conversation_id=chat_request.conversation_id
+            conversation_id=chat_request.conversation_id,
+            include_history=chat_request.include_history
         )
         
         return schemas.ChatResponse(**result)
-        
+    
+    except HTTPException:
+        raise
+    except admission.AdmissionRejected as e:
+        raise rejection_error(e)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
-    except Exception as e:
-        print(f"Chat error: {e}")
+    except Exception:
+        logger.exception("Chat error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while processing your message"
         )
 
+def rejection_error(rejection: admission.AdmissionRejected) -> HTTPException:
+    """429 or 503 telling the client when to retry"""
+    return HTTPException(
+        status_code=rejection.status_code,
+        detail=rejection.detail,
+        headers={"Retry-After": rejection.retry_after_header}
+    )
+
+def format_sse(event: str, data: dict) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(chat_request: schemas.ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Streaming chat endpoint - forwards LLM tokens as server-sent events.
+    Emits "start", then "token" events, then a closing "done" event
+    carrying the persisted message ids.
+    """
+    try:
+        await admission.chat_admission.admit(chat_request.user_id)
+    except admission.AdmissionRejected as e:
+        raise rejection_error(e)
+    
+    user = await async_crud.get_user(db, chat_request.user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    if not chat_request.message or not chat_request.message.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Message content cannot be empty"
+        )
+    
+    # The stream outlives this handler (and its dependencies), so it gets its own session
+    stream_db = AsyncSessionLocal()
+    events = chat_service.stream_chat_message(
+        db=stream_db,
+        user_id=chat_request.user_id,
+        message=chat_request.message.strip(),
+        conversation_id=chat_request.conversation_id
+    )
+    
+    # Run up to the "start" event here so validation errors become proper HTTP errors
+    try:
+        first_event = await events.__anext__()
+    except ValueError as e:
+        await stream_db.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception:
+        await stream_db.close()
+        logger.exception("Chat stream error")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while processing your message"
+        )
+    
+    async def event_stream():
+        try:
+            yield format_sse(*first_event)
+            async for event in events:
+                yield format_sse(*event)
+        except admission.AdmissionRejected as e:
+            # The response has started; tell the client when to retry instead
+            yield format_sse("error", {"detail": e.detail, "retry_after": int(e.retry_after_header)})
+        except Exception:
+            logger.exception("Chat stream error")
+            yield format_sse("error", {"detail": "An error occurred while processing your message"})
+        finally:
+            await events.aclose()
+            await stream_db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Additional endpoints for debugging and administration
 @app.get("/api/stats")
 async def get_stats(db: Session = Depends(get_db)):
-    """Get application statistics"""
-    user_count = db.query(models.User).count()
-    product_count = db.query(models.Product).count()
-    conversation_count = db.query(models.Conversation).count()
-    message_count = db.query(models.Message).count()
-    
-    return {
-        "users": user_count,
-        "products": product_count,
-        "conversations": conversation_count,
-        "messages": message_count
-    }
+    """
+    Get application statistics from the materialized snapshot: totals,
+    active conversations and users, counts per day, and the snapshot age
+    """
+    return app_stats.read_snapshot(db)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus metrics of this worker"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats/pool")
+async def get_pool_statistics():
+    """Get connection pool utilization and checkout wait metrics"""
+    return get_pool_stats()
+
+@app.get("/api/stats/cache")
+async def get_cache_statistics():
+    """Get product cache size and hit/miss metrics"""
+    return product_cache.product_cache.stats()
+
+@app.get("/api/stats/response-cache")
+async def get_response_cache_statistics():
+    """Get LLM response cache hit rate, saved latency and coalesced calls"""
+    return {**response_cache.stats(), "coalescing": llm_flights.stats()}
+
+@app.get("/api/stats/llm")
+async def get_llm_statistics():
+    """Get per-provider latency, error rate, cost, retries and circuit breaker state"""
+    return {"fallbacks": chat_service.llm.fallbacks, "providers": chat_service.llm.stats()}
+
+@app.get("/api/stats/admission")
+async def get_admission_statistics():
+    """Get admission decisions, LLM slot usage and the per-user rate limit"""
+    return admission.chat_admission.stats()
+
+@app.get("/api/stats/jobs")
+async def get_job_statistics():
+    """Get background job queue depth and outcomes per job kind"""
+    return job_runner.stats()
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,419 @@
+"""
+Request instrumentation and Prometheus metrics
+
+- MetricsMiddleware times every HTTP request (including streamed bodies),
+  assigns a request id (X-Request-ID, echoed back) and counts the database
+  queries the request issued
+- span() times a stage of the chat pipeline
+- record_llm_usage() records token usage reported by the LLM
+- background jobs record their queue wait and run time
+- render() produces the Prometheus text format served at /metrics; pool and
+  cache statistics are collected at scrape time by registered collectors
+
+Metrics are kept per worker process.
+"""
+import bisect
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+INF = float("inf")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, INF)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, INF)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, INF)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, INF)
+
+REQUEST_ID_HEADER = "x-request-id"
+
+def _format_value(value: float) -> str:
+    if value == INF:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    """Monotonic counter with labels"""
+    
+    type_name = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+    
+    type_name = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets[-1] == INF else tuple(buckets) + (INF,)
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+    
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in sorted(self._values.items())]
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            yield from histogram_samples(self.name, labels, self.buckets, counts, total, count)
+
+def histogram_samples(name: str, labels: List[Tuple[str, str]], buckets: Sequence[float], counts: Sequence[int], total: float, count: int) -> Iterable[str]:
+    """Exposition lines of one histogram series from per-bucket (non-cumulative) counts"""
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        yield f"{name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}"
+    yield f"{name}_sum{_format_labels(labels)} {_format_value(total)}"
+    yield f"{name}_count{_format_labels(labels)} {count}"
+
+class Registry:
+    """Metrics of this process plus collectors evaluated at scrape time"""
+    
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def register_collector(self, collector: Callable[[], Iterable[str]]):
+        """Add a function yielding complete exposition lines (# HELP/# TYPE included)"""
+        self._collectors.append(collector)
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency including streamed bodies", ("method", "route")
+))
+DB_QUERIES_PER_REQUEST = registry.register(Histogram(
+    "db_queries_per_request", "Database statements executed per HTTP request", ("route",), QUERY_COUNT_BUCKETS
+))
+DB_QUERIES = registry.register(Counter("db_queries_total", "Database statements executed", ("engine",)))
+CHAT_STAGE_SECONDS = registry.register(Histogram(
+    "chat_stage_duration_seconds", "Latency of chat pipeline stages", ("stage",)
+))
+LLM_TOKENS = registry.register(Histogram(
+    "llm_tokens", "Tokens per LLM call as reported by the provider", ("kind",), TOKEN_BUCKETS
+))
+LLM_TOKENS_TOTAL = registry.register(Counter("llm_tokens_total", "Tokens used by LLM calls", ("kind",)))
+CHAT_LLM_SLOT_WAIT_SECONDS = registry.register(Histogram(
+    "chat_llm_slot_wait_seconds", "Time chats waited for an LLM slot (admission control)"
+))
+GROUP_COMMIT_BATCH_SIZE = registry.register(Histogram(
+    "group_commit_batch_size", "Writes per group-commit transaction", ("committer",), BATCH_SIZE_BUCKETS
+))
+GROUP_COMMIT_SECONDS = registry.register(Histogram(
+    "group_commit_duration_seconds", "Time to write and commit a group-commit batch", ("committer",)
+))
+GROUP_COMMIT_FALLBACKS = registry.register(Counter(
+    "group_commit_fallbacks_total", "Group-commit batches that failed and were written one by one", ("committer",)
+))
+BACKGROUND_JOB_WAIT_SECONDS = registry.register(Histogram(
+    "background_job_wait_seconds", "Time background jobs spent queued before running", ("kind",)
+))
+BACKGROUND_JOB_SECONDS = registry.register(Histogram(
+    "background_job_duration_seconds", "Run time of background job attempts", ("kind", "outcome")
+))
+
+@dataclass
+class RequestContext:
+    """Per-request state shared by the middleware, spans and DB listeners"""
+    request_id: str
+    db_queries: int = 0
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+def current_request_id() -> Optional[str]:
+    context = _request_context.get()
+    return context.request_id if context is not None else None
+
+@contextmanager
+def span(stage: str):
+    """Time a chat pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        CHAT_STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("stage %s took %.1f ms", stage, elapsed * 1000, extra={"stage": stage, "duration_ms": round(elapsed * 1000, 3)})
+
+def record_llm_usage(usage):
+    """Record the usage block of a chat completion response, if any"""
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens is not None:
+            LLM_TOKENS.observe(tokens, kind=kind)
+            LLM_TOKENS_TOTAL.inc(tokens, kind=kind)
+
+def instrument_engine(engine: Engine, name: str):
+    """Count statements executed on an engine, per request and in total"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc(engine=name)
+        request = _request_context.get()
+        if request is not None:
+            request.db_queries += 1
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and DB query count per route,
+    and tagging the request (and its log records) with a request id
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER.encode("latin-1"):
+                request_id = value.decode("latin-1")[:128]
+                break
+        context = RequestContext(request_id=request_id or uuid.uuid4().hex)
+        token = _request_context.set(context)
+        status_code = 500
+        
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode("latin-1"), context.request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            # Route templates keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=method, route=route)
+            DB_QUERIES_PER_REQUEST.observe(context.db_queries, route=route)
+            logger.info(
+                "%s %s %s %.1f ms",
+                method, scope["path"], status_code, elapsed * 1000,
+                extra={
+                    "method": method,
+                    "path": scope["path"],
+                    "route": route,
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "db_queries": context.db_queries,
+                }
+            )
+            _request_context.reset(token)
+
+def _family(name: str, metric_type: str, documentation: str) -> List[str]:
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+
+def collect_pool_stats(stats: Dict[str, Dict]) -> Iterable[str]:
+    """Exposition lines for database.get_pool_stats()"""
+    gauges = (
+        ("db_pool_size", "size", "Persistent connections of the pool"),
+        ("db_pool_max_overflow", "max_overflow", "Extra connections the pool may open"),
+        ("db_pool_checked_out", "checked_out", "Connections currently in use"),
+        ("db_pool_overflow", "overflow", "Overflow connections currently open"),
+    )
+    for name, key, documentation in gauges:
+        yield from _family(name, "gauge", documentation)
+        for engine_name, entry in stats.items():
+            if key in entry:
+                yield f"{name}{_format_labels([('engine', engine_name)])} {entry[key]}"
+    
+    yield from _family("db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting for a connection")
+    for engine_name, entry in stats.items():
+        if "timeouts" in entry:
+            yield f"db_pool_checkout_timeouts_total{_format_labels([('engine', engine_name)])} {entry['timeouts']}"
+    
+    yield from _family("db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a pooled connection")
+    for engine_name, entry in stats.items():
+        if "wait_ms_buckets" not in entry:
+            continue
+        bounds = [INF if key == "+Inf" else float(key) / 1000 for key in entry["wait_ms_buckets"]]
+        yield from histogram_samples(
+            "db_pool_checkout_wait_seconds", [("engine", engine_name)], bounds,
+            list(entry["wait_ms_buckets"].values()), entry["wait_seconds_total"],
+            entry["checkouts"] + entry["timeouts"]
+        )
+
+def collect_product_cache_stats(stats: Dict) -> Iterable[str]:
+    """Exposition lines for product_cache.product_cache.stats()"""
+    yield from _family("product_cache_lookups_total", "counter", "Product cache lookups by kind and result")
+    for kind, lookup in stats["lookups"].items():
+        for result in ("hits", "misses"):
+            yield f"product_cache_lookups_total{_format_labels([('kind', kind), ('result', result)])} {lookup[result]}"
+    yield from _family("product_cache_entries", "gauge", "Entries held by the product cache")
+    yield f"product_cache_entries{_format_labels([('type', 'products')])} {stats['products']}"
+    yield f"product_cache_entries{_format_labels([('type', 'queries')])} {stats['queries']}"
+
+def collect_response_cache_stats(stats: Dict) -> Iterable[str]:
+    """Exposition lines for response_cache.response_cache.stats()"""
+    yield from _family("response_cache_lookups_total", "counter", "LLM response cache lookups by result")
+    for result in ("exact_hits", "semantic_hits", "misses"):
+        yield f"response_cache_lookups_total{_format_labels([('result', result)])} {stats[result]}"
+    yield from _family("response_cache_saved_seconds_total", "counter", "LLM latency avoided by cache hits")
+    yield f"response_cache_saved_seconds_total {_format_value(stats['saved_llm_seconds'])}"
+    yield from _family("response_cache_entries", "gauge", "Entries held by the response cache")
+    yield f"response_cache_entries {stats['entries']}"
+
+def collect_llm_coalescing_stats(stats: Dict) -> Iterable[str]:
+    """Exposition lines for response_cache.llm_flights.stats()"""
+    yield from _family("llm_coalesced_calls_total", "counter", "Chat completions that joined an identical call in flight")
+    yield f"llm_coalesced_calls_total {stats['coalesced']}"
+    yield from _family("llm_coalescing_leader_calls_total", "counter", "Chat completions that went upstream through single flight")
+    yield f"llm_coalescing_leader_calls_total {stats['calls']}"
+    yield from _family("llm_coalescing_in_flight", "gauge", "Distinct prompts waiting on the LLM")
+    yield f"llm_coalescing_in_flight {stats['in_flight']}"
+
+def collect_background_job_stats(stats: Dict) -> Iterable[str]:
+    """Exposition lines for background_jobs.job_runner.stats()"""
+    yield from _family("background_jobs_total", "counter", "Background job attempts and submissions by outcome")
+    for kind, outcomes in stats["jobs"].items():
+        for outcome, count in sorted(outcomes.items()):
+            yield f"background_jobs_total{_format_labels([('kind', kind), ('outcome', outcome)])} {count}"
+    gauges = (
+        ("background_jobs_queued", "queued", "Background jobs waiting in the in-process queue"),
+        ("background_jobs_running", "running", "Background jobs running"),
+        ("background_jobs_retrying", "retrying", "Failed background jobs waiting to retry"),
+    )
+    for name, key, documentation in gauges:
+        yield from _family(name, "gauge", documentation)
+        yield f"{name} {stats[key]}"
+
+def collect_admission_stats(stats: Dict) -> Iterable[str]:
+    """Exposition lines for admission.chat_admission.stats()"""
+    yield from _family("chat_admission_decisions_total", "counter", "Chat admission decisions")
+    for decision, count in sorted(stats["decisions"].items()):
+        yield f"chat_admission_decisions_total{_format_labels([('decision', decision)])} {count}"
+    gauges = (
+        ("chat_llm_slots", "capacity", "LLM slots of this worker"),
+        ("chat_llm_slots_in_use", "in_flight", "LLM slots held by chats"),
+        ("chat_llm_slot_queue", "waiting", "Chats waiting for an LLM slot"),
+    )
+    for name, key, documentation in gauges:
+        yield from _family(name, "gauge", documentation)
+        yield f"{name} {stats['llm_slots'][key]}"
+
+def collect_llm_gateway_stats(stats: Dict[str, Dict]) -> Iterable[str]:
+    """Exposition lines for LLMGateway.stats(), keyed by provider"""
+    counters = (
+        ("llm_calls_total", "calls", "LLM gateway calls"),
+        ("llm_call_failures_total", "failed", "LLM gateway calls that failed after retries"),
+        ("llm_retries_total", "retries", "LLM requests retried after a retryable error"),
+        ("llm_attempt_timeouts_total", "timeouts", "LLM attempts cut off by the call deadline"),
+        ("llm_hedged_requests_total", "hedged", "Hedged second requests sent"),
+        ("llm_hedge_wins_total", "hedge_wins", "Calls answered by the hedged request"),
+        ("llm_circuit_opened_total", "circuit_opened", "Times the circuit breaker opened"),
+        ("llm_circuit_rejected_total", "circuit_rejected", "Calls rejected while the circuit was open"),
+    )
+    for name, key, documentation in counters:
+        yield from _family(name, "counter", documentation)
+        for provider, entry in stats.items():
+            yield f"{name}{_format_labels([('provider', provider)])} {entry[key]}"
+    yield from _family("llm_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half-open, 2 open)")
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    for provider, entry in stats.items():
+        yield f"llm_circuit_state{_format_labels([('provider', provider)])} {states[entry['circuit_state']]}"
+
+def collect_llm_router_stats(stats: Dict[str, Dict]) -> Iterable[str]:
+    """Exposition lines for LLMRouter.stats(): per-provider tiers plus their gateways"""
+    tier_metrics = (
+        ("llm_provider_calls_total", "counter", "calls_total", "Calls routed to the provider"),
+        ("llm_provider_failures_total", "counter", "failures_total", "Routed calls that failed and fell back"),
+        ("llm_provider_error_rate", "gauge", "recent_error_rate", "Failed share of the provider's recent calls"),
+    )
+    for name, metric_type, key, documentation in tier_metrics:
+        yield from _family(name, metric_type, documentation)
+        for provider, entry in stats.items():
+            for tier, tier_stats in entry["tiers"].items():
+                labels = [("provider", provider), ("tier", tier), ("model", tier_stats["model"])]
+                yield f"{name}{_format_labels(labels)} {_format_value(tier_stats[key])}"
+    yield from _family("llm_provider_latency_seconds", "gauge", "Recent latency of the provider by quantile")
+    for provider, entry in stats.items():
+        for tier, tier_stats in entry["tiers"].items():
+            for quantile, key in (("0.5", "latency_p50_ms"), ("0.95", "latency_p95_ms")):
+                labels = [("provider", provider), ("tier", tier), ("quantile", quantile)]
+                yield f"llm_provider_latency_seconds{_format_labels(labels)} {_format_value(tier_stats[key] / 1000)}"
+    yield from _family("llm_provider_in_flight", "gauge", "Calls in flight to the provider")
+    for provider, entry in stats.items():
+        yield f"llm_provider_in_flight{_format_labels([('provider', provider)])} {entry['in_flight']}"
+    yield from _family("llm_provider_cost_usd_total", "counter", "Estimated spend from reported token usage")
+    for provider, entry in stats.items():
+        yield f"llm_provider_cost_usd_total{_format_labels([('provider', provider)])} {_format_value(entry['cost_usd'])}"
+    yield from collect_llm_gateway_stats({provider: entry["gateway"] for provider, entry in stats.items()})
@@ -3,7 +3,7 @@ Database models for the Conversational AI Backend
 Milestone 2: Product data models
 Milestone 3: Conversation data schema (users, conversations, messages)
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import BigInteger, Column, Date, Integer, String, Text, DateTime, ForeignKey, Float, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.database import Base
@@ -14,19 +14,55 @@ class Product(Base):
     Product model for e-commerce data from CSV files
     """
     __tablename__ = "products"
+    __table_args__ = (
+        # Filtered listings (product_query): equality on category or brand,
+        # then the sort column, then id as the keyset tie-breaker
+        Index("ix_products_category_price_id", "category", "price", "id"),
+        Index("ix_products_category_rating_id", "category", "rating", "id"),
+        Index("ix_products_brand_price_id", "brand", "price", "id"),
+        Index("ix_products_brand_rating_id", "brand", "rating", "id"),
+        # Unfiltered listings sorted by price or rating
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_rating_id", "rating", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False, index=True)
     category = Column(String, index=True)
-    price = Column(Float)
+    price = Column(Float, index=True)
     description = Column(Text)
     brand = Column(String, index=True)
     sku = Column(String, unique=True, index=True)
     stock_quantity = Column(Integer, default=0)
     rating = Column(Float)
+    # Hash of the source CSV values, used by catalogue sync to skip unchanged rows
+    content_hash = Column(String(40))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class CatalogChange(Base):
+    """
+    Log of product changes written by loaders, replayed by API workers to
+    invalidate caches derived from the catalogue
+    """
+    __tablename__ = "catalog_changes"
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer)  # NULL for a full reload
+    change_type = Column(String(10), nullable=False)  # insert, update, delete, reload
+    changed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class CatalogReader(Base):
+    """
+    Position of each API worker in the catalogue change log; rows below the
+    lowest position of the live readers are pruned
+    """
+    __tablename__ = "catalog_readers"
+    
+    reader = Column(String(100), primary_key=True)
+    position = Column(Integer, nullable=False)
+    polled_at = Column(DateTime(timezone=True), nullable=False)
+
 # Milestone 3: Conversation data schema
 class User(Base):
     """
@@ -49,23 +85,42 @@ class Conversation(Base):
     Conversation model for storing conversation threads
     """
     __tablename__ = "conversations"
+    __table_args__ = (
+        # A user's conversations, most recently updated first
+        Index("ix_conversations_user_updated", "user_id", "updated_at"),
+        # Recently active conversations across users, for the statistics
+        Index("ix_conversations_updated_at", "updated_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     title = Column(String, default="New Conversation")
     is_active = Column(Boolean, default=True)
+    # Rolling summary of the messages up to summary_until_message_id that
+    # no longer fit in the LLM context window
+    summary = Column(Text)
+    summary_until_message_id = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="conversations")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    messages = relationship(
+        "Message",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        order_by="(Message.timestamp, Message.id)"
+    )
 
 class Message(Base):
     """
     Message model for storing chronological messages in conversations
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset pagination of a conversation's history on (timestamp, id)
+        Index("ix_messages_conversation_timestamp_id", "conversation_id", "timestamp", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -75,3 +130,47 @@ class Message(Base):
     
     # Relationship
     conversation = relationship("Conversation", back_populates="messages")
+
+# Materialized application statistics (app_stats)
+class StatsCounter(Base):
+    """
+    One maintained statistic. Counters over append-only tables advance from
+    high_water_id, the largest row id already counted; gauges are recomputed
+    and only use value and refreshed_at.
+    """
+    __tablename__ = "stats_counters"
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    high_water_id = Column(BigInteger, nullable=False, default=0)
+    refreshed_at = Column(DateTime(timezone=True))
+
+class StatsDaily(Base):
+    """
+    Users, conversations and messages created per UTC day
+    """
+    __tablename__ = "stats_daily"
+    
+    day = Column(Date, primary_key=True)
+    users = Column(Integer, nullable=False, default=0)
+    conversations = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)
+
+# Durable background jobs (background_jobs)
+class BackgroundJob(Base):
+    """
+    A background job that did not fit the in-process queue or was still
+    pending at shutdown. A worker claims it by setting claimed_at; claims
+    older than the lease are taken over. Jobs out of attempts keep failed_at
+    and last_error for inspection.
+    """
+    __tablename__ = "background_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True), index=True)
+    failed_at = Column(DateTime(timezone=True))
+    last_error = Column(Text)
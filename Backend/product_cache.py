@@ -0,0 +1,229 @@
+"""
+In-process product catalogue cache
+
+Sits in front of the product reads (crud.get_product, crud.get_products,
+crud.search_products, product_query pages and the hybrid lookup used by the
+chat service):
+- products are kept as compact immutable CachedProduct records in an LRU
+  keyed by id, stamped with the catalogue version they were read at
+- query results are kept in a second LRU as tuples of product ids
+
+Catalogue changes published through catalog_events (loaders, catalogue sync,
+crud.create_product, and other workers via the change log) evict the changed
+products and all query results; a full reload clears everything. Results
+read while a change was being applied are not stored.
+"""
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend import catalog_events, crud, product_query, query_parser, vector_index
+from backend.config import settings
+
+@dataclass(frozen=True, slots=True)
+class CachedProduct:
+    """Detached read-only copy of a product row"""
+    id: int
+    name: str
+    category: Optional[str]
+    price: Optional[float]
+    description: Optional[str]
+    brand: Optional[str]
+    sku: Optional[str]
+    stock_quantity: Optional[int]
+    rating: Optional[float]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    
+    @classmethod
+    def from_model(cls, product) -> "CachedProduct":
+        return cls(**{name: getattr(product, name) for name in cls.__slots__})
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used key"""
+    
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[Hashable, object]" = OrderedDict()
+    
+    def get(self, key: Hashable):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+    
+    def put(self, key: Hashable, value):
+        if self.max_items <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+    
+    def pop(self, key: Hashable):
+        self._items.pop(key, None)
+    
+    def clear(self):
+        self._items.clear()
+    
+    def __len__(self) -> int:
+        return len(self._items)
+
+class ProductCache:
+    """Product records and query results, invalidated by catalogue changes"""
+    
+    def __init__(self, max_products: int, max_queries: int):
+        self.products = LRUCache(max_products)
+        self.queries = LRUCache(max_queries)
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.invalidations = 0
+        self._lock = threading.Lock()
+    
+    def get_product(self, product_id: int) -> Optional[CachedProduct]:
+        with self._lock:
+            product = self.products.get(product_id)
+            if product is None:
+                self.misses["product"] += 1
+            else:
+                self.hits["product"] += 1
+            return product
+    
+    def get_query(self, kind: str, key: Hashable) -> Optional[List[CachedProduct]]:
+        """Cached result of a query; a miss if any of its products was evicted"""
+        with self._lock:
+            ids = self.queries.get((kind, key))
+            products = None
+            if ids is not None:
+                products = [self.products.get(product_id) for product_id in ids]
+                if any(product is None for product in products):
+                    products = None
+            if products is None:
+                self.misses[kind] += 1
+            else:
+                self.hits[kind] += 1
+            return products
+    
+    def put_products(self, products: Iterable, version: int) -> List[CachedProduct]:
+        """
+        Convert rows read at catalogue `version` to cached records, storing
+        them only if no change was published since
+        """
+        records = [CachedProduct.from_model(product) for product in products]
+        with self._lock:
+            if version == catalog_events.get_version():
+                for record in records:
+                    self.products.put(record.id, record)
+        return records
+    
+    def put_query(self, kind: str, key: Hashable, products: Iterable, version: int) -> List[CachedProduct]:
+        records = self.put_products(products, version)
+        with self._lock:
+            if version == catalog_events.get_version():
+                self.queries.put((kind, key), tuple(record.id for record in records))
+        return records
+    
+    def invalidate(self, change: catalog_events.CatalogChange):
+        with self._lock:
+            self.invalidations += 1
+            if change.full_reload:
+                self.products.clear()
+            else:
+                for product_id in change.product_ids:
+                    self.products.pop(product_id)
+            # Any change can alter which products a query matches
+            self.queries.clear()
+    
+    def clear(self):
+        with self._lock:
+            self.products.clear()
+            self.queries.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            return {
+                "catalog_version": catalog_events.get_version(),
+                "products": len(self.products),
+                "max_products": self.products.max_items,
+                "queries": len(self.queries),
+                "max_queries": self.queries.max_items,
+                "invalidations": self.invalidations,
+                "lookups": {
+                    kind: {
+                        "hits": self.hits[kind],
+                        "misses": self.misses[kind],
+                        "hit_rate": round(self.hits[kind] / max(self.hits[kind] + self.misses[kind], 1), 4)
+                    }
+                    for kind in kinds
+                }
+            }
+
+product_cache = ProductCache(settings.PRODUCT_CACHE_MAX_PRODUCTS, settings.PRODUCT_CACHE_MAX_QUERIES)
+catalog_events.subscribe(product_cache.invalidate)
+
+def get_product(db: Session, product_id: int) -> Optional[CachedProduct]:
+    """Cached crud.get_product"""
+    product = product_cache.get_product(product_id)
+    if product is not None:
+        return product
+    version = catalog_events.get_version()
+    row = crud.get_product(db, product_id)
+    if row is None:
+        return None
+    return product_cache.put_products([row], version)[0]
+
+def get_products(db: Session, skip: int = 0, limit: int = 100) -> List[CachedProduct]:
+    """Cached crud.get_products"""
+    key = (skip, limit)
+    products = product_cache.get_query("list", key)
+    if products is not None:
+        return products
+    version = catalog_events.get_version()
+    return product_cache.put_query("list", key, crud.get_products(db, skip=skip, limit=limit), version)
+
+def search_products(db: Session, query: str, limit: int = 20, offset: int = 0) -> List[CachedProduct]:
+    """Cached crud.search_products"""
+    key = (tuple(query_parser.tokenize(query)), limit, offset)
+    products = product_cache.get_query("search", key)
+    if products is not None:
+        return products
+    version = catalog_events.get_version()
+    return product_cache.put_query("search", key, crud.search_products(db, query, limit=limit, offset=offset), version)
+
+def query_products(
+    db: Session,
+    filters: product_query.ProductFilters,
+    sort: str = "id",
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> Tuple[List[CachedProduct], Optional[str]]:
+    """Cached product_query page: the products and the cursor of the next page"""
+    after = product_query.decode_cursor(cursor, sort) if cursor else None
+    key = (filters, sort, cursor, limit)
+    rows = product_cache.get_query("query", key)
+    if rows is None:
+        version = catalog_events.get_version()
+        # One extra row tells whether another page follows
+        rows = product_cache.put_query(
+            "query", key, product_query.fetch_rows(db, filters, sort=sort, after=after, limit=limit + 1), version
+        )
+    return rows[:limit], product_query.next_cursor(rows, sort, limit)
+
+async def find_products(db: AsyncSession, parsed: query_parser.ParsedQuery, limit: int = 5) -> List[CachedProduct]:
+    """Cached hybrid (lexical + vector) product lookup for the chat product context"""
+    key = (
+        tuple(parsed.terms), tuple(parsed.brands), tuple(parsed.categories),
+        parsed.min_price, parsed.max_price, parsed.min_rating, parsed.in_stock, limit
+    )
+    products = product_cache.get_query("find", key)
+    if products is not None:
+        return products
+    version = catalog_events.get_version()
+    rows = await vector_index.hybrid_find_products(db, parsed, limit=limit)
+    return product_cache.put_query("find", key, rows, version)
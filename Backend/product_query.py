@@ -0,0 +1,239 @@
+"""
+Structured product queries: filters, sorting, keyset paging and facets
+
+Filters are category, brand, price range, minimum rating and in stock
+(stock_quantity > 0). Pages are read with keyset pagination: a page ends
+with an opaque cursor holding the sort value and id of its last row, and the
+next page starts strictly after that row, so a deep page costs the same as
+the first. Every sort breaks ties on id in the same direction, which the
+composite (category or brand, price or rating, id) indexes on products serve
+without a sort step. NULL prices and ratings keep the database's own NULL
+ordering so those indexes still apply.
+
+Facet counts per category and brand apply every filter except the facet's
+own, so the UI can show how many products each other choice would give.
+Counts grouped by (category, brand, in stock) are precomputed per catalogue
+version and rebuilt on the first request after a catalogue change; filters
+on those dimensions alone are answered from them, price and rating filters
+are counted in SQL.
+"""
+import base64
+import json
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from backend import catalog_events, models, search
+
+# Sort name -> (product column, descending)
+SORTS: Dict[str, Tuple[str, bool]] = {
+    "id": ("id", False),
+    "newest": ("id", True),
+    "name": ("name", False),
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "rating": ("rating", True),
+}
+
+@dataclass(frozen=True)
+class ProductFilters:
+    """Structured product filters; empty tuples and None mean no restriction"""
+    categories: Tuple[str, ...] = ()
+    brands: Tuple[str, ...] = ()
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_rating: Optional[float] = None
+    in_stock: bool = False
+    
+    def apply(self, stmt: Select, skip_categories: bool = False, skip_brands: bool = False) -> Select:
+        return search.apply_filters(
+            stmt,
+            () if skip_brands else self.brands,
+            () if skip_categories else self.categories,
+            self.min_price,
+            self.max_price,
+            self.min_rating,
+            self.in_stock
+        )
+    
+    @property
+    def only_precomputed_dimensions(self) -> bool:
+        """Whether the facet table alone can answer facet counts for these filters"""
+        return self.min_price is None and self.max_price is None and self.min_rating is None
+
+# Sort column -> types a cursor's sort value may have (None is allowed for NULLs)
+CURSOR_VALUE_TYPES: Dict[str, Tuple[type, ...]] = {
+    "id": (int,),
+    "name": (str,),
+    "price": (int, float),
+    "rating": (int, float),
+}
+
+def _is_a(value: Any, types: Tuple[type, ...]) -> bool:
+    # JSON true/false decode to bool, an int subclass, and are never valid
+    return isinstance(value, types) and not isinstance(value, bool)
+
+class InvalidCursorError(ValueError):
+    """A cursor that is malformed or was issued for another sort order"""
+
+def encode_cursor(sort: str, value: Any, product_id: int) -> str:
+    raw = json.dumps([sort, value, product_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """(sort value, id) of the row a cursor points after"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, product_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursorError("Malformed cursor")
+    if cursor_sort != sort or not _is_a(product_id, (int,)):
+        raise InvalidCursorError("Cursor was issued for a different sort order")
+    if value is not None and not _is_a(value, CURSOR_VALUE_TYPES[SORTS[sort][0]]):
+        raise InvalidCursorError("Malformed cursor")
+    return value, product_id
+
+def nulls_sort_high(dialect: str) -> bool:
+    """Whether the database orders NULL after every value in ascending order"""
+    return dialect not in ("sqlite", "mysql", "mariadb")
+
+def _after_row(column, value: Any, last_id: int, descending: bool, nulls_first: bool):
+    """Rows strictly after (value, last_id) in ORDER BY column, id (both ascending or both descending)"""
+    id_column = models.Product.id
+    id_after = id_column < last_id if descending else id_column > last_id
+    if column is id_column:
+        return id_after
+    if value is None:
+        # Within the NULL block only later ids follow; after it, every
+        # non-NULL value when the NULLs come first
+        condition = and_(column.is_(None), id_after)
+        return or_(condition, column.is_not(None)) if nulls_first else condition
+    value_after = column < value if descending else column > value
+    # The redundant bound lets the database seek the index instead of
+    # filtering every row before the cursor
+    value_bound = column <= value if descending else column >= value
+    condition = and_(value_bound, or_(value_after, and_(column == value, id_after)))
+    return condition if nulls_first else or_(condition, column.is_(None))
+
+def build_page_statement(
+    dialect: str,
+    filters: ProductFilters,
+    sort: str = "id",
+    after: Optional[Tuple[Any, int]] = None,
+    limit: int = 20
+) -> Select:
+    """Filtered products in `sort` order, starting after the (value, id) keyset"""
+    column_name, descending = SORTS[sort]
+    column = getattr(models.Product, column_name)
+    id_column = models.Product.id
+    stmt = filters.apply(select(models.Product))
+    if after is not None:
+        nulls_first = descending == nulls_sort_high(dialect)
+        stmt = stmt.where(_after_row(column, after[0], after[1], descending, nulls_first))
+    if column is id_column:
+        order = [id_column.desc() if descending else id_column]
+    else:
+        order = [column.desc(), id_column.desc()] if descending else [column, id_column]
+    return stmt.order_by(*order).limit(limit)
+
+def fetch_rows(
+    db: Session,
+    filters: ProductFilters,
+    sort: str = "id",
+    after: Optional[Tuple[Any, int]] = None,
+    limit: int = 20
+) -> List[models.Product]:
+    stmt = build_page_statement(db.get_bind().dialect.name, filters, sort=sort, after=after, limit=limit)
+    return list(db.execute(stmt).scalars().all())
+
+def next_cursor(rows: Sequence[Any], sort: str, limit: int) -> Optional[str]:
+    """Cursor after the page's last row, given up to limit + 1 rows; None on the last page"""
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return encode_cursor(sort, getattr(last, SORTS[sort][0]), last.id)
+
+class FacetTable:
+    """Product counts grouped by (category, brand, in stock) at one catalogue version"""
+    
+    def __init__(self, rows: Sequence[Tuple[Optional[str], Optional[str], Any, int]], version: int):
+        self.version = version
+        self.counts: Counter = Counter()
+        for category, brand, in_stock, count in rows:
+            self.counts[(category, brand, bool(in_stock))] += count
+    
+    def facets(self, filters: ProductFilters) -> Dict[str, Any]:
+        total = 0
+        categories: Counter = Counter()
+        brands: Counter = Counter()
+        for (category, brand, in_stock), count in self.counts.items():
+            if filters.in_stock and not in_stock:
+                continue
+            category_matches = not filters.categories or category in filters.categories
+            brand_matches = not filters.brands or brand in filters.brands
+            if brand_matches and category is not None:
+                categories[category] += count
+            if category_matches and brand is not None:
+                brands[brand] += count
+            if category_matches and brand_matches:
+                total += count
+        return _facet_result(total, categories.items(), brands.items())
+
+_facet_table: Optional[FacetTable] = None
+_facet_lock = threading.Lock()
+
+def get_facet_table(db: Session) -> FacetTable:
+    """The precomputed facet counts, rebuilt when the catalogue version has moved on"""
+    global _facet_table
+    version = catalog_events.get_version()
+    table = _facet_table
+    if table is not None and table.version == version:
+        return table
+    with _facet_lock:
+        if _facet_table is not None and _facet_table.version == version:
+            return _facet_table
+        in_stock = (models.Product.stock_quantity > 0).label("in_stock")
+        rows = db.execute(
+            select(models.Product.category, models.Product.brand, in_stock, func.count())
+            .group_by(models.Product.category, models.Product.brand, in_stock)
+        ).all()
+        table = FacetTable(rows, version)
+        # A change published during the read leaves the next request to rebuild
+        if version == catalog_events.get_version():
+            _facet_table = table
+        return table
+
+def get_facets(db: Session, filters: ProductFilters) -> Dict[str, Any]:
+    """Matching total plus per-category and per-brand counts, each ignoring its own filter"""
+    if filters.only_precomputed_dimensions:
+        return get_facet_table(db).facets(filters)
+    return count_facets_in_sql(db, filters)
+
+def count_facets_in_sql(db: Session, filters: ProductFilters) -> Dict[str, Any]:
+    """get_facets with one COUNT and two GROUP BY queries"""
+    category = models.Product.category
+    brand = models.Product.brand
+    total = db.execute(filters.apply(select(func.count()).select_from(models.Product))).scalar_one()
+    categories = db.execute(
+        filters.apply(select(category, func.count()).where(category.is_not(None)), skip_categories=True)
+        .group_by(category)
+    ).all()
+    brands = db.execute(
+        filters.apply(select(brand, func.count()).where(brand.is_not(None)), skip_brands=True)
+        .group_by(brand)
+    ).all()
+    return _facet_result(total, categories, brands)
+
+def _facet_result(total: int, categories, brands) -> Dict[str, Any]:
+    def ordered(counts):
+        return [
+            {"value": value, "count": count}
+            for value, count in sorted(counts, key=lambda item: (-item[1], item[0]))
+            if count
+        ]
+    return {"total": total, "categories": ordered(categories), "brands": ordered(brands)}
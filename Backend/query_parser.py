@@ -0,0 +1,235 @@
+"""
+Query understanding for product lookups
+
+Turns a conversational message into search keywords plus structured filters
+(brands, categories, price range, minimum rating, in stock) so the product lookup is a bounded,
+indexed query instead of a scan for the whole sentence.
+"""
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import catalog_events
+
+# Seconds before the brand/category vocabulary is reloaded from the products table
+VOCABULARY_TTL_SECONDS = 300
+
+# Longest brand or category name, in words, that we try to match
+MAX_PHRASE_WORDS = 3
+
+STOPWORDS = frozenset("""
+a about above after again all am an and any anything are as at available be because been
+before being best below between both but buy by can could did do does doing don down
+during each few find for from further get got had has have having he her here hers him
+his how i if in into is it its just know like looking looks me mine more most my need
+needs no nor not now of off on once only or other our out over own please recommend
+recommendation recommendations same see sell she should show so some something such
+suggest than that the their them then there these they thing things this those through
+to too under until up very want wants was we were what when where which while who why
+will with would you your yours hi hello hey thanks thank cost costs price priced prices
+dollar dollars bucks cheap cheaper cheapest around about less least max maximum min minimum
+budget range within good great nice new stuff
+""".split())
+
+_NUMBER = r"\$?\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?"
+_PRICE_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(rf"\bbetween\s+{_NUMBER}\s+(?:and|to)\s+{_NUMBER}", re.I), "between"),
+    (re.compile(rf"\bfrom\s+{_NUMBER}\s+to\s+{_NUMBER}", re.I), "between"),
+    (re.compile(rf"\$\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?\s*(?:-|to)\s*{_NUMBER}", re.I), "between"),
+    (re.compile(rf"\b(?:under|below|less than|cheaper than|up to|at most|max(?:imum)?|no more than|within)\s+{_NUMBER}", re.I), "max"),
+    (re.compile(rf"\b(?:over|above|more than|at least|min(?:imum)?|starting at|upwards of)\s+{_NUMBER}", re.I), "min"),
+    (re.compile(rf"\b(?:around|about|approximately|roughly)\s+{_NUMBER}", re.I), "around"),
+]
+
+# Relative band used for "around $X"
+AROUND_TOLERANCE = 0.2
+
+# "4 stars", "4.5+ stars", "rated 4 or higher", "rated at least 4"
+_RATING_PATTERNS = [
+    re.compile(r"\b(?:at least\s+|over\s+|above\s+)?(\d(?:\.\d+)?)\s*\+?\s*stars?\b(?:\s+(?:or|and)\s+(?:up|above|higher|more))?", re.I),
+    re.compile(r"\brated\s+(?:at least\s+|over\s+|above\s+)?(\d(?:\.\d+)?)\b(?:\s*\+|\s+(?:or|and)\s+(?:up|above|higher|more))?", re.I),
+]
+_IN_STOCK_PATTERN = re.compile(r"\bin[\s-]stock\b", re.I)
+
+# Highest product rating
+MAX_RATING = 5.0
+
+@dataclass
+class ParsedQuery:
+    """Search keywords and structured filters extracted from a message"""
+    terms: List[str] = field(default_factory=list)
+    brands: List[str] = field(default_factory=list)
+    categories: List[str] = field(default_factory=list)
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_rating: Optional[float] = None
+    in_stock: bool = False
+    
+    @property
+    def has_filters(self) -> bool:
+        return bool(
+            self.brands or self.categories or self.min_price is not None or self.max_price is not None
+            or self.min_rating is not None or self.in_stock
+        )
+    
+    @property
+    def is_empty(self) -> bool:
+        return not self.terms and not self.has_filters
+
+class ProductVocabulary:
+    """
+    Lookup of brand and category phrases (lowercased, with naive plural and
+    singular variants) to their canonical spelling in the products table
+    """
+    
+    def __init__(self, brands: Iterable[str], categories: Iterable[str]):
+        self.brands = self._index(brands)
+        self.categories = self._index(categories)
+        self.loaded_at = time.monotonic()
+    
+    @staticmethod
+    def _index(values: Iterable[str]) -> Dict[str, str]:
+        index = {}
+        for value in values:
+            if not value:
+                continue
+            key = " ".join(tokenize(value, drop_stopwords=False))
+            if not key:
+                continue
+            index[key] = value
+            if key.endswith("s"):
+                index.setdefault(key[:-1], value)
+            else:
+                index.setdefault(key + "s", value)
+        return index
+    
+    def match(self, words: List[str]) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Greedily match the longest brand/category phrases in `words`.
+        Returns (brands, categories, unmatched words).
+        """
+        brands, categories, rest = [], [], []
+        i = 0
+        while i < len(words):
+            for size in range(min(MAX_PHRASE_WORDS, len(words) - i), 0, -1):
+                phrase = " ".join(words[i:i + size])
+                if phrase in self.brands:
+                    if self.brands[phrase] not in brands:
+                        brands.append(self.brands[phrase])
+                    break
+                if phrase in self.categories:
+                    if self.categories[phrase] not in categories:
+                        categories.append(self.categories[phrase])
+                    break
+            else:
+                size = 1
+                rest.append(words[i])
+            i += size
+        return brands, categories, rest
+
+def tokenize(text: str, drop_stopwords: bool = True) -> List[str]:
+    """Lowercased word tokens, optionally without stopwords"""
+    words = re.findall(r"\w+", text.lower())
+    if drop_stopwords:
+        words = [w for w in words if w not in STOPWORDS]
+    return words
+
+def _to_number(digits: str, thousands: Optional[str]) -> float:
+    value = float(digits.replace(",", ""))
+    return value * 1000 if thousands else value
+
+def extract_price_range(message: str) -> Tuple[Optional[float], Optional[float], str]:
+    """
+    Find a price constraint such as "under $500" or "between 200 and 400".
+    Returns (min_price, max_price, message with the price phrase removed).
+    """
+    for pattern, kind in _PRICE_PATTERNS:
+        match = pattern.search(message)
+        if not match:
+            continue
+        groups = match.groups()
+        remainder = message[:match.start()] + " " + message[match.end():]
+        if kind == "between":
+            low, high = sorted((_to_number(groups[0], groups[1]), _to_number(groups[2], groups[3])))
+            return low, high, remainder
+        value = _to_number(groups[0], groups[1])
+        if kind == "max":
+            return None, value, remainder
+        if kind == "min":
+            return value, None, remainder
+        return value * (1 - AROUND_TOLERANCE), value * (1 + AROUND_TOLERANCE), remainder
+    return None, None, message
+
+def extract_rating_and_stock(message: str) -> Tuple[Optional[float], bool, str]:
+    """
+    Find a minimum rating ("4+ stars", "rated at least 4") and an in-stock
+    requirement. Returns (min_rating, in_stock, message with both removed).
+    """
+    min_rating = None
+    for pattern in _RATING_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            value = float(match.group(1))
+            if 0 < value <= MAX_RATING:
+                min_rating = value
+                message = message[:match.start()] + " " + message[match.end():]
+            break
+    in_stock = False
+    match = _IN_STOCK_PATTERN.search(message)
+    if match:
+        in_stock = True
+        message = message[:match.start()] + " " + message[match.end():]
+    return min_rating, in_stock, message
+
+def parse_query(message: str, vocabulary: Optional[ProductVocabulary] = None) -> ParsedQuery:
+    """
+    Tokenize a message, drop stopwords, pull out a rating, stock and price
+    constraint and detect known brands and categories. Words that matched a
+    brand or category become filters rather than search terms.
+    """
+    # Ratings first, so "at least 4 stars" is not read as a price
+    min_rating, in_stock, remainder = extract_rating_and_stock(message)
+    min_price, max_price, remainder = extract_price_range(remainder)
+    words = tokenize(remainder)
+    brands: List[str] = []
+    categories: List[str] = []
+    if vocabulary is not None:
+        brands, categories, words = vocabulary.match(words)
+    # Numbers left over ("15" in "iphone 15") are kept, lone digits dropped
+    terms = [w for w in words if len(w) > 1]
+    return ParsedQuery(
+        terms=list(dict.fromkeys(terms)),
+        brands=brands,
+        categories=categories,
+        min_price=min_price,
+        max_price=max_price,
+        min_rating=min_rating,
+        in_stock=in_stock,
+    )
+
+_vocabulary: Optional[ProductVocabulary] = None
+
+async def get_vocabulary(db: AsyncSession) -> ProductVocabulary:
+    """
+    Return the cached brand/category vocabulary, rebuilding it from the
+    products table when it is older than VOCABULARY_TTL_SECONDS
+    """
+    global _vocabulary
+    if _vocabulary is None or time.monotonic() - _vocabulary.loaded_at > VOCABULARY_TTL_SECONDS:
+        from backend import async_crud
+        brands, categories = await async_crud.get_brands_and_categories(db)
+        _vocabulary = ProductVocabulary(brands, categories)
+    return _vocabulary
+
+def invalidate_vocabulary():
+    """Force the next get_vocabulary() call to reload from the database"""
+    global _vocabulary
+    _vocabulary = None
+
+def _on_catalog_change(change: catalog_events.CatalogChange):
+    invalidate_vocabulary()
+
+catalog_events.subscribe(_on_catalog_change)
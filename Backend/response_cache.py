@@ -0,0 +1,259 @@
+"""
+Response cache for repeated LLM questions
+
+Responses are keyed on a normalized prompt fingerprint:
+- the system prompt (whitespace collapsed)
+- the last RESPONSE_CACHE_CONTEXT_MESSAGES prompt messages before the
+  current one (summary and recent turns), each truncated
+- the catalogue version, which stands in for the product context
+- the user message (lowercased, punctuation and extra whitespace removed)
+
+The exact tier matches the whole fingerprint. The optional semantic tier
+compares a locally computed hashed bag-of-words embedding of the user
+message (stopwords dropped) with entries sharing the same system prompt, context, catalogue
+version and numbers (so "under $500" never answers "under $1000"), and
+serves the best match above RESPONSE_CACHE_SIMILARITY. Entries expire after
+RESPONSE_CACHE_TTL_SECONDS and are evicted least recently used first; a
+catalogue change clears the cache.
+
+Misses with the same exact key that arrive while the first one is still
+waiting on the LLM join its call instead of starting their own (single
+flight), which covers bursts of identical questions on a cold cache.
+"""
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from backend import catalog_events, query_parser
+from backend.config import settings
+
+# Characters kept from each context message in the fingerprint
+CONTEXT_MESSAGE_CHARS = 256
+
+# Dimensions of the hashed bag-of-words embedding
+EMBEDDING_DIMENSIONS = 512
+
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip punctuation and thousands separators, collapse whitespace"""
+    text = re.sub(r"(?<=\d),(?=\d)", "", text.lower())
+    return " ".join(re.findall(r"\d+(?:\.\d+)?|[^\W\d_]+|[$%]", text))
+
+def embed(text: str) -> Dict[int, float]:
+    """
+    Unit-length sparse embedding from hashed unigrams and bigrams of the
+    non-stopword words; cheap, deterministic and computed locally
+    """
+    words = [word for word in query_parser.tokenize(text) if not word.isdigit()]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Counter = Counter()
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest, "little")
+        vector[index % EMBEDDING_DIMENSIONS] += -1.0 if index >> 63 else 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items() if v} if norm else {}
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+@dataclass
+class Fingerprint:
+    """Exact cache key plus the parts used by the semantic tier"""
+    key: str
+    scope: str  # everything except the user message wording
+    message: str
+
+def fingerprint(messages: Sequence[Dict[str, str]], user_message: str, catalog_version: int,
+                context_messages: int = None) -> Fingerprint:
+    """Normalized fingerprint of a chat completion request"""
+    if context_messages is None:
+        context_messages = settings.RESPONSE_CACHE_CONTEXT_MESSAGES
+    current = max(
+        (i for i, m in enumerate(messages) if m["role"] == "user" and m["content"] == user_message),
+        default=len(messages)
+    )
+    system_prompt = " ".join(messages[0]["content"].split()) if messages else ""
+    context = messages[1:current][-context_messages:] if context_messages > 0 else []
+    message = normalize_text(user_message)
+    numbers = sorted(NUMBER_PATTERN.findall(message))
+    scope_parts = [system_prompt, str(catalog_version), " ".join(numbers)]
+    scope_parts += [f"{m['role']}:{normalize_text(m['content'][:CONTEXT_MESSAGE_CHARS])}" for m in context]
+    scope = hashlib.sha256("\x1e".join(scope_parts).encode("utf-8")).hexdigest()
+    key = hashlib.sha256(f"{scope}\x1e{message}".encode("utf-8")).hexdigest()
+    return Fingerprint(key=key, scope=scope, message=message)
+
+@dataclass
+class CacheEntry:
+    response: str
+    scope: str
+    embedding: Optional[Dict[int, float]]
+    created: float
+    latency: float  # seconds the original LLM call took
+
+class ResponseCache:
+    """Exact and semantic LRU + TTL cache of LLM responses"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float, semantic: bool, similarity: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity = similarity
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._scopes: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+    
+    def get(self, fp: Fingerprint) -> Optional[str]:
+        """Cached response for a fingerprint, trying the exact tier first"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live_entry(fp.key, now)
+            if entry is not None:
+                self.exact_hits += 1
+            elif self.semantic:
+                entry = self._nearest(fp, now)
+                if entry is not None:
+                    self.semantic_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.saved_seconds += entry.latency
+            return entry.response
+    
+    def put(self, fp: Fingerprint, response: str, latency: float):
+        if not self.enabled:
+            return
+        embedding = embed(fp.message) if self.semantic else None
+        with self._lock:
+            self._remove(fp.key)
+            self._entries[fp.key] = CacheEntry(response, fp.scope, embedding, time.monotonic(), latency)
+            self._scopes.setdefault(fp.scope, set()).add(fp.key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+    
+    def on_catalog_change(self, change: catalog_events.CatalogChange):
+        # Keys already include the catalogue version; clearing frees the memory
+        self.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "semantic": self.semantic,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / max(lookups, 1), 4),
+                "saved_llm_seconds": round(self.saved_seconds, 3)
+            }
+    
+    def _live_entry(self, key: str, now: float) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry.created > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+    
+    def _nearest(self, fp: Fingerprint, now: float) -> Optional[CacheEntry]:
+        query = embed(fp.message)
+        if not query:
+            return None
+        best_key, best_score = None, self.similarity
+        for key in list(self._scopes.get(fp.scope, ())):
+            entry = self._live_entry(key, now)
+            if entry is None or not entry.embedding:
+                continue
+            score = cosine(query, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return self._entries[best_key] if best_key is not None else None
+    
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._scopes.get(entry.scope)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._scopes[entry.scope]
+
+class SingleFlight:
+    """Shares one in-flight call among concurrent callers with the same key"""
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+    
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Result of `call`, or of the identical call already in flight. The
+        call runs in its own task, so a caller that goes away (a client
+        disconnect) does not cancel it for the others.
+        """
+        if not self.enabled:
+            return await call()
+        future = self._calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+    
+    def _finish(self, key: str, future: asyncio.Future):
+        self._calls.pop(key, None)
+        # Mark the error as retrieved in case every caller has gone away
+        if not future.cancelled():
+            future.exception()
+    
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls),
+            "calls": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_MAX_ENTRIES,
+    settings.RESPONSE_CACHE_TTL_SECONDS,
+    settings.RESPONSE_CACHE_SEMANTIC,
+    settings.RESPONSE_CACHE_SIMILARITY
+)
+catalog_events.subscribe(response_cache.on_catalog_change)
+
+# LLM completions in flight, keyed on the exact prompt fingerprint
+llm_flights = SingleFlight(settings.LLM_COALESCE)
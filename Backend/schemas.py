@@ -26,6 +26,26 @@ class Product(ProductBase):
     created_at: datetime
     updated_at: datetime
 
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class ProductFacets(BaseModel):
+    """
+    Products matching the filters, plus counts per category and brand that
+    ignore the category and brand filter respectively
+    """
+    total: int
+    categories: List[FacetCount]
+    brands: List[FacetCount]
+
+class ProductPage(BaseModel):
+    """One page of a product query. Pass next_cursor as `cursor` to read the next page."""
+    products: List[Product]
+    has_more: bool
+    next_cursor: Optional[str] = None
+    facets: Optional[ProductFacets] = None
+
 # User schemas
 class UserBase(BaseModel):
     username: str
@@ -57,6 +77,16 @@ class Message(MessageBase):
     conversation_id: int
     timestamp: datetime
 
+class MessagePage(BaseModel):
+    """
+    One page of a conversation's history, oldest first. Pass before_cursor as
+    `before` to read older messages and after_cursor as `after` to read newer ones.
+    """
+    messages: List[Message]
+    has_more: bool
+    before_cursor: Optional[int] = None
+    after_cursor: Optional[int] = None
+
 # Conversation schemas
 class ConversationBase(BaseModel):
     title: Optional[str] = "New Conversation"
@@ -74,11 +104,24 @@ class Conversation(ConversationBase):
     updated_at: datetime
     messages: List[Message] = []
 
+class ConversationSummary(ConversationBase):
+    """Conversation listing entry without message bodies"""
+    id: int
+    user_id: int
+    is_active: bool
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+
 # Chat API schemas
 class ChatRequest(BaseModel):
     user_id: int
     message: str
     conversation_id: Optional[int] = None
+    # False returns only the new user/AI message pair in `messages`
+    include_history: bool = True
 
 class ChatResponse(BaseModel):
     conversation_id: int
@@ -0,0 +1,173 @@
+"""
+Full-text product search
+
+Postgres: a stored, weighted tsvector column with a GIN index, ranked with
+ts_rank_cd (cover density with document length normalization).
+SQLite: an FTS5 external-content table kept in sync by triggers, ranked with
+the built-in bm25() function.
+Other backends fall back to ILIKE matching.
+
+Ranking, filters and LIMIT/OFFSET are always applied in the database.
+"""
+from typing import Optional, Sequence
+
+from sqlalchemy import column, false, or_, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select, func, literal_column
+
+from backend import models
+
+# Longest query we turn into a full-text expression
+MAX_QUERY_TERMS = 16
+
+# Relative weights of name, category, brand and description for bm25()
+SQLITE_BM25_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, category, brand, description,
+        content='products', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, category, brand, description)
+        VALUES (new.id, new.name, new.category, new.brand, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category, brand, description)
+        VALUES ('delete', old.id, old.name, old.category, old.brand, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category, brand, description)
+        VALUES ('delete', old.id, old.name, old.category, old.brand, old.description);
+        INSERT INTO products_fts(rowid, name, category, brand, description)
+        VALUES (new.id, new.name, new.category, new.brand, new.description);
+    END
+    """,
+]
+
+POSTGRES_FTS_DDL = [
+    """
+    ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(brand, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+]
+
+def ensure_search_index(engine: Engine):
+    """
+    Create the full-text index objects for the engine's backend. On SQLite
+    the FTS table is rebuilt from products the first time it is created.
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "sqlite":
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+            ).first()
+            for statement in SQLITE_FTS_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        elif dialect == "postgresql":
+            for statement in POSTGRES_FTS_DDL:
+                conn.execute(text(statement))
+
+def apply_filters(
+    stmt: Select,
+    brands: Sequence[str] = (),
+    categories: Sequence[str] = (),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    in_stock: bool = False
+) -> Select:
+    """Restrict a product statement by brand, category, price, rating and stock"""
+    if brands:
+        stmt = stmt.where(models.Product.brand.in_(list(brands)))
+    if categories:
+        stmt = stmt.where(models.Product.category.in_(list(categories)))
+    if min_price is not None:
+        stmt = stmt.where(models.Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(models.Product.price <= max_price)
+    if min_rating is not None:
+        stmt = stmt.where(models.Product.rating >= min_rating)
+    if in_stock:
+        stmt = stmt.where(models.Product.stock_quantity > 0)
+    return stmt
+
+def build_search_statement(
+    dialect: str,
+    terms: Sequence[str],
+    limit: int = 20,
+    offset: int = 0,
+    brands: Sequence[str] = (),
+    categories: Sequence[str] = (),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    in_stock: bool = False
+) -> Select:
+    """
+    Build a ranked, paged product search statement for the given SQL dialect.
+    Brand, category, price, rating and stock filters are applied in SQL;
+    without search terms the filtered products are returned best rated first.
+    """
+    terms = list(terms)[:MAX_QUERY_TERMS]
+    stmt = apply_filters(select(models.Product), brands, categories, min_price, max_price, min_rating, in_stock)
+    
+    has_filters = bool(
+        brands or categories or min_price is not None or max_price is not None
+        or min_rating is not None or in_stock
+    )
+    if not terms:
+        if not has_filters:
+            return stmt.where(false()).limit(limit)
+        return (
+            stmt.order_by(models.Product.rating.desc().nulls_last(), models.Product.id)
+            .limit(limit)
+            .offset(offset)
+        )
+    
+    if dialect == "sqlite":
+        fts = table("products_fts", column("rowid"))
+        match = " OR ".join(f'"{term}"' for term in terms)
+        weights = ", ".join(str(w) for w in SQLITE_BM25_WEIGHTS)
+        stmt = (
+            stmt.join(fts, fts.c.rowid == models.Product.id)
+            .where(text("products_fts MATCH :match").bindparams(match=match))
+            .order_by(text(f"bm25(products_fts, {weights})"), models.Product.id)
+        )
+    elif dialect == "postgresql":
+        search_vector = literal_column("products.search_vector")
+        ts_query = func.to_tsquery("english", " | ".join(terms))
+        stmt = (
+            stmt.where(search_vector.op("@@")(ts_query))
+            .order_by(func.ts_rank_cd(search_vector, ts_query, 1).desc(), models.Product.id)
+        )
+    else:
+        stmt = stmt.where(or_(*[
+            column_.ilike(f"%{term}%")
+            for term in terms
+            for column_ in (
+                models.Product.name,
+                models.Product.category,
+                models.Product.brand,
+                models.Product.description,
+            )
+        ])).order_by(models.Product.id)
+    
+    return stmt.limit(limit).offset(offset)
@@ -0,0 +1,40 @@
+"""
+Test setup: point the backend at a throwaway SQLite database before any
+backend module creates its engines, and give each test an empty database
+
+    python -m pytest backend/tests
+"""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='backend_tests_'), 'import.db')}"
+os.environ["VECTOR_INDEX_PATH"] = ""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Imported for its side effect: the model classes add every table to
+# Base.metadata, which create_all below needs
+from backend import models  # noqa: F401
+from backend.database import Base
+
+@pytest.fixture
+def database_url(tmp_path):
+    """URL of an SQLite file holding an empty copy of every table"""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+@pytest.fixture
+def db(database_url):
+    """Sync session on the test database"""
+    engine = create_engine(database_url)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,78 @@
+"""Group commit of chat turns, including the per-turn fallback after a failed batch"""
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend import async_crud, models
+from backend.group_commit import GroupCommitter
+
+def turn(content, conversation_id=None):
+    return async_crud.ChatTurn(
+        user_id=1,
+        conversation_id=conversation_id,
+        title="Conversation",
+        user_content=content,
+        ai_content=None if content is None else f"reply to {content}"
+    )
+
+def committer_on(engine, window=0.05):
+    return GroupCommitter(async_crud.write_chat_turns, async_sessionmaker(engine, expire_on_commit=False), window, 100)
+
+def async_engine(database_url):
+    return create_async_engine(database_url.replace("sqlite://", "sqlite+aiosqlite://"))
+
+async def submit_all(database_url, turns):
+    """Submit turns concurrently; (results or exceptions, committer stats, stored user messages)"""
+    engine = async_engine(database_url)
+    try:
+        committer = committer_on(engine)
+        results = await asyncio.gather(*(committer.submit(item) for item in turns), return_exceptions=True)
+        async with engine.connect() as conn:
+            stored = (await conn.execute(
+                select(models.Message.content).where(models.Message.is_user_message.is_(True)).order_by(models.Message.id)
+            )).scalars().all()
+        return results, committer.stats(), stored
+    finally:
+        await engine.dispose()
+
+def test_concurrent_turns_share_one_transaction(database_url):
+    results, stats, stored = asyncio.run(submit_all(database_url, [turn(f"question {i}") for i in range(5)]))
+    assert stats["batches"] == 1 and stats["writes"] == 5 and stats["fallbacks"] == 0
+    assert stored == [f"question {i}" for i in range(5)]
+    conversation_id, user_message, ai_message = results[2]
+    assert user_message.content == "question 2" and ai_message.content == "reply to question 2"
+    assert user_message.conversation_id == ai_message.conversation_id == conversation_id
+
+def test_failed_batch_fails_only_the_bad_turn(database_url):
+    # A NULL message content violates NOT NULL and fails the whole batch
+    turns = [turn("question 0"), turn("question 1"), turn(None), turn("question 3")]
+    results, stats, stored = asyncio.run(submit_all(database_url, turns))
+    assert isinstance(results[2], IntegrityError)
+    for index in (0, 1, 3):
+        assert not isinstance(results[index], Exception)
+        assert results[index][1].content == f"question {index}"
+    assert stats["fallbacks"] == 1
+    # The good turns were committed one by one, in submission order
+    assert stats["batches"] == 3 and stats["writes"] == 3
+    assert stored == ["question 0", "question 1", "question 3"]
+
+def test_a_cancelled_submitter_does_not_cancel_the_write(database_url):
+    async def cancel_one():
+        engine = async_engine(database_url)
+        try:
+            committer = committer_on(engine)
+            cancelled = asyncio.ensure_future(committer.submit(turn("question 0")))
+            kept = asyncio.ensure_future(committer.submit(turn("question 1")))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await kept
+            with pytest.raises(asyncio.CancelledError):
+                await cancelled
+            async with engine.connect() as conn:
+                return (await conn.execute(select(func.count()).select_from(models.Message))).scalar_one()
+        finally:
+            await engine.dispose()
+    assert asyncio.run(cancel_one()) == 4
@@ -0,0 +1,93 @@
+"""Keyset paging of product listings through NULL prices and ratings"""
+import pytest
+
+from backend import models, product_query
+from backend.product_query import ProductFilters
+
+# (price, rating): NULLs, ties on the value, and ties between NULLs
+PRODUCTS = [
+    (None, 4.5), (19.99, None), (5.0, 3.0), (None, None), (19.99, 4.5),
+    (5.0, None), (42.0, 3.0), (None, 4.5), (19.99, 5.0), (42.0, None),
+    (1.0, 3.0), (None, 2.0),
+]
+
+@pytest.fixture
+def products(db):
+    db.add_all([
+        models.Product(name=f"Product {index}", category="Laptops", sku=f"SKU{index}", price=price, rating=rating)
+        for index, (price, rating) in enumerate(PRODUCTS)
+    ])
+    db.commit()
+    return db.query(models.Product).all()
+
+def expected_ids(products, sort):
+    """Ids in SQLite's order for the sort: NULL below every value, ties broken on id in the same direction"""
+    column, descending = product_query.SORTS[sort]
+    ordered = sorted(
+        products,
+        key=lambda product: (getattr(product, column) is not None, getattr(product, column) or 0, product.id),
+        reverse=descending
+    )
+    return [product.id for product in ordered]
+
+def page_through(db, sort, limit, filters=ProductFilters()):
+    """Ids of every page, following next cursors as the API does"""
+    ids = []
+    after = None
+    while True:
+        rows = product_query.fetch_rows(db, filters, sort=sort, after=after, limit=limit + 1)
+        ids += [row.id for row in rows[:limit]]
+        cursor = product_query.next_cursor(rows, sort, limit)
+        if cursor is None:
+            return ids
+        after = product_query.decode_cursor(cursor, sort)
+
+@pytest.mark.parametrize("sort", ["price_asc", "price_desc", "rating"])
+@pytest.mark.parametrize("limit", [1, 2, 3, 5])
+def test_pages_cover_every_product_once_in_order(db, products, sort, limit):
+    assert page_through(db, sort, limit) == expected_ids(products, sort)
+
+@pytest.mark.parametrize("sort", ["price_asc", "price_desc", "rating"])
+def test_filtered_pages_cross_the_null_block(db, products, sort):
+    filters = ProductFilters(categories=("Laptops",))
+    assert page_through(db, sort, 2, filters) == expected_ids(products, sort)
+
+def test_nulls_lead_ascending_and_trail_descending_on_sqlite(db, products):
+    null_price_ids = sorted(product.id for product in products if product.price is None)
+    ascending = page_through(db, "price_asc", 2)
+    descending = page_through(db, "price_desc", 2)
+    assert ascending[:len(null_price_ids)] == null_price_ids
+    assert descending[-len(null_price_ids):] == null_price_ids[::-1]
+
+def test_cursor_for_another_sort_is_rejected(db, products):
+    rows = product_query.fetch_rows(db, ProductFilters(), sort="price_asc", limit=3)
+    cursor = product_query.next_cursor(rows, "price_asc", 2)
+    with pytest.raises(product_query.InvalidCursorError):
+        product_query.decode_cursor(cursor, "rating")
+
+@pytest.mark.parametrize("sort, value", [
+    ("price_asc", [1, 2]),
+    ("price_asc", {"price": 1}),
+    ("price_asc", "19.99"),
+    ("price_desc", True),
+    ("rating", "5"),
+    ("name", 3),
+    ("id", 1.5),
+    ("newest", "7"),
+])
+def test_cursor_value_of_the_wrong_type_is_rejected(db, products, sort, value):
+    cursor = product_query.encode_cursor(sort, value, 3)
+    with pytest.raises(product_query.InvalidCursorError):
+        product_query.decode_cursor(cursor, sort)
+
+@pytest.mark.parametrize("sort, value", [
+    ("price_asc", None),
+    ("price_desc", 5),
+    ("rating", 4.5),
+    ("name", "Product 1"),
+    ("id", 2),
+])
+def test_cursor_values_of_the_sort_type_are_accepted(db, products, sort, value):
+    cursor = product_query.encode_cursor(sort, value, 3)
+    assert product_query.decode_cursor(cursor, sort) == (value, 3)
+    product_query.fetch_rows(db, ProductFilters(), sort=sort, after=(value, 3), limit=2)
@@ -0,0 +1,433 @@
+"""
+Vector retrieval of products
+
+Products (name, brand, category and description) are embedded at ingest
+time and stored as a float32 matrix in VECTOR_INDEX_PATH (vectors.npy, the
+matching ids.npy and meta.json), which API workers memory-map. Queries are
+embedded the same way and scored with a blocked matrix-vector product; from
+VECTOR_IVF_MIN_PRODUCTS products on, rows are grouped by k-means centroid
+(IVF) and only the VECTOR_IVF_PROBES closest lists are scored. The top-k
+hits are filtered in the database and fused with the lexical results by
+reciprocal rank fusion.
+
+Embedders:
+- HashingEmbedder (default): signed feature hashing of words and their
+  six-character prefixes ("flights" ~ "flight", "cancelling" ~ "cancellation")
+- SentenceTransformerEmbedder: a local CPU model, used when VECTOR_MODEL is
+  set and sentence-transformers is installed
+
+The loaders keep the index current (bulk loads rebuild it, catalogue syncs
+patch the changed rows); `python -m backend.vector_index` rebuilds it by hand,
+e.g. after products were added through the API.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import async_crud, catalog_events, models, query_parser
+from backend.config import settings
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+CENTROIDS_FILE = "centroids.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+logger = logging.getLogger(__name__)
+
+# Products embedded per batch while building the index
+EMBED_BATCH_SIZE = 4096
+
+# Rows scored per block, keeping temporaries small for memory-mapped matrices
+SEARCH_BLOCK_ROWS = 262_144
+
+# Rows assigned to IVF lists per block (rows x lists similarity matrix)
+ASSIGN_BLOCK_ROWS = 16_384
+
+# k-means training rows per IVF list, and iterations
+KMEANS_SAMPLE_PER_LIST = 64
+KMEANS_ITERATIONS = 8
+
+# Vector hits fetched per requested product, to leave room for filters
+CANDIDATE_FACTOR = 4
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+# Characters of a word kept for its prefix feature
+PREFIX_CHARS = 6
+
+def product_text(product) -> str:
+    """Text embedded for a product"""
+    return " ".join(part for part in (product.name, product.brand, product.category, product.description) if part)
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word prefixes, L2 normalized"""
+    
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+    
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows: List[int] = []
+        cols: List[int] = []
+        signs: List[float] = []
+        for row, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                if word in query_parser.STOPWORDS:
+                    continue
+                for feature in (word, "~" + word[:PREFIX_CHARS]):
+                    h = zlib.crc32(feature.encode("utf-8"))
+                    rows.append(row)
+                    cols.append(h % self.dimensions)
+                    signs.append(1.0 if h & 0x80000000 else -1.0)
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), np.asarray(signs, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model on CPU"""
+    
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+    
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = self.model.encode(list(texts), batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32)
+
+_embedder = None
+
+def get_embedder():
+    """The configured embedder, created once per process"""
+    global _embedder
+    if _embedder is None:
+        if settings.VECTOR_MODEL:
+            try:
+                _embedder = SentenceTransformerEmbedder(settings.VECTOR_MODEL)
+            except ImportError:  # sentence-transformers is optional
+                logger.warning("sentence-transformers is not installed; using the hashing embedder")
+        if _embedder is None:
+            _embedder = HashingEmbedder(settings.VECTOR_DIMENSIONS)
+    return _embedder
+
+class VectorIndex:
+    """
+    Product ids and their unit-length embeddings. With centroids the rows
+    are grouped by nearest centroid (an IVF index): offsets[c]:offsets[c + 1]
+    are the rows of list c, and a query only scores the closest lists.
+    """
+    
+    def __init__(
+        self,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        embedder_name: str,
+        centroids: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None
+    ):
+        self.ids = ids
+        self.vectors = vectors
+        self.embedder_name = embedder_name
+        self.centroids = centroids
+        self.offsets = offsets
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Optional["VectorIndex"]:
+        """Open a saved index (memory-mapped by default); None if there is none"""
+        try:
+            with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            mode = "r" if mmap else None
+            arrays = {
+                name: np.load(os.path.join(path, filename), mmap_mode=mode)
+                for name, filename in meta["files"].items()
+            }
+        except FileNotFoundError:
+            return None
+        return cls(
+            arrays["ids"], arrays["vectors"], meta["embedder"],
+            arrays.get("centroids"), arrays.get("offsets")
+        )
+    
+    def save(self, path: str, use_ivf: Optional[bool] = None):
+        """
+        Write the index next to the current one and switch meta.json over
+        last, so readers never see a half-written index. Large indexes get
+        IVF centroids (reused from this index when it already has them).
+        """
+        if use_ivf is None:
+            use_ivf = 0 < settings.VECTOR_IVF_MIN_PRODUCTS <= len(self.ids)
+        centroids = None
+        order = None
+        offsets = None
+        if use_ivf:
+            centroids = self.centroids
+            if centroids is None:
+                centroids = train_centroids(self.vectors, ivf_list_count(len(self.ids)))
+            lists = assign_lists(self.vectors, centroids)
+            order = np.argsort(lists, kind="stable")
+            offsets = np.searchsorted(lists[order], np.arange(len(centroids) + 1)).astype(np.int64)
+        
+        os.makedirs(path, exist_ok=True)
+        stamp = f"{int(time.time() * 1000)}"
+        files = {"ids": f"{stamp}-{IDS_FILE}", "vectors": f"{stamp}-{VECTORS_FILE}"}
+        ids = np.lib.format.open_memmap(os.path.join(path, files["ids"]), mode="w+", dtype=np.int64, shape=self.ids.shape)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(path, files["vectors"]), mode="w+", dtype=np.float32, shape=self.vectors.shape
+        )
+        for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+            rows = slice(start, start + SEARCH_BLOCK_ROWS) if order is None else order[start:start + SEARCH_BLOCK_ROWS]
+            ids[start:start + SEARCH_BLOCK_ROWS] = self.ids[rows]
+            vectors[start:start + SEARCH_BLOCK_ROWS] = self.vectors[rows]
+        ids.flush()
+        vectors.flush()
+        del ids, vectors
+        if use_ivf:
+            files["centroids"] = f"{stamp}-{CENTROIDS_FILE}"
+            files["offsets"] = f"{stamp}-{OFFSETS_FILE}"
+            np.save(os.path.join(path, files["centroids"]), centroids.astype(np.float32))
+            np.save(os.path.join(path, files["offsets"]), offsets)
+        _write_meta(path, files, self.embedder_name, len(self.ids))
+    
+    def search(self, query: np.ndarray, k: int, probes: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (product id, cosine similarity) pairs with a positive score;
+        exact, or over the `probes` closest IVF lists
+        """
+        if k <= 0 or len(self.ids) == 0:
+            return []
+        query = query.astype(np.float32)
+        if self.centroids is None:
+            ranges = [(start, min(start + SEARCH_BLOCK_ROWS, len(self.ids))) for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS)]
+        else:
+            probes = min(probes or settings.VECTOR_IVF_PROBES, len(self.centroids))
+            closest = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+            ranges = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in closest]
+        
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start, end in ranges:
+            if start == end:
+                continue
+            scores = self.vectors[start:end] @ query
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return [
+            (int(self.ids[best_rows[i]]), float(best_scores[i]))
+            for i in order if best_scores[i] > 0
+        ]
+
+def ivf_list_count(rows: int) -> int:
+    """About sqrt(N) lists, as is usual for IVF indexes"""
+    return max(1, int(math.sqrt(rows)))
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row"""
+    lists = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return lists
+
+def train_centroids(vectors: np.ndarray, count: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the rows"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), max(KMEANS_SAMPLE_PER_LIST * count, count))
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), count, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        lists = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, lists, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+def _write_meta(path: str, files: Dict[str, str], embedder_name: str, count: int):
+    previous = None
+    meta_path = os.path.join(path, META_FILE)
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as file:
+            previous = json.load(file)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"files": files, "embedder": embedder_name, "count": count}, file)
+    os.replace(tmp_path, meta_path)
+    # Workers that still map the previous files keep them alive until they reload
+    if previous is not None:
+        for name in previous.get("files", {}).values():
+            if name not in files.values():
+                try:
+                    os.remove(os.path.join(path, name))
+                except FileNotFoundError:
+                    pass
+
+def build_index(engine: Engine, path: Optional[str] = None, batch_size: int = EMBED_BATCH_SIZE) -> VectorIndex:
+    """Embed every product, streaming batches into a scratch memory-mapped matrix"""
+    path = path or settings.VECTOR_INDEX_PATH
+    embedder = get_embedder()
+    os.makedirs(path, exist_ok=True)
+    scratch = [os.path.join(path, f"building-{os.getpid()}-{name}") for name in (IDS_FILE, VECTORS_FILE)]
+    
+    with engine.connect() as conn:
+        count = conn.execute(select(func.count(models.Product.id))).scalar_one()
+        ids = np.lib.format.open_memmap(scratch[0], mode="w+", dtype=np.int64, shape=(count,))
+        vectors = np.lib.format.open_memmap(scratch[1], mode="w+", dtype=np.float32, shape=(count, embedder.dimensions))
+        rows = conn.execution_options(yield_per=batch_size).execute(
+            select(models.Product.id, models.Product.name, models.Product.brand,
+                   models.Product.category, models.Product.description)
+            .order_by(models.Product.id)
+        )
+        filled = 0
+        for batch in rows.partitions():
+            batch = batch[:count - filled]
+            ids[filled:filled + len(batch)] = [row.id for row in batch]
+            vectors[filled:filled + len(batch)] = embedder.embed([product_text(row) for row in batch])
+            filled += len(batch)
+    
+    try:
+        VectorIndex(ids[:filled], vectors[:filled], embedder.name).save(path)
+    finally:
+        del ids, vectors
+        for scratch_path in scratch:
+            os.remove(scratch_path)
+    return VectorIndex.load(path)
+
+def update_index(engine: Engine, change: catalog_events.CatalogChange, path: Optional[str] = None) -> VectorIndex:
+    """
+    Re-embed only the products in a change, keeping existing IVF centroids;
+    falls back to a full build without a compatible index or for a full reload
+    """
+    path = path or settings.VECTOR_INDEX_PATH
+    index = VectorIndex.load(path)
+    embedder = get_embedder()
+    if change.full_reload or index is None or index.embedder_name != embedder.name:
+        return build_index(engine, path)
+    if change.is_empty:
+        return index
+    
+    stale = np.isin(index.ids, np.asarray(change.updated + change.deleted, dtype=np.int64))
+    ids = index.ids[~stale]
+    vectors = index.vectors[~stale]
+    
+    changed_ids = change.inserted + change.updated
+    if changed_ids:
+        with engine.connect() as conn:
+            products = conn.execute(
+                select(models.Product.id, models.Product.name, models.Product.brand,
+                       models.Product.category, models.Product.description)
+                .where(models.Product.id.in_(changed_ids))
+            ).all()
+        if products:
+            ids = np.concatenate([ids, np.asarray([p.id for p in products], dtype=np.int64)])
+            vectors = np.concatenate([vectors, embedder.embed([product_text(p) for p in products])])
+    
+    VectorIndex(ids, vectors, embedder.name, index.centroids).save(path)
+    return VectorIndex.load(path)
+
+_index: Optional[VectorIndex] = None
+_index_mtime: Optional[float] = None
+_checked_at = 0.0
+
+def get_index() -> Optional[VectorIndex]:
+    """
+    The saved index, memory-mapped once per process. meta.json is checked at
+    most every CATALOG_POLL_SECONDS (or after a catalogue change) and the
+    index is reopened when a loader has replaced it.
+    """
+    global _index, _index_mtime, _checked_at
+    if not settings.VECTOR_INDEX_PATH:
+        return None
+    now = time.monotonic()
+    if now - _checked_at < settings.CATALOG_POLL_SECONDS:
+        return _index
+    _checked_at = now
+    try:
+        mtime = os.stat(os.path.join(settings.VECTOR_INDEX_PATH, META_FILE)).st_mtime
+    except FileNotFoundError:
+        mtime = None
+    if mtime != _index_mtime:
+        _index_mtime = mtime
+        _index = VectorIndex.load(settings.VECTOR_INDEX_PATH) if mtime is not None else None
+        if _index is not None and _index.embedder_name != get_embedder().name:
+            logger.warning("Vector index was built with %s; rebuild it to use %s", _index.embedder_name, get_embedder().name)
+            _index = None
+    return _index
+
+def _on_catalog_change(change: catalog_events.CatalogChange):
+    global _checked_at
+    _checked_at = 0.0
+
+catalog_events.subscribe(_on_catalog_change)
+
+def fuse_rankings(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[int]:
+    """Reciprocal rank fusion of ranked id lists, best first"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, product_id in enumerate(ranking):
+            scores[product_id] = scores.get(product_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda product_id: -scores[product_id])
+
+async def hybrid_find_products(db: AsyncSession, parsed: query_parser.ParsedQuery, limit: int = 5) -> List[models.Product]:
+    """
+    Lexical search fused with vector retrieval; the lexical results alone
+    when there is no index or nothing to embed
+    """
+    lexical = await async_crud.find_products(db, parsed, limit=limit * CANDIDATE_FACTOR)
+    index = get_index()
+    query_text = " ".join(parsed.terms + parsed.brands + parsed.categories)
+    if index is None or not parsed.terms:
+        return lexical[:limit]
+    
+    def vector_search():
+        return index.search(get_embedder().embed([query_text])[0], limit * CANDIDATE_FACTOR)
+    
+    # Scoring a large matrix takes milliseconds; keep it off the event loop
+    hits = await asyncio.to_thread(vector_search)
+    # Low similarities are mostly hash collisions or unrelated products
+    hit_ids = [product_id for product_id, score in hits if score >= settings.VECTOR_MIN_SIMILARITY]
+    semantic = await async_crud.get_products_by_ids(db, hit_ids, parsed)
+    
+    by_id = {product.id: product for product in lexical + semantic}
+    fused = fuse_rankings([[p.id for p in lexical], [p.id for p in semantic]])
+    return [by_id[product_id] for product_id in fused[:limit]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the product vector index")
+    parser.add_argument("--path", default=settings.VECTOR_INDEX_PATH)
+    args = parser.parse_args()
+    
+    from backend.database import engine
+    started = time.perf_counter()
+    index = build_index(engine, args.path)
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(index)} products with {index.embedder_name} in {elapsed:.1f}s ({len(index) / max(elapsed, 1e-9):,.0f} products/s)")
+
+if __name__ == "__main__":
+    main()
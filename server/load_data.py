@@ -1,12 +1,241 @@
 #!/usr/bin/env python3
+"""
+Load product CSV files from data/ into the products table.
+
+CSV files are split into byte-range chunks that a process pool parses and
+converts in parallel. Parsed batches go through a bounded queue to a fixed
+set of writer threads, each with its own connection; when the writers fall
+behind the queue fills up and no further chunks are submitted (backpressure).
+
+Usage:
+    python server/load_data.py --workers 8 --writers 4 --batch-size 5000
+"""
 import os
 import csv
+import argparse
+import io
+import queue
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
-import uuid
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from psycopg2.extras import RealDictCursor, execute_values
+import time
+
+# Rows per INSERT statement and per commit
+BATCH_SIZE = 5000
+
+# Size of the byte ranges large files are split into; 0 parses whole files
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Writer connections and parse workers (default: one per core)
+WRITERS = 4
+WORKERS = os.cpu_count() or 1
+
+PRODUCT_FIELDS = ('name', 'description', 'price', 'category', 'brand', 'in_stock')
+
+INSERT_PRODUCTS_SQL = """
+INSERT INTO products (name, description, price, category, brand, in_stock)
+VALUES %s;
+"""
+
+def map_csv_row(row):
+    """
+    Map CSV columns to database columns
+    """
+    return {
+        'name': row.get('name', row.get('product_name', '')),
+        'description': row.get('description', row.get('desc', '')),
+        'price': float(row.get('price', 0)) if row.get('price') else None,
+        'category': row.get('category', row.get('type', '')),
+        'brand': row.get('brand', row.get('manufacturer', '')),
+        'in_stock': row.get('in_stock', 'true').lower() == 'true'
+    }
+
+def insert_product_batch(cursor, products):
+    """
+    Insert a batch of products with multi-row INSERT statements
+    instead of one execute per row
+    """
+    execute_values(
+        cursor,
+        INSERT_PRODUCTS_SQL,
+        products,
+        template="(%(name)s, %(description)s, %(price)s, %(category)s, %(brand)s, %(in_stock)s)",
+        page_size=1000
+    )
+
+def plan_chunks(csv_path, chunk_bytes):
+    """
+    Split a CSV file into (path, header, start, end) byte ranges of the data
+    rows. Chunk boundaries are moved to line starts by the parser, so quoted
+    fields must not contain newlines unless chunk_bytes is 0.
+    """
+    with open(csv_path, 'rb') as file:
+        header = file.readline().decode('utf-8-sig')
+        data_start = file.tell()
+        size = os.fstat(file.fileno()).st_size
+    if chunk_bytes <= 0 or size - data_start <= chunk_bytes:
+        return [(csv_path, header, data_start, size)]
+    return [
+        (csv_path, header, start, min(start + chunk_bytes, size))
+        for start in range(data_start, size, chunk_bytes)
+    ]
+
+def iter_chunk_lines(csv_path, start, end):
+    """
+    Yield the decoded lines that begin inside [start, end); the line that
+    straddles start belongs to the previous chunk
+    """
+    with open(csv_path, 'rb') as file:
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+def parse_chunk(task, batch_size):
+    """
+    Process pool worker: parse one byte range into batches of row tuples
+    ready for execute_values. Returns (batches, rows, skipped).
+    """
+    csv_path, header, start, end = task
+    fieldnames = next(csv.reader(io.StringIO(header)))
+    batches = []
+    batch = []
+    rows = 0
+    skipped = 0
+    for row in csv.DictReader(iter_chunk_lines(csv_path, start, end), fieldnames=fieldnames):
+        try:
+            product = map_csv_row(row)
+        except (ValueError, AttributeError):
+            # Bad numbers, and short rows whose missing fields are None
+            skipped += 1
+            continue
+        batch.append(tuple(product[f] for f in PRODUCT_FIELDS))
+        rows += 1
+        if len(batch) >= batch_size:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches, rows, skipped
 
-def load_csv_to_products():
+def put_batch(batches, item, stop):
+    """
+    Queue an item for the writers unless the run was aborted; False once
+    stop is set, so a failed writer cannot leave the producer blocked on a
+    full queue
+    """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def run_writer(database_url, batches, committed, errors, stop):
+    """
+    Writer thread: insert batches from the queue on its own connection, one
+    commit per batch, until it receives None. The first failure, including
+    failing to connect, is recorded and sets stop so the whole run aborts.
+    """
+    conn = None
+    try:
+        conn = psycopg2.connect(database_url)
+        cursor = conn.cursor()
+        while not stop.is_set():
+            try:
+                batch = batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch is None:
+                return
+            execute_values(
+                cursor,
+                INSERT_PRODUCTS_SQL,
+                batch,
+                page_size=1000
+            )
+            conn.commit()
+            committed.append(len(batch))
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+    finally:
+        if conn is not None:
+            conn.close()
+
+def ingest_csv_files(database_url, csv_paths, workers=WORKERS, writers=WRITERS, batch_size=BATCH_SIZE, chunk_bytes=CHUNK_BYTES):
+    """
+    Parse CSV files in a process pool and insert them through a bounded pool
+    of writer connections. Returns (rows committed, rows skipped, seconds).
+    A writer or parse failure aborts the run; batches committed before it stay.
+    """
+    tasks = [chunk for path in csv_paths for chunk in plan_chunks(path, chunk_bytes)]
+    # At most two batches per writer wait in memory, and at most two parsed
+    # chunks per worker are outstanding, so a slow database throttles parsing
+    batches = queue.Queue(maxsize=writers * 2)
+    committed = []
+    errors = []
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=run_writer, args=(database_url, batches, committed, errors, stop), daemon=True)
+        for _ in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    
+    started = time.perf_counter()
+    skipped = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            remaining = iter(tasks)
+            try:
+                while not stop.is_set():
+                    while len(pending) < workers * 2:
+                        task = next(remaining, None)
+                        if task is None:
+                            break
+                        pending.add(pool.submit(parse_chunk, task, batch_size))
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        chunk_batches, _, chunk_skipped = future.result()
+                        for batch in chunk_batches:
+                            if not put_batch(batches, batch, stop):
+                                break
+                        skipped += chunk_skipped
+            except BaseException:
+                # A failed parse aborts the run like a failed writer, before
+                # the pool waits for the chunks still being parsed
+                stop.set()
+                raise
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        for _ in threads:
+            put_batch(batches, None, stop)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise RuntimeError(f"Writer failed after {sum(committed)} rows were committed: {errors[0]}") from errors[0]
+    return sum(committed), skipped, time.perf_counter() - started
+
+def load_csv_to_products(workers=WORKERS, writers=WRITERS, batch_size=BATCH_SIZE, chunk_bytes=CHUNK_BYTES, data_dir=None):
     """
     Load data from CSV files to the products table.
     This script expects CSV files in a 'data' directory with product information.
@@ -39,7 +268,8 @@ def load_csv_to_products():
         cursor.execute(create_table_sql)
         
         # Look for CSV files in data directory
-        data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+        if data_dir is None:
+            data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
         csv_files = []
         
         if os.path.exists(data_dir):
@@ -131,76 +361,24 @@ def load_csv_to_products():
                 }
             ]
             
-            # Insert sample products
-            for product in sample_products:
-                insert_sql = """
-                INSERT INTO products (name, description, price, category, brand, in_stock)
-                VALUES (%(name)s, %(description)s, %(price)s, %(category)s, %(brand)s, %(in_stock)s);
-                """
-                try:
-                    cursor.execute(insert_sql, product)
-                except Exception as e:
-                    if "duplicate key" not in str(e).lower():
-                        raise e
+            # Insert sample products in one round trip
+            insert_product_batch(cursor, sample_products)
             
             conn.commit()
             print(f"Inserted {len(sample_products)} sample products")
         
         else:
-            # Process CSV files
-            total_inserted = 0
-            for csv_file in csv_files:
-                csv_path = os.path.join(data_dir, csv_file)
-                print(f"Processing {csv_file}...")
-                
-                with open(csv_path, 'r', encoding='utf-8') as file:
-                    csv_reader = csv.DictReader(file)
-                    batch_size = 100
-                    batch = []
-                    
-                    for row in csv_reader:
-                        # Map CSV columns to database columns
-                        product = {
-                            'name': row.get('name', row.get('product_name', '')),
-                            'description': row.get('description', row.get('desc', '')),
-                            'price': float(row.get('price', 0)) if row.get('price') else None,
-                            'category': row.get('category', row.get('type', '')),
-                            'brand': row.get('brand', row.get('manufacturer', '')),
-                            'in_stock': row.get('in_stock', 'true').lower() == 'true'
-                        }
-                        
-                        batch.append(product)
-                        
-                        if len(batch) >= batch_size:
-                            # Insert batch
-                            insert_sql = """
-                            INSERT INTO products (name, description, price, category, brand, in_stock)
-                            VALUES (%(name)s, %(description)s, %(price)s, %(category)s, %(brand)s, %(in_stock)s);
-                            """
-                            for product in batch:
-                                try:
-                                    cursor.execute(insert_sql, product)
-                                except Exception as e:
-                                    if "duplicate key" not in str(e).lower():
-                                        raise e
-                            conn.commit()
-                            total_inserted += len(batch)
-                            batch = []
-                    
-                    # Insert remaining items
-                    if batch:
-                        for product in batch:
-                            try:
-                                cursor.execute(insert_sql, product)
-                            except Exception as e:
-                                if "duplicate key" not in str(e).lower():
-                                    raise e
-                        conn.commit()
-                        total_inserted += len(batch)
-                
-                print(f"Processed {csv_file}")
-            
-            print(f"Total products inserted: {total_inserted}")
+            # Schema setup must be visible to the writer connections
+            conn.commit()
+            csv_paths = [os.path.join(data_dir, f) for f in sorted(csv_files)]
+            print(f"Processing {len(csv_paths)} CSV files with {workers} parse workers and {writers} writers...")
+            total_inserted, total_skipped, elapsed = ingest_csv_files(
+                database_url, csv_paths, workers, writers, batch_size, chunk_bytes
+            )
+            print(
+                f"Total products inserted: {total_inserted} in {elapsed:.2f}s "
+                f"({total_inserted / max(elapsed, 1e-9):,.0f} rows/s, {total_skipped} rows skipped)"
+            )
         
         # Get final count
         cursor.execute("SELECT COUNT(*) FROM products;")
@@ -210,7 +388,7 @@ def load_csv_to_products():
         cursor.close()
         conn.close()
         print("Database loading completed successfully!")
-        
+    
     except Exception as e:
         print(f"Error loading data: {e}")
         if 'conn' in locals():
@@ -218,5 +396,22 @@ def load_csv_to_products():
             cursor.close()
             conn.close()
 
+def main():
+    parser = argparse.ArgumentParser(description="Load product CSV files into the products table")
+    parser.add_argument("--data-dir", help="Directory of CSV files (default: ../data)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Parse processes")
+    parser.add_argument("--writers", type=int, default=WRITERS, help="Writer connections")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per INSERT and commit")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / (1024 * 1024),
+                        help="Split files into byte ranges of this size; 0 parses whole files")
+    args = parser.parse_args()
+    load_csv_to_products(
+        workers=args.workers,
+        writers=args.writers,
+        batch_size=args.batch_size,
+        chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+        data_dir=args.data_dir
+    )
+
 if __name__ == "__main__":
-    load_csv_to_products()
+    main()